@@ -25,7 +25,8 @@ config.set_main_option('sqlalchemy.url', db_url)
 fileConfig(config.config_file_name)
 
 # for 'autogenerate' support
-from hera_mc import mc  # noqa
+from hera_mc import mc, _load_table_modules  # noqa
+_load_table_modules()
 target_metadata = mc.MCDeclarativeBase.metadata
 
 
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Compare insertion rates of the per-object add_* methods against the
+add_*_bulk methods on MCSession.
+
+Runs against the "testing" database in your mc_config.json. All inserts are
+rolled back at the end of each trial, so nothing is left in the database.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import numpy as np
+from astropy.time import Time, TimeDelta
+
+from hera_mc import mc
+
+
+def _run_trial(db, func, nrows):
+    conn = db.engine.connect()
+    trans = conn.begin()
+    session = mc.MCSession(bind=conn)
+    try:
+        t0 = time.time()
+        func(session, nrows)
+        session.flush()
+        elapsed = time.time() - t0
+    finally:
+        session.close()
+        trans.rollback()
+        conn.close()
+    return elapsed
+
+
+def _weather_times(nrows):
+    t0 = Time('2018-01-01 00:00:00', scale='utc')
+    return t0 + TimeDelta(np.arange(nrows, dtype=np.float64), format='sec')
+
+
+def per_object_weather(session, nrows):
+    times = _weather_times(nrows)
+    values = np.random.uniform(0, 20, nrows).tolist()
+    for ind in range(nrows):
+        session.add_weather_data(times[ind], 'wind_speed', values[ind])
+
+
+def bulk_weather(session, nrows):
+    times = _weather_times(nrows)
+    values = np.random.uniform(0, 20, nrows)
+    session.add_weather_data_bulk(times, 'wind_speed', values)
+
+
+def per_object_roach(session, nrows):
+    times = _weather_times(nrows)
+    temps = np.random.uniform(20, 60, (5, nrows)).tolist()
+    for ind in range(nrows):
+        session.add_roach_temperature(times[ind], 'pf1', temps[0][ind], temps[1][ind],
+                                      temps[2][ind], temps[3][ind], temps[4][ind])
+
+
+def bulk_roach(session, nrows):
+    times = _weather_times(nrows)
+    temps = np.random.uniform(20, 60, (5, nrows))
+    session.add_roach_temperature_bulk(times, 'pf1', *temps)
+
+
+trials = [('weather_data', per_object_weather, bulk_weather),
+          ('roach_temperature', per_object_roach, bulk_roach)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--nrows', type=int, default=5000,
+                        help='Number of rows to insert per trial.')
+    args = parser.parse_args()
+
+    db = mc.connect_to_mc_testing_db()
+    db.create_tables()
+
+    print('{:<20s} {:>16s} {:>16s} {:>8s}'.format('table', 'per-object rows/s',
+                                                  'bulk rows/s', 'speedup'))
+    for name, per_object, bulk in trials:
+        t_obj = _run_trial(db, per_object, args.nrows)
+        t_bulk = _run_trial(db, bulk, args.nrows)
+        print('{:<20s} {:>16.0f} {:>16.0f} {:>8.1f}'.format(
+            name, args.nrows / t_obj, args.nrows / t_bulk, t_obj / t_bulk))
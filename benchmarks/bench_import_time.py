@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Measure the time to import hera_mc and hera_mc.mc using `python -X importtime`.
+
+Each import is run in a fresh interpreter several times and the median total
+import time (less the interpreter's own startup imports) is reported, along
+with the time spent importing the heavy third-party packages it pulls in.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import subprocess
+import sys
+
+import numpy as np
+
+
+def import_times(statement):
+    """
+    Run an import statement in a fresh interpreter with `-X importtime`.
+
+    Returns a dict of cumulative import times in microseconds keyed by module
+    name, plus the total of all the top level imports under the key None.
+    """
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', statement],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('{0} failed:\n{1}'.format(statement, stderr))
+
+    times = {None: 0}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented, only keep the outermost time for each name
+        times.setdefault(name.strip(), int(cumulative))
+        if not name.startswith('  '):
+            times[None] += int(cumulative)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntrials', type=int, default=5,
+                        help='Number of fresh interpreters to time each import in.')
+    parser.add_argument('modules', nargs='*', default=['hera_mc', 'hera_mc.mc'],
+                        help='Modules to time.')
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        raise RuntimeError('-X importtime requires python 3.7 or later')
+
+    heavy = ['numpy', 'astropy', 'pandas', 'tornado', 'sqlalchemy']
+    print('{:<12s} {:>10s}   {}'.format('module', 'median ms', 'heavy dependencies (ms)'))
+    startup = np.median([import_times('pass')[None] for _ in range(args.ntrials)])
+    for module in args.modules:
+        trials = [import_times('import ' + module) for _ in range(args.ntrials)]
+        total = (np.median([trial[None] for trial in trials]) - startup) / 1e3
+        deps = ['{0} {1:.0f}'.format(name, np.median([trial[name] for trial in trials]) / 1e3)
+                for name in heavy if name in trials[0]]
+        print('{:<12s} {:>10.1f}   {}'.format(module, total, ', '.join(deps)))
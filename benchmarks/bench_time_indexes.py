@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Time the time-range queries on the telemetry tables with and without the
+time indexes.
+
+Fills a scratch database (a temporary SQLite file by default, or the database
+at --url, which must be empty and will have all M&C tables dropped at the end)
+with a few days of synthetic data, times the MCSession getters for short time
+windows, then creates the indexes and times them again.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from astropy.time import Time, TimeDelta
+from sqlalchemy import create_engine
+
+import hera_mc
+from hera_mc import MCDeclarativeBase, mc
+
+hera_mc._load_table_modules()
+
+t0 = Time('2018-01-01 00:00:00', scale='utc')
+gps0 = int(np.floor(t0.gps))
+
+
+def _insert(conn, table_name, rows):
+    table = MCDeclarativeBase.metadata.tables[table_name]
+    for start in range(0, len(rows), 10000):
+        conn.execute(table.insert(), rows[start:start + 10000])
+
+
+def fill(conn, nrows):
+    """Add about nrows rows to each of the benchmarked tables."""
+    # one observation every 10 minutes
+    nobs = max(nrows // 1000, 1)
+    obsids = gps0 + 600 * np.arange(nobs)
+    _insert(conn, 'hera_obs', [{'obsid': int(obsid), 'starttime': t0.mjd, 'stoptime': t0.mjd,
+                                'jd_start': t0.jd, 'lst_start_hr': 0.}
+                               for obsid in obsids])
+    span = int(obsids[-1] - obsids[0]) + 600
+
+    metrics = ['metric{0}'.format(ind) for ind in range(10)]
+    _insert(conn, 'metric_list', [{'metric': metric, 'desc': 'benchmark metric'}
+                                  for metric in metrics])
+    rows = []
+    for obsid in obsids:
+        for metric in metrics:
+            for ant in range(50):
+                rows.append({'obsid': int(obsid), 'ant': ant, 'pol': 'x', 'metric': metric,
+                             'mc_time': int(obsid), 'val': 1.})
+    _insert(conn, 'ant_metrics', rows[:nrows])
+
+    times = np.sort(gps0 + np.random.randint(0, span, nrows)).tolist()
+    # ids are given explicitly because SQLite does not autoincrement BigIntegers
+    _insert(conn, 'subsystem_error', [{'id': ind, 'time': t, 'subsystem': 'rtp',
+                                       'mc_time': t, 'severity': 1, 'log': 'benchmark'}
+                                      for ind, t in enumerate(times)])
+    _insert(conn, 'lib_raid_errors', [{'id': ind, 'time': t,
+                                       'hostname': 'raid{0}'.format(t % 4),
+                                       'disk': 'A', 'log': 'benchmark'}
+                                      for ind, t in enumerate(times)])
+
+    # 100 hosts reporting once a minute
+    hosts = ['host{0}'.format(ind) for ind in range(100)]
+    rows = [{'hostname': host, 'mc_time': gps0 + 60 * ind, 'ip_address': '0.0.0.0',
+             'mc_system_timediff': 0., 'num_cores': 16, 'cpu_load_pct': 1.,
+             'uptime_days': 1., 'memory_used_pct': 1., 'memory_size_gb': 1.,
+             'disk_space_pct': 1., 'disk_size_gb': 1.}
+            for ind in range(nrows // len(hosts)) for host in hosts]
+    _insert(conn, 'rtp_server_status', rows)
+
+    # 50 antennas, 2 pols every minute
+    unix0 = t0.unix
+    rows = [{'id': ind, 'time': Time(unix0 + 60 * (ind // 100), format='unix').datetime,
+             'antnum': (ind // 2) % 50, 'polarization': 'xy'[ind % 2],
+             'measurement_type': 0, 'value': 1.}
+            for ind in range(nrows)]
+    _insert(conn, 'autocorrelations', rows)
+
+    return obsids
+
+
+def queries(obsids):
+    """Return (name, function) pairs for queries of a 10 minute window mid-way through the data."""
+    start = Time(int(obsids[len(obsids) // 2]), format='gps')
+    stop = start + TimeDelta(600, format='sec')
+    return [
+        ('subsystem_error', lambda s: s.get_subsystem_error(start, stoptime=stop)),
+        ('lib_raid_errors', lambda s: s.get_lib_raid_error(start, stoptime=stop)),
+        ('rtp_server_status', lambda s: s.get_server_status('rtp', start, stoptime=stop)),
+        ('ant_metrics', lambda s: s.get_ant_metric(metric='metric3', starttime=start,
+                                                   stoptime=stop)),
+        ('autocorrelations', lambda s: s.get_autocorrelations(start, stoptime=stop)),
+    ]
+
+
+def time_queries(engine, query_list, ntrials):
+    results = {}
+    for name, func in query_list:
+        with mc.MCSession(bind=engine) as session:
+            trials = []
+            for _ in range(ntrials):
+                t_start = time.time()
+                func(session)
+                trials.append(time.time() - t_start)
+        results[name] = np.median(trials)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--nrows', type=int, default=200000,
+                        help='Approximate number of rows per table.')
+    parser.add_argument('--ntrials', type=int, default=5,
+                        help='Number of times to run each query.')
+    parser.add_argument('--url', type=str, default=None,
+                        help='URL of an empty scratch database to use.')
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.url is None:
+        temp_dir = tempfile.mkdtemp()
+        args.url = 'sqlite:///' + os.path.join(temp_dir, 'bench_time_indexes.db')
+
+    engine = create_engine(args.url)
+    indexes = [index for table in MCDeclarativeBase.metadata.sorted_tables
+               for index in table.indexes]
+    try:
+        MCDeclarativeBase.metadata.create_all(engine)
+        for index in indexes:
+            index.drop(engine)
+
+        print('filling database...')
+        with engine.begin() as conn:
+            obsids = fill(conn, args.nrows)
+        query_list = queries(obsids)
+
+        before = time_queries(engine, query_list, args.ntrials)
+        for index in indexes:
+            index.create(engine)
+        after = time_queries(engine, query_list, args.ntrials)
+
+        print('{:<20s} {:>12s} {:>12s} {:>8s}'.format('table', 'no index ms', 'index ms',
+                                                      'speedup'))
+        for name, _ in query_list:
+            print('{:<20s} {:>12.2f} {:>12.2f} {:>8.1f}'.format(
+                name, before[name] * 1e3, after[name] * 1e3, before[name] / after[name]))
+    finally:
+        MCDeclarativeBase.metadata.drop_all(engine)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
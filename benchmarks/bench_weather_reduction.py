@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Time weather._reduce_time_vals on 1 Hz sensor data, against a per-bucket
+Python loop like the original implementation.
+
+Does not need a database.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from hera_mc import weather
+
+
+def loop_reduce(times, vals, period, strategy):
+    times_keep, inds = np.unique((times // period) * period, return_index=True)
+    if times_keep[0] < np.min(times):
+        times_keep = times_keep[1:]
+        inds = inds[1:]
+    func = {'max': np.max, 'min': np.min, 'sum': np.sum, 'mean': np.mean,
+            'median': np.median, 'std': np.std}[strategy]
+    vals_keep = []
+    for count in range(len(inds) - 1):
+        vals_keep.append(func(vals[inds[count]:inds[count + 1]]))
+    return times_keep[:-1], np.array(vals_keep)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-d', '--days', type=float, default=30.,
+                        help='Days of 1 Hz data to reduce.')
+    parser.add_argument('-p', '--period', type=int, default=30,
+                        help='Reduction period in seconds.')
+    args = parser.parse_args()
+
+    ntimes = int(args.days * 86400)
+    times = 1.2e9 + np.arange(ntimes) + np.random.uniform(0, 0.5, ntimes)
+    vals = np.random.uniform(0, 20, ntimes)
+
+    print('{0} samples, {1} s period'.format(ntimes, args.period))
+    print('{:<10s} {:>12s} {:>14s} {:>8s}'.format('strategy', 'loop (s)',
+                                                  'vectorized (s)', 'speedup'))
+    for strategy in ['max', 'min', 'sum', 'mean', 'median', 'std']:
+        t0 = time.time()
+        loop_reduce(times, vals, args.period, strategy)
+        t_loop = time.time() - t0
+        t0 = time.time()
+        weather._reduce_time_vals(times, vals, args.period, strategy=strategy)
+        t_vec = time.time() - t0
+        print('{:<10s} {:>12.3f} {:>14.3f} {:>8.1f}'.format(
+            strategy, t_loop, t_vec, t_loop / t_vec))
+
+    # several variables in one pass
+    vals_2d = np.random.uniform(0, 20, (ntimes, 4))
+    t0 = time.time()
+    weather._reduce_time_vals(times, vals_2d, args.period, strategy='mean')
+    print('mean of 4 variables in one pass: {:.3f} s'.format(time.time() - t0))
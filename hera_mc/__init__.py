@@ -4,8 +4,9 @@
 
 from __future__ import absolute_import, division, print_function
 
+import sys
+import importlib
 from types import MethodType
-import numpy as np
 import six
 
 # Before we can do anything else, we need to initialize some core, shared
@@ -32,6 +33,8 @@ class MCDeclarativeBase(object):
         return rep_str
 
     def isclose(self, other):
+        import numpy as np
+
         if not isinstance(other, self.__class__):
             print('not the same class')
             return False
@@ -85,17 +88,53 @@ def NotNull(kind, **kwargs):
 
 
 from .version import __version__  # noqa
-from . import autocorrelations  # noqa
-from . import cm_transfer  # noqa
-from . import part_connect  # noqa
-from . import geo_location  # noqa
-from . import temperatures  # noqa
-from . import observations  # noqa
-from . import subsystem_error  # noqa
-from . import server_status  # noqa
-from . import librarian  # noqa
-from . import rtp  # noqa
-from . import qm  # noqa
-from . import weather  # noqa
-from . import roach  # noqa
-from . import mc    # noqa keep this last.
+
+# The modules defining tables pull in numpy, astropy, pandas, tornado etc., so
+# they are only imported when first accessed as attributes of this package or
+# when a database object or session is created (see _load_table_modules).
+_table_modules = ['autocorrelations', 'cm_transfer', 'part_connect', 'geo_location',
+                  'temperatures', 'observations', 'subsystem_error', 'server_status',
+                  'librarian', 'rtp', 'qm', 'weather', 'roach', 'retention']
+_lazy_submodules = _table_modules + ['mc']
+
+
+def _load_table_modules():
+    """Import all the table modules so their tables are registered with MCDeclarativeBase."""
+    for name in _table_modules:
+        importlib.import_module('.' + name, __name__)
+
+
+# time columns of the tables where they are not called 'time' or 'mc_time'
+table_time_columns = {'ant_metrics': 'obsid', 'array_metrics': 'obsid', 'hera_obs': 'obsid'}
+
+
+def get_table_class(table_name):
+    """Return the class defining the M&C table with a given name."""
+    _load_table_modules()
+    for table_class in MCDeclarativeBase._decl_class_registry.values():
+        if getattr(table_class, '__tablename__', None) == table_name:
+            return table_class
+    raise ValueError('no M&C table named {0!r}'.format(table_name))
+
+
+def get_time_column(table_name):
+    """Return the name of the column holding the time of the M&C table with a given name."""
+    if table_name in table_time_columns:
+        return table_time_columns[table_name]
+    columns = get_table_class(table_name).__table__.columns
+    for name in ['time', 'mc_time']:
+        if name in columns:
+            return name
+    raise ValueError('cannot tell which column of table {0} holds the time'
+                     .format(table_name))
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _lazy_submodules:
+            return importlib.import_module('.' + name, __name__)
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+else:
+    # no module-level __getattr__ (PEP 562), import everything up front.
+    _load_table_modules()
+    from . import mc    # noqa
@@ -0,0 +1,499 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Columnar file archives of the time-filtered M&C tables.
+
+`export_table` streams the rows of a table in a time range out of the
+database and writes them to time-partitioned columnar files: every partition
+(one day by default) is a directory holding one `.npy` file per column, and a
+`manifest.json` for the table lists the columns and partitions. Exports are
+widened to whole partitions, and re-exporting a partition replaces it, so
+archives can be extended incrementally (e.g. nightly).
+
+`ArchiveReader` reads the files back with numpy memory-mapping, applying the
+same time and key filters as MCSession._time_filter, so offline analysis
+does not need the live database and only touches the parts of the files it
+needs.
+
+Columns are stored as:
+
+- float64 for float columns and for nullable integer columns (NaN for nulls),
+- int64 for non-nullable integer columns,
+- datetime64[us] for DateTime columns (NaT for nulls),
+- int32 codes into a list of the distinct values in the partition, kept in
+  `<column>.categories.json`, for all other columns (e.g. strings). They are
+  decoded to object arrays when read. Values that are not strings, numbers
+  or nulls are stored as strings.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import shutil
+from math import floor
+
+import numpy as np
+from astropy.time import Time
+from sqlalchemy import DateTime
+
+from . import get_table_class, get_time_column
+
+default_partition_seconds = 86400
+
+manifest_name = 'manifest.json'
+
+
+def _column_storage(col):
+    """Return the encoding ('plain' or 'dictionary') and dtype used to store a column."""
+    try:
+        python_type = col.type.python_type
+    except NotImplementedError:
+        python_type = None
+
+    if python_type is float:
+        return 'plain', 'float64'
+    if python_type is int:
+        return 'plain', 'float64' if col.nullable else 'int64'
+    if python_type is bool and not col.nullable:
+        return 'plain', 'bool'
+    if isinstance(col.type, DateTime):
+        return 'plain', 'datetime64[us]'
+    return 'dictionary', 'int32'
+
+
+def _to_plain(values, dtype):
+    """Convert a column of a chunk (possibly an object array with Nones) to dtype."""
+    if values.dtype != object:
+        return values.astype(dtype, copy=False)
+    if dtype == 'datetime64[us]':
+        null = np.datetime64('NaT')
+    else:
+        null = np.nan
+    return np.array([null if val is None else val for val in values], dtype=dtype)
+
+
+def _to_gps(value, time_type):
+    """Convert a stored time value to gps seconds."""
+    if time_type == 'datetime':
+        return Time(value.astype('datetime64[us]').item(), scale='utc').gps
+    return float(value)
+
+
+def _bucket_start(value, time_type, partition_seconds):
+    """Start of the partition holding a stored time value (gps or unix seconds)."""
+    if time_type == 'datetime':
+        value = value.astype('datetime64[s]').astype(np.int64)
+    return int(floor(value / partition_seconds) * partition_seconds)
+
+
+def _unique_in_order(values):
+    seen = set()
+    for val in values:
+        if val not in seen:
+            seen.add(val)
+            yield val
+
+
+class _PartitionWriter(object):
+    """Write the rows of one partition column by column, a chunk at a time."""
+
+    def __init__(self, table_dir, name, storage):
+        self.name = name
+        self.final_dir = os.path.join(table_dir, name)
+        self.temp_dir = os.path.join(table_dir, '.' + name + '.tmp')
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+        os.makedirs(self.temp_dir)
+        self.storage = storage
+        self.raw_files = dict((col_name, open(os.path.join(self.temp_dir, col_name + '.raw'),
+                                              'wb'))
+                              for col_name in storage)
+        self.categories = dict((col_name, {}) for col_name, (encoding, _) in storage.items()
+                               if encoding == 'dictionary')
+        self.nrows = 0
+        self.min_time = None
+        self.max_time = None
+
+    def append(self, arrays, time_values):
+        for col_name, (encoding, dtype) in self.storage.items():
+            values = arrays[col_name]
+            if encoding == 'dictionary':
+                codes = self.categories[col_name]
+                values = values.tolist()
+                for val in _unique_in_order(values):
+                    codes.setdefault(val, len(codes))
+                stored = np.fromiter((codes[val] for val in values), dtype=dtype,
+                                     count=len(values))
+            else:
+                stored = _to_plain(values, dtype)
+            self.raw_files[col_name].write(np.ascontiguousarray(stored).tobytes())
+
+        if self.min_time is None:
+            self.min_time = time_values[0]
+        self.max_time = time_values[-1]
+        self.nrows += len(time_values)
+
+    def finish(self, time_type):
+        for col_name, raw_file in self.raw_files.items():
+            raw_file.close()
+            dtype = np.dtype(self.storage[col_name][1])
+            raw_path = raw_file.name
+            with open(os.path.join(self.temp_dir, col_name + '.npy'), 'wb') as npy_file:
+                np.lib.format.write_array_header_1_0(
+                    npy_file, {'descr': np.lib.format.dtype_to_descr(dtype),
+                               'fortran_order': False, 'shape': (self.nrows,)})
+                with open(raw_path, 'rb') as raw:
+                    shutil.copyfileobj(raw, npy_file)
+            os.remove(raw_path)
+
+        for col_name, codes in self.categories.items():
+            values = sorted(codes, key=codes.get)
+            values = [val if val is None or isinstance(val, (int, float, bool))
+                      else str(val) for val in values]
+            with open(os.path.join(self.temp_dir, col_name + '.categories.json'), 'w') as f:
+                json.dump(values, f)
+
+        if os.path.exists(self.final_dir):
+            shutil.rmtree(self.final_dir)
+        os.rename(self.temp_dir, self.final_dir)
+
+        return {'name': self.name, 'nrows': self.nrows,
+                'min_time': _to_gps(self.min_time, time_type),
+                'max_time': _to_gps(self.max_time, time_type)}
+
+
+def _write_manifest(table_dir, manifest):
+    temp_path = os.path.join(table_dir, '.' + manifest_name + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(temp_path, os.path.join(table_dir, manifest_name))
+
+
+def _read_manifest(table_dir):
+    path = os.path.join(table_dir, manifest_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def export_table(session, table_name, archive_dir, starttime, stoptime=None,
+                 time_column=None, partition_seconds=default_partition_seconds,
+                 chunk_size=10000):
+    """
+    Export the rows of a table in a time range to a columnar archive.
+
+    Rows are streamed from the database (see MCSession._iter_time_filter),
+    so memory use does not depend on the size of the time range. The range
+    is widened to whole partitions. Partitions that are already in the
+    archive are replaced, and removed if they no longer have any rows.
+
+    Parameters:
+    ------------
+    session: MCSession object
+    table_name: string
+        name of the table to export, e.g. 'weather_data'.
+    archive_dir: string
+        directory of the archive. The table is written to a subdirectory
+        named after it.
+    starttime: astropy time object
+        export rows after this time.
+    stoptime: astropy time object
+        export rows up to this time. If None, export all rows after starttime.
+    time_column: string
+        column holding the time. Defaults to the one given by
+        hera_mc.get_time_column.
+    partition_seconds: integer
+        length of the partitions in seconds (in gps seconds, or in unix
+        seconds for tables with DateTime time columns).
+    chunk_size: integer
+        number of rows read from the database at a time.
+
+    Returns:
+    --------
+    list of dicts describing the partitions written, with keys name, nrows,
+    min_time and max_time (in gps seconds)
+    """
+    table_class = get_table_class(table_name)
+    table = table_class.__table__
+    if time_column is None:
+        time_column = get_time_column(table_name)
+    if not isinstance(starttime, Time):
+        raise ValueError('starttime must be an astropy time object. '
+                         'value was: {t}'.format(t=starttime))
+    if stoptime is not None and not isinstance(stoptime, Time):
+        raise ValueError('stoptime must be an astropy time object. '
+                         'value was: {t}'.format(t=stoptime))
+
+    if isinstance(table.columns[time_column].type, DateTime):
+        time_type = 'datetime'
+        start = floor(starttime.unix / partition_seconds) * partition_seconds
+        starttime = Time(start, format='unix')
+        if stoptime is not None:
+            stop = (floor(stoptime.unix / partition_seconds) + 1) * partition_seconds
+            stoptime = Time(stop - 1e-6, format='unix')
+    else:
+        time_type = 'gps'
+        start = floor(starttime.gps / partition_seconds) * partition_seconds
+        starttime = Time(start, format='gps')
+        if stoptime is not None:
+            stop = (floor(stoptime.gps / partition_seconds) + 1) * partition_seconds
+            stoptime = Time(stop - 1, format='gps')
+
+    storage = dict((col.name, _column_storage(col)) for col in table.columns)
+    columns = [{'name': col.name, 'encoding': storage[col.name][0],
+                'dtype': storage[col.name][1]} for col in table.columns]
+
+    table_dir = os.path.join(archive_dir, table_name)
+    manifest = _read_manifest(table_dir)
+    if manifest is None:
+        manifest = {'table': table_name, 'time_column': time_column,
+                    'time_type': time_type, 'partition_seconds': partition_seconds,
+                    'columns': columns, 'partitions': []}
+    elif (manifest['time_column'] != time_column or manifest['columns'] != columns
+          or manifest['partition_seconds'] != partition_seconds):
+        raise ValueError('the archive of table {0} in {1} has different columns or '
+                         'partitions'.format(table_name, archive_dir))
+    if not os.path.exists(table_dir):
+        os.makedirs(table_dir)
+
+    written = []
+    writer = None
+    for arrays in session._iter_time_filter(table_class, time_column, starttime,
+                                            stoptime=stoptime, chunk_size=chunk_size,
+                                            as_arrays=True):
+        time_values = arrays[time_column]
+        buckets = np.array([_bucket_start(val, time_type, partition_seconds)
+                            for val in time_values[[0, -1]]])
+        if buckets[0] == buckets[1]:
+            splits = [(buckets[0], 0, len(time_values))]
+        else:
+            if time_type == 'datetime':
+                seconds = time_values.astype('datetime64[s]').astype(np.int64)
+            else:
+                seconds = time_values
+            all_buckets = (np.floor(seconds / partition_seconds).astype(np.int64)
+                           * partition_seconds)
+            edges = np.flatnonzero(np.diff(all_buckets)) + 1
+            bounds = np.concatenate(([0], edges, [len(time_values)]))
+            splits = [(all_buckets[lo], lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+        for bucket, lo, hi in splits:
+            name = str(int(bucket))
+            if writer is not None and writer.name != name:
+                written.append(writer.finish(time_type))
+                writer = None
+            if writer is None:
+                writer = _PartitionWriter(table_dir, name, storage)
+            writer.append(dict((key, val[lo:hi]) for key, val in arrays.items()),
+                          time_values[lo:hi])
+    if writer is not None:
+        written.append(writer.finish(time_type))
+
+    # every partition in the exported range was just written or has no rows now
+    new_names = set(part['name'] for part in written)
+    partitions = []
+    removed = []
+    for part in manifest['partitions']:
+        if part['name'] in new_names:
+            continue
+        if int(part['name']) >= start and (stoptime is None or int(part['name']) < stop):
+            removed.append(part['name'])
+        else:
+            partitions.append(part)
+    manifest['partitions'] = sorted(partitions + written, key=lambda part: int(part['name']))
+    _write_manifest(table_dir, manifest)
+    for name in removed:
+        shutil.rmtree(os.path.join(table_dir, name), ignore_errors=True)
+
+    return written
+
+
+class ArchiveReader(object):
+    """
+    Read a table archived by export_table, using memory-mapped files.
+
+    Parameters:
+    ------------
+    archive_dir: string
+        directory of the archive (as given to export_table).
+    table_name: string
+        name of the archived table.
+    """
+
+    def __init__(self, archive_dir, table_name):
+        self.table_dir = os.path.join(archive_dir, table_name)
+        manifest = _read_manifest(self.table_dir)
+        if manifest is None:
+            raise ValueError('no archive of table {0} in {1}'.format(table_name, archive_dir))
+        self.table_name = table_name
+        self.time_column = manifest['time_column']
+        self.time_type = manifest['time_type']
+        self.columns = [col['name'] for col in manifest['columns']]
+        self._storage = dict((col['name'], (col['encoding'], col['dtype']))
+                             for col in manifest['columns'])
+        self.partitions = manifest['partitions']
+
+    def _time_value(self, t):
+        if self.time_type == 'datetime':
+            return np.datetime64(t.utc.datetime, 'us')
+        return t.gps
+
+    def _load(self, partition, col_name):
+        return np.load(os.path.join(self.table_dir, partition['name'], col_name + '.npy'),
+                       mmap_mode='r')
+
+    def _categories(self, partition, col_name):
+        with open(os.path.join(self.table_dir, partition['name'],
+                               col_name + '.categories.json')) as f:
+            return json.load(f)
+
+    def _empty(self, columns):
+        arrays = {}
+        for col_name in columns:
+            encoding, dtype = self._storage[col_name]
+            arrays[col_name] = np.array([], dtype=object if encoding == 'dictionary'
+                                        else dtype)
+        return arrays
+
+    def iter_partitions(self, starttime, stoptime=None, filter_column=None,
+                        filter_value=None, columns=None):
+        """
+        Read the archived rows in a time range one partition at a time.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+        stoptime: astropy time object
+            last time to get records for. If None, all records after
+            starttime are included.
+        filter_column: string
+            column name to use as an additional filter (often a part of the primary key)
+        filter_value: type corresponding to filter_column, usually a string
+            value to require that the filter_column is equal to
+        columns: list of strings
+            column names to return. Defaults to all columns.
+
+        Yields:
+        --------
+        dicts of numpy arrays keyed by column name, ordered by time. When no
+        filter_value is given, the arrays of plain columns are read-only
+        views of the memory-mapped files.
+        """
+        if not isinstance(starttime, Time):
+            raise ValueError('starttime must be an astropy time object. '
+                             'value was: {t}'.format(t=starttime))
+        if stoptime is not None and not isinstance(stoptime, Time):
+            raise ValueError('stoptime must be an astropy time object. '
+                             'value was: {t}'.format(t=stoptime))
+        if columns is None:
+            columns = self.columns
+        else:
+            columns = list(columns)
+        for col_name in columns + ([] if filter_column is None else [filter_column]):
+            if col_name not in self._storage:
+                raise ValueError('no column {0!r} in the archive of {1}'
+                                 .format(col_name, self.table_name))
+
+        start_gps = starttime.gps
+        stop_gps = None if stoptime is None else stoptime.gps
+        start_value = self._time_value(starttime)
+        stop_value = None if stoptime is None else self._time_value(stoptime)
+
+        for partition in self.partitions:
+            if partition['nrows'] == 0 or partition['max_time'] < start_gps - 1:
+                continue
+            if stop_gps is not None and partition['min_time'] > stop_gps + 1:
+                break
+
+            # rows are sorted by time, so only the needed range is read
+            times = self._load(partition, self.time_column)
+            lo = np.searchsorted(times, start_value, side='left')
+            if stop_value is None:
+                hi = len(times)
+            else:
+                hi = np.searchsorted(times, stop_value, side='right')
+            if hi <= lo:
+                continue
+
+            index = slice(lo, hi)
+            if filter_value is not None:
+                filter_values = self._load(partition, filter_column)[lo:hi]
+                if self._storage[filter_column][0] == 'dictionary':
+                    categories = self._categories(partition, filter_column)
+                    if filter_value not in categories:
+                        continue
+                    mask = filter_values == categories.index(filter_value)
+                else:
+                    mask = filter_values == filter_value
+                index = lo + np.flatnonzero(mask)
+                if len(index) == 0:
+                    continue
+
+            arrays = {}
+            for col_name in columns:
+                values = self._load(partition, col_name)[index]
+                if self._storage[col_name][0] == 'dictionary':
+                    categories = np.array(self._categories(partition, col_name),
+                                          dtype=object)
+                    values = categories[values]
+                arrays[col_name] = values
+            yield arrays
+
+    def read(self, starttime, stoptime=None, filter_column=None, filter_value=None,
+             columns=None):
+        """
+        Read the archived rows in a time range, like MCSession._time_filter
+        with as_arrays=True.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+        stoptime: astropy time object
+            last time to get records for. If None, only the first record after
+            starttime is returned.
+        filter_column: string
+            column name to use as an additional filter (often a part of the primary key)
+        filter_value: type corresponding to filter_column, usually a string
+            value to require that the filter_column is equal to
+        columns: list of strings
+            column names to return. Defaults to all columns.
+
+        Returns:
+        --------
+        dict of numpy arrays keyed by column name, ordered by time
+        """
+        if columns is None:
+            columns = self.columns
+        chunks = []
+        for arrays in self.iter_partitions(starttime, stoptime=stoptime,
+                                           filter_column=filter_column,
+                                           filter_value=filter_value, columns=columns):
+            if stoptime is None:
+                return dict((key, val[:1].copy()) for key, val in arrays.items())
+            chunks.append(arrays)
+
+        if len(chunks) == 0:
+            return self._empty(columns)
+        if len(chunks) == 1:
+            return chunks[0]
+        return dict((col_name, np.concatenate([chunk[col_name] for chunk in chunks]))
+                    for col_name in columns)
+
+
+def read_archive(archive_dir, table_name, starttime, stoptime=None, filter_column=None,
+                 filter_value=None, columns=None):
+    """
+    Read rows of an archived table. See ArchiveReader.read for the parameters.
+
+    Returns:
+    --------
+    dict of numpy arrays keyed by column name, ordered by time
+    """
+    return ArchiveReader(archive_dir, table_name).read(
+        starttime, stoptime=stoptime, filter_column=filter_column,
+        filter_value=filter_value, columns=columns)
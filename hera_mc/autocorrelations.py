@@ -13,17 +13,23 @@ from __future__ import absolute_import, division, print_function
 from argparse import Namespace
 import datetime
 import numpy as np
+import zlib
 from sqlalchemy import (BigInteger, Column, DateTime, Float, Integer,
-                        SmallInteger, String)
+                        LargeBinary, SmallInteger, String)
 
-from . import MCDeclarativeBase, NotNull
+from . import MCDeclarativeBase, NotNull, logger
+
+# host of the Redis server the correlator software logs the spectra to
+redis_host = 'redishost'
+
+# antennas to read autocorrelations for
+default_antnums = range(128)
 
 
 class _MeasurementTypes(object):
     """A read-only enumeration of different ways we can measure the
     autocorrelation power, since each autocorrelation measurement is a
-    spectrum. For now we only have one type, but in the future we might add
-    min/max/rms, different sub-windows of the spectra, etc.
+    spectrum.
 
     These values are logged into the M&C database. Once a certain value is
     created, never remove or change it!
@@ -32,9 +38,37 @@ class _MeasurementTypes(object):
     median = 0
     "The median value across the whole autocorrelation spectrum."
 
-    names = ['median']
+    mean = 1
+    "The mean value across the whole autocorrelation spectrum."
+
+    rms = 2
+    "The root mean square value across the whole autocorrelation spectrum."
+
+    min = 3
+    "The minimum value across the whole autocorrelation spectrum."
+
+    max = 4
+    "The maximum value across the whole autocorrelation spectrum."
+
+    median_band0 = 5
+    "The median value across the first quarter of the channels."
+
+    median_band1 = 6
+    "The median value across the second quarter of the channels."
+
+    median_band2 = 7
+    "The median value across the third quarter of the channels."
+
+    median_band3 = 8
+    "The median value across the last quarter of the channels."
+
+    names = ['median', 'mean', 'rms', 'min', 'max', 'median_band0', 'median_band1',
+             'median_band2', 'median_band3']
     "A list of textual names corresponding to each value."
 
+    n_bands = 4
+    "The number of equal sub-bands the spectra are split into for the median_band types."
+
 
 MeasurementTypes = _MeasurementTypes()
 
@@ -45,11 +79,12 @@ class Autocorrelations(MCDeclarativeBase):
     """
     __tablename__ = 'autocorrelations'
 
-    id = Column(BigInteger, primary_key=True)
+    # plain Integer on SQLite so ids autoincrement there as on PostgreSQL
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
     "A unique ID number for each record; no intrinsic meaning."
 
-    time = NotNull(DateTime)
-    "The time when the information was generated; stored as SqlAlchemy UTC DateTime."
+    time = NotNull(DateTime, index=True)
+    "The time when the information was generated; stored as SqlAlchemy UTC DateTime. Indexed."
 
     antnum = NotNull(Integer)
     "The internal antenna number to which this record pertains."
@@ -74,6 +109,288 @@ class Autocorrelations(MCDeclarativeBase):
                'value={self.value}>').format(self=self)
 
 
+# dtypes and codecs the spectra in the autocorrelation_spectra table can be stored with
+spectrum_dtypes = ('float16', 'float32')
+spectrum_codecs = ('none', 'zlib')
+
+
+class AutocorrelationSpectra(MCDeclarativeBase):
+    """A table logging decimated antenna autocorrelation spectra.
+
+    Each spectrum is stored as a binary blob of little-endian floats, so a
+    whole spectrum costs one row rather than one row per channel.
+
+    """
+    __tablename__ = 'autocorrelation_spectra'
+
+    time = Column(DateTime, primary_key=True)
+    "The time when the information was generated; stored as SqlAlchemy UTC DateTime."
+
+    antnum = Column(Integer, primary_key=True)
+    "The internal antenna number to which this record pertains."
+
+    polarization = Column(String(1), primary_key=True)
+    """Which polarization this record refers to: "x" or "y"."""
+
+    decimation = NotNull(Integer)
+    "The number of adjacent channels of the original spectrum averaged into each stored channel."
+
+    n_channels = NotNull(Integer)
+    "The number of channels stored."
+
+    dtype = NotNull(String(8))
+    "The type of the stored values, one of spectrum_dtypes."
+
+    codec = NotNull(String(8))
+    "How the values are compressed, one of spectrum_codecs."
+
+    spectrum = NotNull(LargeBinary)
+    "The encoded spectrum."
+
+    def get_spectrum(self):
+        """Decode the stored spectrum, returns a numpy array."""
+        return decode_spectrum(self.spectrum, self.dtype, self.codec)
+
+    def __repr__(self):
+        return ('<AutocorrelationSpectra time={self.time} antnum={self.antnum} '
+                'polarization={self.polarization} decimation={self.decimation} '
+                'n_channels={self.n_channels} dtype={self.dtype} '
+                'codec={self.codec}>').format(self=self)
+
+
+def decimate_spectra(spectra, decimation):
+    """
+    Average groups of adjacent channels of spectra. Channels left over at the
+    end that do not fill a group are dropped.
+
+    Parameters:
+    ------------
+    spectra: numpy array
+        spectra with the channels along the last axis.
+    decimation: integer
+        number of channels to average together.
+
+    Returns:
+    --------
+    numpy array of the decimated spectra
+    """
+    spectra = np.asarray(spectra)
+    n_channels = spectra.shape[-1] // decimation
+    if n_channels == 0:
+        raise ValueError('decimation is larger than the number of channels')
+    grouped = spectra[..., :n_channels * decimation].reshape(
+        spectra.shape[:-1] + (n_channels, decimation))
+    return grouped.mean(axis=-1, dtype=np.float64)
+
+
+def encode_spectrum(spectrum, dtype='float32', codec='zlib'):
+    """
+    Encode a spectrum for the autocorrelation_spectra table.
+
+    Parameters:
+    ------------
+    spectrum: 1-D numpy array
+        values to encode.
+    dtype: string
+        type to store the values as, one of spectrum_dtypes. float16 halves
+        the size but only holds values up to 65504 (to ~3 significant digits).
+    codec: string
+        compression to use, one of spectrum_codecs.
+
+    Returns:
+    --------
+    encoded bytes
+    """
+    if dtype not in spectrum_dtypes:
+        raise ValueError('dtype must be one of {0}'.format(spectrum_dtypes))
+    if codec not in spectrum_codecs:
+        raise ValueError('codec must be one of {0}'.format(spectrum_codecs))
+    data = np.ascontiguousarray(spectrum, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    if codec == 'zlib':
+        data = zlib.compress(data)
+    return data
+
+
+def decode_spectrum(data, dtype, codec):
+    """
+    Decode a spectrum from the autocorrelation_spectra table. Uncompressed
+    ('none' codec) spectra are read without copying, so the returned array is
+    read-only. zlib spectra are decompressed into a new buffer first.
+
+    Parameters:
+    ------------
+    data: bytes
+        encoded spectrum.
+    dtype: string
+        type the values are stored as, one of spectrum_dtypes.
+    codec: string
+        compression used, one of spectrum_codecs.
+
+    Returns:
+    --------
+    1-D numpy array
+    """
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec != 'none':
+        raise ValueError('codec must be one of {0}'.format(spectrum_codecs))
+    return np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder('<'))
+
+
+def read_spectra_from_redis(redis_session=None, antnums=None):
+    """
+    Read the autocorrelation spectra from the Redis server, with all the
+    reads sent in one pipelined round trip.
+
+    Parameters:
+    ------------
+    redis_session: redis.Redis object
+        Existing connection to the Redis server to use (without
+        decode_responses, since the spectra are binary). Defaults to
+        connecting to redis_host.
+    antnums: list of integers
+        antennas to read. Defaults to default_antnums.
+
+    Returns:
+    --------
+    list of the (antnum, polarization) pairs read, 2-D float32 numpy array of
+    their spectra (one row per pair), and list of the (antnum, polarization)
+    pairs that could not be read
+    """
+    if redis_session is None:
+        import redis
+
+        redis_session = redis.Redis(redis_host)
+    if antnums is None:
+        antnums = default_antnums
+
+    keys = [(ant, pol) for ant in antnums for pol in 'xy']
+    pipeline = redis_session.pipeline(transaction=False)
+    for ant, pol in keys:
+        pipeline.hgetall('visdata://%d/%d/%s%s' % (ant, ant, pol, pol))
+    try:
+        results = pipeline.execute(raise_on_error=False)
+    except Exception as e:
+        logger.warning('failed to get autocorrelations: %s (%s)', e, e.__class__.__name__)
+        return [], np.zeros((0, 0), dtype=np.float32), keys
+
+    good_keys = []
+    spectra = []
+    failures = []
+    for (ant, pol), data in zip(keys, results):
+        if isinstance(data, Exception):
+            logger.warning('failed to get autocorrelation %d%s: %s (%s)',
+                           ant, pol, data, data.__class__.__name__)
+            failures.append((ant, pol))
+            continue
+
+        data = data.get(b'data', data.get('data'))
+        if data is None:
+            logger.warning('failed to get autocorrelation %d%s: no "data" item?',
+                           ant, pol)
+            failures.append((ant, pol))
+            continue
+
+        spectrum = np.frombuffer(data, dtype=np.float32)
+        if len(spectra) > 0 and len(spectrum) != len(spectra[0]):
+            logger.warning('failed to get autocorrelation %d%s: %d channels instead of %d',
+                           ant, pol, len(spectrum), len(spectra[0]))
+            failures.append((ant, pol))
+            continue
+
+        good_keys.append((ant, pol))
+        spectra.append(spectrum)
+
+    if len(spectra) == 0:
+        return [], np.zeros((0, 0), dtype=np.float32), failures
+    return good_keys, np.stack(spectra), failures
+
+
+def get_statistics(spectra):
+    """
+    Compute all the MeasurementTypes statistics of autocorrelation spectra.
+
+    Parameters:
+    ------------
+    spectra: 2-D numpy array
+        spectra, one per row.
+
+    Returns:
+    --------
+    dict of float64 numpy arrays (one value per spectrum) keyed by measurement type
+    """
+    spectra = np.asarray(spectra)
+    stats = {MeasurementTypes.median: np.median(spectra, axis=1),
+             MeasurementTypes.mean: np.mean(spectra, axis=1, dtype=np.float64),
+             MeasurementTypes.rms: np.sqrt(np.mean(np.square(spectra, dtype=np.float64),
+                                                   axis=1)),
+             MeasurementTypes.min: np.min(spectra, axis=1),
+             MeasurementTypes.max: np.max(spectra, axis=1)}
+    for band, band_spectra in enumerate(np.array_split(spectra, MeasurementTypes.n_bands,
+                                                       axis=1)):
+        stats[MeasurementTypes.median_band0 + band] = np.median(band_spectra, axis=1)
+    return dict((mtype, values.astype(np.float64)) for mtype, values in stats.items())
+
+
+def _get_spectra_rows(time, keys, spectra, decimation, dtype='float32', codec='zlib'):
+    # decimate and encode spectra, as autocorrelation_spectra table rows
+    decimated = decimate_spectra(spectra, decimation)
+    return [dict(time=time, antnum=ant, polarization=pol, decimation=decimation,
+                 n_channels=decimated.shape[1], dtype=dtype, codec=codec,
+                 spectrum=encode_spectrum(spectrum, dtype=dtype, codec=codec))
+            for (ant, pol), spectrum in zip(keys, decimated)]
+
+
+def _get_rows(redis_session=None, antnums=None, time=None, spectra_decimation=None,
+              spectra_dtype='float32', spectra_codec='zlib'):
+    # read the spectra and compute the statistics, as table rows. If
+    # spectra_decimation is set, also return autocorrelation_spectra rows.
+    if time is None:
+        time = datetime.datetime.utcnow()
+    keys, spectra, failures = read_spectra_from_redis(redis_session=redis_session,
+                                                      antnums=antnums)
+    rows = []
+    spectra_rows = []
+    if len(keys) > 0:
+        stats = get_statistics(spectra)
+        for mtype in sorted(stats.keys()):
+            values = stats[mtype].tolist()
+            rows.extend(dict(time=time, antnum=ant, polarization=pol,
+                             measurement_type=mtype, value=value)
+                        for (ant, pol), value in zip(keys, values))
+        if spectra_decimation is not None:
+            spectra_rows = _get_spectra_rows(time, keys, spectra, spectra_decimation,
+                                             dtype=spectra_dtype, codec=spectra_codec)
+    return rows, spectra_rows, failures
+
+
+def create_from_redis(redis_session=None, antnums=None, time=None):
+    """
+    Read the autocorrelation spectra from the Redis server and return
+    Autocorrelations objects holding all the MeasurementTypes statistics.
+
+    Parameters:
+    ------------
+    redis_session: redis.Redis object
+        Existing connection to the Redis server to use. Defaults to
+        connecting to redis_host.
+    antnums: list of integers
+        antennas to read. Defaults to default_antnums.
+    time: datetime object
+        time to give all the records. The spectra in Redis have their own
+        timestamps, but using the same time for all the records of a read
+        is more convenient. Defaults to the current UTC time.
+
+    Returns:
+    --------
+    list of Autocorrelations objects, and list of the (antnum, polarization)
+    pairs that could not be read
+    """
+    rows, spectra_rows, failures = _get_rows(redis_session=redis_session, antnums=antnums,
+                                             time=time)
+    return [Autocorrelations(**row) for row in rows], failures
+
+
 def plot_HERA_autocorrelations_for_plotly(session):
     from plotly import graph_objs as go, plotly as py
 
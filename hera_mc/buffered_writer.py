@@ -0,0 +1,244 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Write-behind buffering of M&C inserts for high-cadence producers.
+
+`BufferedWriter` accepts the same calls as the add_* methods of MCSession,
+but only queues them and returns immediately. A background thread applies the
+queued calls to its own session and commits them in batches, when either
+enough calls are queued or enough time has passed since the oldest one.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from six.moves import queue
+
+from . import logger
+
+overflow_policies = ['block', 'drop', 'raise']
+
+
+class _FlushRequest(object):
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_stop = object()
+
+
+class BufferedWriter(object):
+    """
+    Buffer add_* calls to the M&C database and write them in batches from a
+    background thread.
+
+    Any add_* method of MCSession (and add, for table objects) can be called
+    on the writer with the same arguments. Errors raised by the calls
+    themselves (e.g. invalid values) happen on the background thread; they are
+    logged and counted in stats() rather than raised to the caller. If a batch
+    fails to commit, its calls are retried one at a time so a single bad
+    record only loses itself.
+
+    Parameters:
+    ------------
+    db: DB object
+        database to write to, e.g. from mc.connect_to_mc_db.
+    max_batch_size: integer
+        commit as soon as this many calls are queued.
+    max_batch_interval: float
+        commit calls at most this many seconds after they were queued.
+    max_queue_size: integer
+        maximum number of calls waiting to be written.
+    overflow: string
+        what to do when the queue is full. One of 'block' (wait for space),
+        'drop' (discard the new call, counted in stats) or 'raise' (raise
+        queue.Full).
+    """
+
+    def __init__(self, db, max_batch_size=1000, max_batch_interval=10.,
+                 max_queue_size=100000, overflow='block'):
+        if overflow not in overflow_policies:
+            raise ValueError('overflow must be one of {0}'.format(overflow_policies))
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be a positive integer')
+
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.max_batch_interval = max_batch_interval
+        self.overflow = overflow
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {'n_queued': 0, 'n_written': 0, 'n_dropped': 0, 'n_errors': 0,
+                       'n_batches': 0, 'max_queue_depth': 0, 'last_flush_latency': None,
+                       'max_flush_latency': 0., 'total_flush_latency': 0.,
+                       'last_error': None}
+
+        self._thread = threading.Thread(target=self._run, name='hera_mc BufferedWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, etb):
+        self.close()
+        return False
+
+    def __getattr__(self, name):
+        if name != 'add' and not name.startswith('add_'):
+            raise AttributeError('{0!r} object has no attribute {1!r}'
+                                 .format(self.__class__.__name__, name))
+
+        def buffered_method(*args, **kwargs):
+            self._put((name, args, kwargs))
+
+        buffered_method.__name__ = name
+        return buffered_method
+
+    def _put(self, item):
+        if not self._thread.is_alive():
+            raise RuntimeError('BufferedWriter is closed')
+        try:
+            self._queue.put(item, block=(self.overflow == 'block'))
+        except queue.Full:
+            if self.overflow == 'raise':
+                raise
+            with self._stats_lock:
+                self._stats['n_dropped'] += 1
+            return
+
+        with self._stats_lock:
+            self._stats['n_queued'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'],
+                                                 self._queue.qsize())
+
+    def flush(self, timeout=None):
+        """
+        Block until all the calls queued so far have been written.
+
+        Parameters:
+        ------------
+        timeout: float
+            maximum time to wait in seconds. Waits forever if None.
+
+        Returns:
+        --------
+        True if everything was written before the timeout, False otherwise
+        """
+        if not self._thread.is_alive():
+            return True
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Write all queued calls and stop the background thread.
+
+        Parameters:
+        ------------
+        timeout: float
+            maximum time to wait in seconds. Waits forever if None.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_stop)
+            self._thread.join(timeout)
+
+    def stats(self):
+        """
+        Get statistics on the writer.
+
+        Returns:
+        --------
+        dict with the current queue depth and the maximum seen, the numbers of
+        calls queued, written, dropped on overflow and failed, the number of
+        batches committed and the last, maximum and mean batch flush latency
+        in seconds.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        total_latency = stats.pop('total_flush_latency')
+        if stats['n_batches'] > 0:
+            stats['mean_flush_latency'] = total_latency / stats['n_batches']
+        else:
+            stats['mean_flush_latency'] = None
+        return stats
+
+    def _run(self):
+        session = self.db.sessionmaker()
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                flush_requests = []
+                deadline = None
+                while len(batch) < self.max_batch_size:
+                    if deadline is None:
+                        item = self._queue.get()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            item = self._queue.get(timeout=remaining)
+                        except queue.Empty:
+                            break
+
+                    if item is _stop:
+                        stopping = True
+                        break
+                    elif isinstance(item, _FlushRequest):
+                        flush_requests.append(item)
+                        break
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.time() + self.max_batch_interval
+
+                if len(batch) > 0:
+                    self._write_batch(session, batch)
+                for request in flush_requests:
+                    request.done.set()
+        finally:
+            session.close()
+
+    def _apply(self, session, call):
+        name, args, kwargs = call
+        getattr(session, name)(*args, **kwargs)
+
+    def _record_error(self, call, error):
+        logger.error('BufferedWriter could not write %s: %s', call[0], error)
+        with self._stats_lock:
+            self._stats['n_errors'] += 1
+            self._stats['last_error'] = '{0}: {1}'.format(call[0], error)
+
+    def _write_batch(self, session, batch):
+        t0 = time.time()
+        n_written = len(batch)
+        try:
+            for call in batch:
+                self._apply(session, call)
+            session.commit()
+        except Exception:
+            session.rollback()
+            # retry each call on its own so only the bad ones are lost
+            n_written = 0
+            for call in batch:
+                try:
+                    self._apply(session, call)
+                    session.commit()
+                    n_written += 1
+                except Exception as e:
+                    session.rollback()
+                    self._record_error(call, e)
+
+        latency = time.time() - t0
+        with self._stats_lock:
+            self._stats['n_written'] += n_written
+            self._stats['n_batches'] += 1
+            self._stats['last_flush_latency'] = latency
+            self._stats['max_flush_latency'] = max(self._stats['max_flush_latency'], latency)
+            self._stats['total_flush_latency'] += latency
@@ -14,7 +14,6 @@ from math import floor
 import subprocess
 import six
 from astropy.time import Time
-import pandas as pd
 import csv
 from sqlalchemy import Column, BigInteger, String
 
@@ -72,6 +71,8 @@ def package_db_to_csv(session=None, tables='all'):
     tables: string
         comma-separated list of names of tables to initialize or 'all'. Default is 'all'
     """
+    import pandas as pd
+
     if session is None:
         db = mc.connect_to_mc_db(None)
         session = db.sessionmaker()
@@ -0,0 +1,416 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""A single long-lived daemon collecting M&C data from many sources.
+
+`CollectorDaemon` runs each configured source (ROACH temperatures, antenna
+autocorrelations, weather, server status) at its own cadence on one tornado
+IOLoop, instead of separate cron jobs and daemons that each re-import hera_mc,
+reconnect and re-validate the schema. All the sources share one database
+connection pool and one persistent Redis connection pool. Each source has its
+own AsyncMCSession, so a slow source does not hold up the others, and the
+sessions all run on the small worker pool shared by AsyncMCSessions, so there
+is no thread per source. Each run of a source is committed as one batch.
+
+Timing and failure counters are kept for each source and published every
+`stats_interval` seconds to the log and, if Redis is configured, to the hash
+`mc_collector:<hostname>` (one JSON value per source).
+
+The daemon is configured by the "collector" section of mc_config.json::
+
+    "collector": {
+        "redis_host": "redishost",
+        "stats_interval": 60,
+        "sources": {
+            "roach_temperatures": {"cadence": 45},
+            "autocorrelations": {"cadence": 60, "spectra_decimation": 16},
+            "weather": {"cadence": 300, "lookback": 900},
+            "server_status": {"cadence": 60, "report_every": 5, "subsystem": "rtp"}
+        }
+    }
+
+Only the listed sources are run. Other sources can be added to
+`collector_sources`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import time
+import socket
+import threading
+
+import numpy as np
+import tornado.gen
+import tornado.ioloop
+import tornado.locks
+from astropy.time import Time, TimeDelta
+
+from . import logger
+from .mc_async import AsyncMCSession
+from .server_status import ServerStatusMonitor
+
+default_stats_interval = 60.
+
+
+class Source(object):
+    """
+    Base class for the data sources run by CollectorDaemon.
+
+    Subclasses implement `collect`, which is run on the source's session
+    worker thread, or override the `run` coroutine to do part of the work on
+    the IOLoop.
+
+    Parameters:
+    ------------
+    daemon: CollectorDaemon object
+        the daemon running the source, giving access to the shared Redis
+        connection.
+    name: string
+        name of the source in the configuration and the counters.
+    cadence: float
+        seconds between the starts of consecutive runs.
+    """
+
+    default_cadence = 60.
+
+    def __init__(self, daemon, name, cadence=None):
+        self.daemon = daemon
+        self.name = name
+        self.cadence = self.default_cadence if cadence is None else float(cadence)
+
+    def collect(self, session):
+        """
+        Collect one batch of data and add it to session (which is committed
+        afterwards).
+
+        This is an abstract hook: subclasses must implement it, unless they
+        override `run` instead (as WeatherSource does), in which case it is
+        never called. It is not an abc abstract method so that such
+        subclasses do not have to define it.
+
+        Parameters:
+        ------------
+        session: MCSession object
+
+        Returns:
+        --------
+        number of records added
+        """
+        raise NotImplementedError
+
+    @tornado.gen.coroutine
+    def run(self, async_session):
+        """Coroutine collecting one batch, returns the number of records added."""
+        n_records = yield async_session.run(self.collect)
+        raise tornado.gen.Return(n_records)
+
+    def committed(self):
+        """Called after the batch from a run has been committed."""
+        pass
+
+
+class RoachTemperatureSource(Source):
+    """
+    ROACH temperatures from Redis. Only the ROACHes whose timestamps changed
+    since the last run are added, so the cadence can be short.
+    """
+
+    default_cadence = 45.
+
+    def __init__(self, daemon, name, cadence=None):
+        super(RoachTemperatureSource, self).__init__(daemon, name, cadence=cadence)
+        self._collector = None
+
+    def collect(self, session):
+        from .roach import RoachTemperatureCollector
+
+        if self._collector is None:
+            self._collector = RoachTemperatureCollector(redis_session=self.daemon.redis)
+        return self._collector.add_to_session(session)
+
+    def committed(self):
+        # only skip the unchanged ROACHes once their records are stored
+        if self._collector is not None:
+            self._collector.confirm()
+
+
+class AutocorrelationSource(Source):
+    """
+    Statistics of the antenna autocorrelation spectra in Redis, and the
+    decimated spectra if spectra_decimation is set. They are stored with
+    spectra_dtype and spectra_codec, see add_autocorrelations_from_redis.
+    """
+
+    def __init__(self, daemon, name, cadence=None, antnums=None, spectra_decimation=None,
+                 spectra_dtype='float32', spectra_codec='zlib'):
+        super(AutocorrelationSource, self).__init__(daemon, name, cadence=cadence)
+        self.antnums = antnums
+        self.spectra_decimation = spectra_decimation
+        self.spectra_dtype = spectra_dtype
+        self.spectra_codec = spectra_codec
+
+    def collect(self, session):
+        # spectra that could not be read are logged, the others are still added
+        n_records, failures = session.add_autocorrelations_from_redis(
+            redis_session=self.daemon.redis, antnums=self.antnums,
+            spectra_decimation=self.spectra_decimation, spectra_dtype=self.spectra_dtype,
+            spectra_codec=self.spectra_codec)
+        return n_records
+
+
+class WeatherSource(Source):
+    """
+    Weather data from the KAT sensors. Each run fetches the last `lookback`
+    seconds, so data that arrives late is still recorded. The sensor
+    histories are fetched on the IOLoop and duplicate records are skipped.
+    """
+
+    default_cadence = 300.
+
+    def __init__(self, daemon, name, cadence=None, lookback=None, variables=None):
+        super(WeatherSource, self).__init__(daemon, name, cadence=cadence)
+        self.lookback = 3 * self.cadence if lookback is None else float(lookback)
+        self.variables = variables
+
+    @tornado.gen.coroutine
+    def run(self, async_session):
+        from .weather import _helper_create_from_sensors
+
+        stoptime = Time.now()
+        starttime = stoptime - TimeDelta(self.lookback, format='sec')
+        weather_data_list = yield _helper_create_from_sensors(starttime, stoptime,
+                                                              variables=self.variables)
+        yield async_session.add_all_ignore_duplicates(weather_data_list)
+        raise tornado.gen.Return(len(weather_data_list))
+
+
+class ServerStatusSource(Source):
+    """
+    Status of this machine, reported every `report_every` runs (every 5
+    minutes by default). See ServerStatusMonitor.
+    """
+
+    def __init__(self, daemon, name, cadence=None, subsystem='rtp', report_every=5):
+        super(ServerStatusSource, self).__init__(daemon, name, cadence=cadence)
+        self.subsystem = subsystem
+        self._monitor = ServerStatusMonitor(report_every=report_every)
+
+    def collect(self, session):
+        return self._monitor.add_to_session(session, self.subsystem)
+
+
+# source classes by the name used in the configuration
+collector_sources = {'roach_temperatures': RoachTemperatureSource,
+                     'autocorrelations': AutocorrelationSource,
+                     'weather': WeatherSource,
+                     'server_status': ServerStatusSource}
+
+
+def get_collector_config(config_path):
+    """
+    Read the "collector" section of an mc_config.json file.
+
+    Parameters:
+    ------------
+    config_path: string
+        path to the config file
+
+    Returns:
+    --------
+    dict with the collector configuration
+    """
+    with open(config_path) as f:
+        config_data = json.load(f)
+
+    config = config_data.get('collector')
+    if config is None:
+        raise RuntimeError('no "collector" section in {0!r}'.format(config_path))
+    return config
+
+
+class CollectorDaemon(object):
+    """
+    Run data sources at their cadences and commit what they collect to the
+    M&C database.
+
+    Parameters:
+    ------------
+    db: DB object
+        database to write to, e.g. from mc.connect_to_mc_db.
+    config: dict
+        collector configuration, with a "sources" dict mapping source names
+        (keys of collector_sources) to their options, and optionally
+        "redis_host" and "stats_interval". See the module docstring.
+    redis_session: redis.Redis object
+        Redis connection to use instead of connecting to config["redis_host"].
+    """
+
+    def __init__(self, db, config, redis_session=None):
+        self.db = db
+        self.stats_interval = float(config.get('stats_interval', default_stats_interval))
+        self.hostname = socket.gethostname()
+
+        self._redis = redis_session
+        self._redis_host = config.get('redis_host')
+
+        self.sources = []
+        for name, options in sorted(config.get('sources', {}).items()):
+            if name not in collector_sources:
+                raise ValueError('unknown collector source {0!r}, must be one of {1}'
+                                 .format(name, sorted(collector_sources.keys())))
+            self.sources.append(collector_sources[name](self, name, **options))
+        if len(self.sources) == 0:
+            raise ValueError('no collector sources are configured')
+
+        self._stats_lock = threading.Lock()
+        self._stats = dict((source.name, {'runs': 0, 'failures': 0,
+                                          'consecutive_failures': 0, 'records': 0,
+                                          'last_duration': None, 'max_duration': 0.,
+                                          'total_duration': 0., 'last_run': None,
+                                          'last_error': None})
+                           for source in self.sources)
+        self._stopping = False
+        self._wake = None
+
+    @property
+    def redis(self):
+        """The shared Redis connection (a connection pool, created when first used)."""
+        if self._redis is None:
+            import redis
+
+            if self._redis_host is None:
+                raise RuntimeError('no "redis_host" in the collector configuration')
+            self._redis = redis.Redis(self._redis_host, socket_timeout=10.)
+        return self._redis
+
+    def _record(self, name, duration, n_records=None, error=None):
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats['runs'] += 1
+            stats['last_duration'] = duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            stats['total_duration'] += duration
+            stats['last_run'] = time.time()
+            if error is None:
+                stats['records'] += n_records or 0
+                stats['consecutive_failures'] = 0
+            else:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+                stats['last_error'] = '{0}: {1}'.format(error.__class__.__name__, error)
+
+    def stats(self):
+        """
+        Get the counters of all the sources.
+
+        Returns:
+        --------
+        dict keyed by source name of dicts with the numbers of runs, failures,
+        consecutive_failures and records added, the last, max, total and
+        mean_duration of the runs in seconds, the last_run (unix) time and
+        the last_error message
+        """
+        with self._stats_lock:
+            stats = dict((name, dict(source_stats))
+                         for name, source_stats in self._stats.items())
+        for source_stats in stats.values():
+            source_stats['mean_duration'] = (source_stats['total_duration']
+                                             / source_stats['runs']
+                                             if source_stats['runs'] > 0 else None)
+        return stats
+
+    def publish_stats(self):
+        """Publish the counters to the log and to Redis (if configured)."""
+        stats = self.stats()
+        for name in sorted(stats):
+            source_stats = stats[name]
+            logger.info('collector source %s: %d runs, %d failures, %d records, '
+                        'mean duration %s s', name, source_stats['runs'],
+                        source_stats['failures'], source_stats['records'],
+                        source_stats['mean_duration'])
+        if self._redis is not None or self._redis_host is not None:
+            try:
+                self.redis.hset('mc_collector:' + self.hostname,
+                                mapping=dict((name, json.dumps(source_stats))
+                                             for name, source_stats in stats.items()))
+            except Exception as e:
+                logger.warning('could not publish collector stats to Redis: %s', e)
+
+    @tornado.gen.coroutine
+    def _sleep_until(self, deadline):
+        """Sleep until an IOLoop time, or until the daemon is stopped."""
+        # a Condition rather than an Event, whose timeouts log cancelled futures
+        if not self._stopping:
+            yield self._wake.wait(timeout=deadline)
+
+    @tornado.gen.coroutine
+    def _run_source(self, source):
+        io_loop = tornado.ioloop.IOLoop.current()
+        async_session = AsyncMCSession(self.db)
+        next_run = io_loop.time()
+        try:
+            while not self._stopping:
+                start = time.time()
+                try:
+                    n_records = yield source.run(async_session)
+                    yield async_session.commit()
+                    source.committed()
+                except Exception as e:
+                    logger.exception('collector source %s failed', source.name)
+                    self._record(source.name, time.time() - start, error=e)
+                    try:
+                        yield async_session.rollback()
+                    except Exception:
+                        logger.exception('rollback failed for collector source %s',
+                                         source.name)
+                else:
+                    self._record(source.name, time.time() - start, n_records=n_records)
+
+                # keep to the cadence, skipping runs that were missed
+                next_run += source.cadence
+                now = io_loop.time()
+                if next_run < now:
+                    next_run += np.ceil((now - next_run) / source.cadence) * source.cadence
+                yield self._sleep_until(next_run)
+        finally:
+            yield async_session.close()
+
+    @tornado.gen.coroutine
+    def _publish_loop(self):
+        io_loop = tornado.ioloop.IOLoop.current()
+        while not self._stopping:
+            yield self._sleep_until(io_loop.time() + self.stats_interval)
+            self.publish_stats()
+
+    @tornado.gen.coroutine
+    def run_async(self):
+        """Coroutine running all the sources until stop is called."""
+        self._stopping = False
+        self._wake = tornado.locks.Condition()
+        yield [self._run_source(source) for source in self.sources] + [self._publish_loop()]
+
+    def run(self, duration=None):
+        """
+        Run all the sources on the current IOLoop until stop is called (or
+        the process is interrupted).
+
+        Parameters:
+        ------------
+        duration: float
+            If set, stop after this many seconds.
+        """
+        io_loop = tornado.ioloop.IOLoop.current()
+        if duration is not None:
+            io_loop.call_later(duration, self.stop)
+        try:
+            io_loop.run_sync(self.run_async)
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        """Stop the daemon after the runs in progress. Must be called on the IOLoop."""
+        self._stopping = True
+        if self._wake is not None:
+            self._wake.notify_all()
@@ -4,12 +4,19 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import os.path as op
+import json
+import hashlib
 from sqlalchemy import inspect
 from sqlalchemy.ext.declarative.clsregistry import _ModuleMarker
 from sqlalchemy.orm import RelationshipProperty
 
 from . import logger
 
+# file holding the fingerprints of databases that passed is_valid_database
+default_schema_cache_file = op.expanduser('~/.hera_mc/schema_cache.json')
+
 
 def check_connection(session):
     """
@@ -101,3 +108,114 @@ def is_valid_database(base, session):
             errors = True
 
     return not errors
+
+
+def schema_fingerprint(base):
+    """
+    Get a fingerprint of the tables and columns declared in a declarative base.
+
+    Parameters
+    ----------
+    base: instance of SQLAlchemy Declarative Base
+
+    Returns
+    ----------
+    hex digest string that changes if any declared table or column changes.
+    """
+    schema = []
+    for name, klass in base._decl_class_registry.items():
+        if isinstance(klass, _ModuleMarker):
+            continue
+        columns = sorted(column.key for column in klass.__table__.columns)
+        schema.append([klass.__tablename__, columns])
+
+    schema_str = json.dumps(sorted(schema))
+    return hashlib.sha1(schema_str.encode('utf-8')).hexdigest()
+
+
+def get_alembic_revision(session):
+    """
+    Get the alembic revision the database is at.
+
+    Parameters
+    ----------
+    session: SQLAlchemy session bound to an engine
+
+    Returns
+    ----------
+    alembic revision string, or None if the database is not managed by alembic.
+    """
+    engine = session.get_bind()
+    if 'alembic_version' not in inspect(engine).get_table_names():
+        return None
+
+    return session.execute('SELECT version_num FROM alembic_version').scalar()
+
+
+def _read_schema_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def is_valid_database_cached(base, session, force=False, cache_file=None):
+    """
+    Check whether the database matches the declared models, using a local cache
+    to skip the full (and slow) reflection when the database has already been
+    validated.
+
+    A database is recorded in the cache after passing is_valid_database, keyed
+    by its URL, alembic revision and the fingerprint of the declared schema.
+    If any of these change, or the database is not managed by alembic, the full
+    check is run.
+
+    Parameters
+    ----------
+    base: instance of SQLAlchemy Declarative Base to check
+    session: SQLAlchemy session bound to an engine
+    force: boolean
+        If True, always run the full check (and refresh the cache).
+    cache_file: string
+        Path to the cache file. Defaults to ~/.hera_mc/schema_cache.json
+
+    Returns
+    ----------
+    True if all declared models have corresponding tables and columns.
+    """
+    if base is None:
+        from . import MCDeclarativeBase
+        base = MCDeclarativeBase
+    if cache_file is None:
+        cache_file = default_schema_cache_file
+
+    # repr hides any password in the URL
+    db_url = repr(session.get_bind().engine.url)
+    cache_entry = {'revision': get_alembic_revision(session),
+                   'fingerprint': schema_fingerprint(base)}
+
+    if cache_entry['revision'] is None:
+        return is_valid_database(base, session)
+
+    if not force and _read_schema_cache(cache_file).get(db_url) == cache_entry:
+        return True
+
+    if not is_valid_database(base, session):
+        return False
+
+    cache = _read_schema_cache(cache_file)
+    cache[db_url] = cache_entry
+    try:
+        cache_dir = op.dirname(cache_file)
+        if not op.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file and rename so readers never see a partial file
+        temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError) as e:
+        logger.warning('could not write schema cache file %s: %s', cache_file, e)
+
+    return True
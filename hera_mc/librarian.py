@@ -127,14 +127,14 @@ class LibRAIDErrors(MCDeclarativeBase):
     Definition of lib_raid_errors table.
 
     id: autoincrementing error id (BigInteger). Primary_key
-    time: time of this status in floor(gps seconds) (BigInteger)
+    time: time of this status in floor(gps seconds) (BigInteger). Indexed
     hostname: name of RAID server with error (String)
     disk: name of disk with error (String)
     log: error message or log file name (TBD) (Text)
     """
     __tablename__ = 'lib_raid_errors'
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    time = Column(BigInteger, nullable=False)
+    time = Column(BigInteger, nullable=False, index=True)
     hostname = Column(String(32), nullable=False)
     disk = Column(String, nullable=False)
     log = Column(Text, nullable=False)
@@ -213,13 +213,13 @@ class LibFiles(MCDeclarativeBase):
     obsid: observation obsid (Long). Foreign key into Observation table
       Null values allowed for maintenance files not associated with
       particular observations.
-    time: time this file was created in floor(gps seconds) (BigInteger)
+    time: time this file was created in floor(gps seconds) (BigInteger). Indexed
     size_gb: file size in gb (Float)
     """
     __tablename__ = 'lib_files'
     filename = Column(String(256), primary_key=True)
     obsid = Column(BigInteger, ForeignKey('hera_obs.obsid'), nullable=True)
-    time = Column(BigInteger, nullable=False)
+    time = Column(BigInteger, nullable=False, index=True)
     size_gb = Column(Float, nullable=False)
 
     @classmethod
@@ -13,14 +13,17 @@ from __future__ import absolute_import, division, print_function
 import os.path as op
 import os
 import sys
+import threading
 from abc import ABCMeta
 from six import add_metaclass
 from sqlalchemy import create_engine, update
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker, Session
 
-from . import MCDeclarativeBase
+from . import MCDeclarativeBase, _load_table_modules
 from .mc_session import MCSession
+from .query_stats import instrument_engine
+from .query_cache import QueryCache, default_ttl
 
 data_path = op.join(op.dirname(__file__), 'data')
 test_data_path = op.join(data_path, 'test_data')
@@ -28,6 +31,59 @@ default_config_file = op.expanduser('~/.hera_mc/mc_config.json')
 mc_log_file = op.expanduser('~/.hera_mc/mc_log.txt')
 cm_log_file = op.expanduser('~/.hera_mc/cm_log.txt')
 
+# connection pool settings that can be given for a database in mc_config.json
+pool_setting_names = ['pool_size', 'max_overflow', 'pool_pre_ping', 'pool_recycle']
+
+# process-wide registries of engines and connected DB objects so repeated
+# connections to the same database reuse the same connection pool
+_engines = {}
+_connected_dbs = {}
+_registry_lock = threading.Lock()
+
+
+def get_engine(db_url, pool_settings=None):
+    """Return the shared SQLAlchemy engine for a database URL, creating it if needed.
+
+    Engines are cached for the life of the process, keyed by URL and pool
+    settings. They are thread-safe, so the same engine (and its connection
+    pool) can be shared by all the sessions in a process.
+
+    Parameters:
+    ------------
+    db_url: string
+        SQLAlchemy database URL
+    pool_settings: dict
+        keyword arguments for create_engine, keys must be in pool_setting_names.
+        pool_size and max_overflow are ignored for SQLite, which does not use
+        a queue pool.
+
+    Returns:
+    --------
+    SQLAlchemy engine
+    """
+    if pool_settings is None:
+        pool_settings = {}
+    for key in pool_settings:
+        if key not in pool_setting_names:
+            raise ValueError('unrecognized connection pool setting {0!r}, must be '
+                             'one of {1}'.format(key, pool_setting_names))
+
+    engine_key = (db_url, tuple(sorted(pool_settings.items())))
+    with _registry_lock:
+        engine = _engines.get(engine_key)
+        if engine is None:
+            engine_kwargs = dict(pool_settings)
+            if db_url.startswith('sqlite'):
+                engine_kwargs.pop('pool_size', None)
+                engine_kwargs.pop('max_overflow', None)
+                # sessions may move between threads (e.g. an AsyncMCSession on
+                # the shared worker pool), but are only used by one at a time
+                engine_kwargs['connect_args'] = {'check_same_thread': False}
+            engine = create_engine(db_url, **engine_kwargs)
+            _engines[engine_key] = engine
+
+    return engine
+
 
 @add_metaclass(ABCMeta)
 class DB(object):
@@ -38,13 +94,37 @@ class DB(object):
 
     """
     engine = None
-    sessionmaker = sessionmaker(class_=MCSession)
+    read_engine = None
+    sessionmaker = None
     sqlalchemy_base = None
+    query_stats = None
+    query_cache = None
+
+    def __init__(self, sqlalchemy_base, db_url, pool_settings=None, instrument_queries=False,
+                 read_url=None, read_after_write=60., query_cache=None):
+        # make sure all the tables are defined before creating or checking them
+        _load_table_modules()
 
-    def __init__(self, sqlalchemy_base, db_url):
         self.sqlalchemy_base = MCDeclarativeBase
-        self.engine = create_engine(db_url)
-        self.sessionmaker.configure(bind=self.engine)
+        self.engine = get_engine(db_url, pool_settings=pool_settings)
+
+        session_kwargs = {}
+        if read_url is not None:
+            # sessions send their SELECTs to the replica, see MCSession.get_bind
+            self.read_engine = get_engine(read_url, pool_settings=pool_settings)
+            session_kwargs = {'read_bind': self.read_engine,
+                              'read_after_write': read_after_write}
+        if query_cache is not None:
+            # one cache shared by all the sessions, see the query_cache module
+            self.query_cache = query_cache
+            session_kwargs['query_cache'] = query_cache
+        self.sessionmaker = sessionmaker(class_=MCSession, bind=self.engine,
+                                         **session_kwargs)
+
+        if instrument_queries:
+            self.query_stats = instrument_engine(self.engine)
+            if self.read_engine is not None:
+                instrument_engine(self.read_engine)
 
 
 class DeclarativeDB(DB):
@@ -52,8 +132,14 @@ class DeclarativeDB(DB):
     Declarative M&C database object -- to create M&C database tables
     """
 
-    def __init__(self, db_url):
-        super(DeclarativeDB, self).__init__(MCDeclarativeBase, db_url)
+    def __init__(self, db_url, pool_settings=None, instrument_queries=False,
+                 read_url=None, read_after_write=60., query_cache=None):
+        super(DeclarativeDB, self).__init__(MCDeclarativeBase, db_url,
+                                            pool_settings=pool_settings,
+                                            instrument_queries=instrument_queries,
+                                            read_url=read_url,
+                                            read_after_write=read_after_write,
+                                            query_cache=query_cache)
 
     def create_tables(self):
         """Create all M&C tables"""
@@ -70,17 +156,28 @@ class AutomappedDB(DB):
 
     This is intended for use with the production M&C database. __init__()
     raises an exception if the existing database does not match the schema
-    defined in the SQLAlchemy initialization magic.
+    defined in the SQLAlchemy initialization magic. Databases that already
+    passed this check at the same alembic revision are not reflected again
+    (see `db_check.is_valid_database_cached`) unless *force_validation* is
+    True.
 
     """
 
-    def __init__(self, db_url):
-        super(AutomappedDB, self).__init__(automap_base(), db_url)
+    def __init__(self, db_url, pool_settings=None, force_validation=False,
+                 instrument_queries=False, read_url=None, read_after_write=60.,
+                 query_cache=None):
+        super(AutomappedDB, self).__init__(automap_base(), db_url,
+                                           pool_settings=pool_settings,
+                                           instrument_queries=instrument_queries,
+                                           read_url=read_url,
+                                           read_after_write=read_after_write,
+                                           query_cache=query_cache)
 
-        from .db_check import is_valid_database
+        from .db_check import is_valid_database_cached
 
         with self.sessionmaker() as session:
-            if not is_valid_database(MCDeclarativeBase, session):
+            if not is_valid_database_cached(MCDeclarativeBase, session,
+                                            force=force_validation):
                 raise RuntimeError('database {0} does not match expected schema'
                                    .format(db_url))
 
@@ -128,7 +225,8 @@ def get_cm_csv_path(mc_config_file=None):
     return config_data.get('cm_csv_path')
 
 
-def connect_to_mc_db(args, forced_db_name=None, check_connect=True):
+def connect_to_mc_db(args, forced_db_name=None, check_connect=True,
+                     force_validation=False):
     """Return an instance of the `DB` class providing access to the M&C database.
 
     *args* should be the result of calling `parse_args` on an
@@ -136,6 +234,31 @@ def connect_to_mc_db(args, forced_db_name=None, check_connect=True):
      `get_mc_argument_parser()`. Alternatively, it can be None to use the full
      defaults.
 
+    Connection pool settings (any of `pool_size`, `max_overflow`,
+    `pool_pre_ping` and `pool_recycle`) can be given in the database's entry
+    in the config file. The DB object for each database is cached for the life
+    of the process, so repeated calls reuse the same engine and do not repeat
+    the schema and connection checks. Set *force_validation* to re-run the
+    full schema check for a production database rather than trusting the
+    cached result.
+
+    If the database's entry has a `read_url` (e.g. a streaming replica of a
+    PostgreSQL primary), sessions from the returned DB send their reads to
+    it and their writes to `url`. Reads go to `url` for `read_after_write`
+    seconds (default 60, null to never) after a session writes, so it sees
+    its own writes. See MCSession for details.
+
+    Setting `query_cache_size` in the database's entry turns on caching of
+    the results of the MCSession get_* methods, keeping up to that many
+    results for `query_cache_ttl` seconds (default 60). See the query_cache
+    module.
+
+    Statement timings are recorded (see `query_stats`) if `instrument_queries`
+    is true in the database's entry. This walks the call stack of every
+    statement, so it is off by default. If the entry also
+    has a `query_stats_interval` (in seconds), the statistics are dumped
+    that often, to the file given by `query_stats_file` or else to the log.
+
     """
     if args is None:
         config_path = default_config_file
@@ -179,10 +302,38 @@ def connect_to_mc_db(args, forced_db_name=None, check_connect=True):
         raise RuntimeError('cannot connect to M&C database: no "mode" item for the DB '
                            'named {0!r} in {1!r}'.format(db_name, config_path))
 
+    pool_settings = dict((key, db_data[key]) for key in pool_setting_names
+                         if key in db_data)
+
+    instrument_queries = db_data.get('instrument_queries', False)
+    read_url = db_data.get('read_url')
+    read_after_write = db_data.get('read_after_write', 60.)
+    query_cache_size = db_data.get('query_cache_size')
+    query_cache_ttl = db_data.get('query_cache_ttl', default_ttl)
+
+    db_key = (db_url, db_mode, tuple(sorted(pool_settings.items())), instrument_queries,
+              read_url, read_after_write, query_cache_size, query_cache_ttl)
+    if not force_validation:
+        with _registry_lock:
+            db = _connected_dbs.get(db_key)
+        if db is not None:
+            return db
+
+    query_cache = None
+    if query_cache_size:
+        query_cache = QueryCache(max_entries=query_cache_size, ttl=query_cache_ttl)
+
     if db_mode == 'testing':
-        db = DeclarativeDB(db_url)
+        db = DeclarativeDB(db_url, pool_settings=pool_settings,
+                           instrument_queries=instrument_queries,
+                           read_url=read_url, read_after_write=read_after_write,
+                           query_cache=query_cache)
     elif db_mode == 'production':
-        db = AutomappedDB(db_url)
+        db = AutomappedDB(db_url, pool_settings=pool_settings,
+                          force_validation=force_validation,
+                          instrument_queries=instrument_queries,
+                          read_url=read_url, read_after_write=read_after_write,
+                          query_cache=query_cache)
     else:
         raise RuntimeError('cannot connect to M&C database: unrecognized mode {0!r} for'
                            'the DB named {1!r} in {2!r}'.format(db_mode, db_name,
@@ -195,6 +346,14 @@ def connect_to_mc_db(args, forced_db_name=None, check_connect=True):
             if not db_check.check_connection(session):
                 raise RuntimeError('Could not establish valid connection to database.')
 
+        # only cache DB objects that have been checked
+        with _registry_lock:
+            _connected_dbs[db_key] = db
+
+    if db.query_stats is not None and db_data.get('query_stats_interval') is not None:
+        db.query_stats.start_periodic_dump(db_data['query_stats_interval'],
+                                           path=db_data.get('query_stats_file'))
+
     return db
 
 
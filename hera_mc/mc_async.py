@@ -0,0 +1,232 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Non-blocking access to the M&C database for collectors and daemons.
+
+SQLAlchemy (1.x) has no asynchronous engine, so `AsyncMCSession` runs the
+methods of a normal `MCSession` on a small pool of worker threads and returns
+futures that can be yielded from tornado coroutines or awaited from asyncio.
+The pool is shared by all the AsyncMCSessions in a process (see
+`get_executor`), so the number of threads does not grow with the number of
+sessions. A session must not be used from two threads at once, so the calls
+on each AsyncMCSession are run one at a time, in order, while calls on
+different sessions run concurrently on the shared workers.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import tornado.concurrent
+import tornado.gen
+import tornado.ioloop
+from sqlalchemy import inspect
+from sqlalchemy.orm.state import InstanceState
+
+from .mc_session import MCSession
+
+# MCSession methods that are proxied as asynchronous methods, by prefix and by name.
+# Methods returning lazy or thread-bound objects (query, iter_*) are not proxied,
+# use AsyncMCSession.run for those. The objects returned by the get_* methods are
+# detached from the session (see _expunge_results).
+async_method_prefixes = ('add_', 'get_', 'update_', 'ingest_', 'check_', 'write_')
+async_method_names = ('commit', 'rollback', 'flush', 'execute', 'merge', 'delete',
+                      'expunge_all')
+
+# number of worker threads in the pool shared by all AsyncMCSessions
+default_max_workers = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the pool of worker threads shared by all AsyncMCSessions, creating it
+    (with default_max_workers threads) if needed.
+
+    Returns:
+    --------
+    concurrent.futures.ThreadPoolExecutor object
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=default_max_workers)
+        return _executor
+
+
+def _expunge_results(session, results):
+    """
+    Detach the ORM objects in the results of a get_* method from session.
+
+    Otherwise the objects stay bound to the session on the worker thread, and
+    after its next commit expires them, reading their attributes on the IOLoop
+    thread would reload them through that session from the wrong thread.
+    Detached objects keep the values they were loaded with.
+    """
+    if isinstance(results, (list, tuple)):
+        for obj in results:
+            _expunge_results(session, obj)
+        return
+    state = inspect(results, raiseerr=False)
+    if isinstance(state, InstanceState) and state.session is session:
+        session.expunge(results)
+
+
+class AsyncMCSession(object):
+    """
+    Asynchronous wrapper around an MCSession.
+
+    The add_*, get_*, update_* etc. methods of MCSession (as well as commit,
+    rollback, flush, execute, merge and delete) are available with the same
+    arguments, but return futures instead of blocking. Calls are run in the
+    order they are made.
+
+    ORM objects returned by the get_* methods are detached from the session,
+    so they can be read safely on the calling thread, but they are not
+    refreshed by later commits and unloaded relationships cannot be loaded
+    from them. Objects returned by functions passed to `run` are not
+    detached; only use those on the worker thread (i.e. within `run`).
+
+    Example, in a tornado coroutine or an asyncio coroutine::
+
+        session = AsyncMCSession(db)
+        yield session.add_roach_temperature_from_redis()
+        status = yield session.get_latest_server_status('rtp')
+        yield session.commit()
+
+    Parameters:
+    ------------
+    db: DB object
+        database to create a session on, e.g. from mc.connect_to_mc_db.
+        Either db or session must be given.
+    session: MCSession object
+        existing session to wrap. It should not be used directly while it is
+        wrapped.
+    executor: concurrent.futures.Executor object
+        worker threads to run the calls on. Defaults to the pool shared by
+        all AsyncMCSessions (see get_executor).
+    """
+
+    def __init__(self, db=None, session=None, executor=None):
+        if session is None:
+            if db is None:
+                raise ValueError('one of db or session must be specified')
+            session = db.sessionmaker()
+        elif db is not None:
+            raise ValueError('only one of db or session can be specified')
+
+        self.session = session
+        self._executor = get_executor() if executor is None else executor
+        self._calls = collections.deque()
+        self._calls_lock = threading.Lock()
+        self._running = False
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run a function with the session on a worker thread, after the calls
+        already made on this AsyncMCSession.
+
+        Parameters:
+        ------------
+        func: callable
+            function to run, called as func(session, *args, **kwargs)
+
+        Returns:
+        --------
+        future resolving to the return value of func
+        """
+        call_future = Future()
+        with self._calls_lock:
+            self._calls.append((call_future, func, args, kwargs))
+            start = not self._running
+            self._running = True
+        if start:
+            self._executor.submit(self._run_next)
+
+        future = tornado.concurrent.Future()
+        tornado.concurrent.chain_future(call_future, future)
+        return future
+
+    def _run_next(self):
+        # Make the oldest queued call on a worker thread. If more calls are
+        # queued, resubmit rather than looping so other sessions get a turn.
+        with self._calls_lock:
+            call_future, func, args, kwargs = self._calls.popleft()
+
+        try:
+            if call_future.set_running_or_notify_cancel():
+                try:
+                    result = func(self.session, *args, **kwargs)
+                except Exception as e:
+                    call_future.set_exception(e)
+                else:
+                    call_future.set_result(result)
+        finally:
+            with self._calls_lock:
+                self._running = len(self._calls) > 0
+                if self._running:
+                    self._executor.submit(self._run_next)
+
+    def __getattr__(self, name):
+        if not (name.startswith(async_method_prefixes) or name in async_method_names):
+            raise AttributeError('{0!r} object has no attribute {1!r}'
+                                 .format(self.__class__.__name__, name))
+        method = getattr(MCSession, name)
+
+        if name.startswith('get_'):
+            def async_method(*args, **kwargs):
+                def get_detached(session):
+                    results = method(session, *args, **kwargs)
+                    _expunge_results(session, results)
+                    return results
+                return self.run(get_detached)
+        else:
+            def async_method(*args, **kwargs):
+                return self.run(method, *args, **kwargs)
+
+        async_method.__name__ = name
+        async_method.__doc__ = method.__doc__
+        return async_method
+
+    @tornado.gen.coroutine
+    def add_weather_data_from_sensors(self, starttime, stoptime, variables=None,
+                                      ignore_duplicates=False):
+        """
+        Add weather data for a given variable and timespan from KAT sensors.
+
+        Unlike MCSession.add_weather_data_from_sensors, the sensor histories
+        are fetched on the calling IOLoop, so other coroutines keep running
+        while waiting on KATPortal.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to start getting history.
+        stoptime: astropy time object
+            time to stop getting history.
+        variable: string
+            variable to get history for. Must be a key in weather.weather_sensor_dict,
+            defaults to all keys in weather.weather_sensor_dict
+        ignore_duplicates: boolean
+            If True, skip data points that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .weather import _helper_create_from_sensors
+
+        weather_data_list = yield _helper_create_from_sensors(starttime, stoptime,
+                                                              variables=variables)
+        if ignore_duplicates:
+            yield self.run(MCSession.add_all_ignore_duplicates, weather_data_list)
+        else:
+            yield self.run(lambda session: session.add_all(weather_data_list))
+
+    @tornado.gen.coroutine
+    def close(self):
+        """
+        Close the session. Uncommitted changes are rolled back.
+        """
+        yield self.run(MCSession.close)
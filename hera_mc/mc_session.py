@@ -4,12 +4,23 @@
 
 from __future__ import absolute_import, division, print_function
 
+from sqlalchemy import (select, and_, cast, extract, literal_column, BigInteger,
+                        DateTime, Float)
 from sqlalchemy.orm import Session
-from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import (func, Select, CompoundSelect, FunctionElement,
+                                       TextClause)
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import find_tables
 from astropy.time import Time
+import datetime
+import re
+import time
+import numpy as np
 import warnings
 
-from .utils import get_iterable
+from . import _load_table_modules
+from .utils import get_iterable, get_gps_floor_list, get_column_lists
+from .query_cache import cached_query
 """
 Primary session object which handles most DB queries.
 
@@ -17,9 +28,117 @@ See INSTALL.md in the Git repository for instructions on how to initialize
 your database and configure M&C to find it.
 """
 
+# number of rows per multi-row VALUES insert statement
+insert_chunk_size = 1000
+
+# SQL aggregate functions supported by MCSession.get_aggregated (in addition
+# to 'last', which needs special handling).
+aggregate_functions = {'mean': lambda col: func.avg(col, type_=Float),
+                       'min': func.min, 'max': func.max, 'sum': func.sum,
+                       'count': func.count}
+
+_text_select_re = re.compile(r'\s*select\b', re.IGNORECASE)
+
+
+def _is_read_statement(clause):
+    """
+    Return True if a statement only reads from the database: SELECTs,
+    functions executed on their own (like func.current_timestamp()) and
+    textual statements starting with SELECT.
+    """
+    if isinstance(clause, (Select, CompoundSelect, FunctionElement)):
+        return True
+    if isinstance(clause, TextClause):
+        return _text_select_re.match(clause.text) is not None
+    return False
+
+
+def _rows_to_arrays(rows, table_columns):
+    """
+    Convert a list of result rows into a dict of numpy arrays keyed by
+    column name. Float columns are converted to float64 arrays (with nulls
+    as NaN), integer columns to int64 arrays and DateTime columns to
+    datetime64 arrays where possible.
+    """
+    arrays = {}
+    for ind, col in enumerate(table_columns):
+        values = [row[ind] for row in rows]
+        try:
+            python_type = col.type.python_type
+        except NotImplementedError:
+            python_type = None
+
+        if python_type is float:
+            arrays[col.name] = np.array(values, dtype=np.float64)
+        elif python_type is int and None not in values:
+            arrays[col.name] = np.array(values, dtype=np.int64)
+        elif python_type is datetime.datetime and None not in values:
+            arrays[col.name] = np.array(values, dtype='datetime64[us]')
+        elif len(values) == 0:
+            arrays[col.name] = np.array(values, dtype=object)
+        else:
+            arrays[col.name] = np.array(values)
+    return arrays
+
 
 class MCSession(Session):
 
+    def __init__(self, *args, **kwargs):
+        """
+        Create a new M&C session. Accepts the same arguments as a
+        SQLAlchemy Session plus the following keywords.
+
+        Parameters:
+        ------------
+        db_clock_refresh_interval: float
+            Seconds between re-measurements of the offset between the local
+            clock and the database clock used by get_current_db_time.
+            Defaults to 60 seconds.
+
+        strict_db_time: boolean
+            If True, get_current_db_time always queries the database rather
+            than using the cached clock offset. Defaults to False.
+
+        read_bind: SQLAlchemy engine
+            Engine for a read replica of the database. If set, SELECTs
+            (queries and the get_* methods) are sent to it, while flushes,
+            commits and other statements go to the session's main bind.
+            Defaults to None (everything goes to the main bind).
+
+        read_after_write: float
+            Seconds after this session last wrote to the database during
+            which reads are still sent to the main bind, so the session sees
+            its own writes despite replication lag. Reads also go to the main
+            bind while the session has uncommitted writes. Use float('inf')
+            to read from the main bind for the rest of the session once it
+            has written, or None to always read from the replica. Defaults
+            to 60 seconds.
+
+        query_cache: QueryCache
+            Cache for the results of the get_* methods, usually shared by
+            all the sessions of a DB object. See the query_cache module.
+            Defaults to None (no caching).
+        """
+        self.db_clock_refresh_interval = kwargs.pop('db_clock_refresh_interval', 60.)
+        self.strict_db_time = kwargs.pop('strict_db_time', False)
+        self.read_bind = kwargs.pop('read_bind', None)
+        self.read_after_write = kwargs.pop('read_after_write', 60.)
+        self._last_write_time = None
+        self._uncommitted_writes = False
+        self.query_cache = kwargs.pop('query_cache', None)
+        # tables read by the cached methods being run (innermost last) and
+        # tables written to in the current transaction
+        self._cache_read_stack = []
+        self._cache_written_tables = set()
+        super(MCSession, self).__init__(*args, **kwargs)
+
+        # the table classes are imported lazily inside the methods, but all
+        # of them need to be defined to resolve foreign keys on flush
+        _load_table_modules()
+
+        self._db_clock_offset = None
+        self._db_clock_offset_checked = None
+
     def __enter__(self):
         return self
 
@@ -31,22 +150,163 @@ class MCSession(Session):
         self.close()
         return False  # propagate exception if any occurred
 
-    def get_current_db_time(self):
+    def _reads_need_primary(self):
+        if self.read_after_write is None or self._last_write_time is None:
+            return False
+        if self._uncommitted_writes:
+            return True
+        return time.time() - self._last_write_time < self.read_after_write
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        """
+        Return the engine or connection to run a statement on. SELECT
+        statements (see _is_read_statement) are sent to read_bind if set, unless the session has
+        recently written (see read_after_write in __init__); everything else
+        goes to the main bind. Also records the tables read and written for
+        the query cache.
+        """
+        is_read = _is_read_statement(clause) and not self._flushing
+        if self._flushing or (clause is not None and not is_read):
+            self._last_write_time = time.time()
+            self._uncommitted_writes = True
+            if self.query_cache is not None:
+                if self._flushing and mapper is not None:
+                    self._note_cache_write(table.name for table in mapper.tables)
+                elif isinstance(clause, UpdateBase):
+                    self._note_cache_write([clause.table.name])
+        elif is_read and self._cache_read_stack:
+            self._note_cache_reads(table.name for table in find_tables(clause))
+
+        if self.read_bind is not None and is_read and not self._reads_need_primary():
+            return self.read_bind
+        return super(MCSession, self).get_bind(mapper, clause, **kwargs)
+
+    def _note_cache_reads(self, tables):
+        if self._cache_read_stack:
+            self._cache_read_stack[-1].update(tables)
+
+    def _note_cache_write(self, tables):
+        tables = set(tables)
+        self._cache_written_tables.update(tables)
+        self.query_cache.invalidate(tables)
+
+    def commit(self):
+        super(MCSession, self).commit()
+        self._uncommitted_writes = False
+        if self.query_cache is not None and self._cache_written_tables:
+            # drop results other sessions read before the commit
+            self.query_cache.invalidate(self._cache_written_tables)
+        self._cache_written_tables = set()
+
+    def rollback(self):
+        super(MCSession, self).rollback()
+        self._uncommitted_writes = False
+        self._cache_written_tables = set()
+
+    def query_cache_stats(self, reset=False):
+        """
+        Get the hit and miss statistics of this session's query cache.
+
+        Parameters:
+        ------------
+        reset: boolean
+            reset the statistics after getting them.
+
+        Returns:
+        --------
+        dict of statistics (see QueryCache.stats), or None if the session
+        does not have a query cache
+        """
+        if self.query_cache is None:
+            return None
+        stats = self.query_cache.stats()
+        if reset:
+            self.query_cache.reset_stats()
+        return stats
+
+    def query_stats(self, n=None, sort_by='total_time', reset=False):
+        """
+        Get timing statistics for the statements run on this session's
+        database, grouped by the MCSession method that issued them.
+
+        The statistics cover all sessions in this process using the same
+        engine, and are only recorded if the engine is instrumented (set
+        `instrument_queries` in the database's entry of mc_config.json).
+
+        Parameters:
+        ------------
+        n: integer
+            only return the top n call sites. Defaults to all call sites.
+        sort_by: string
+            quantity to sort the call sites by (descending), one of
+            'total_time', 'mean_time', 'max_time', 'count', 'rows'.
+        reset: boolean
+            clear the statistics after getting them.
+
+        Returns:
+        --------
+        list of dicts with keys call_site, count, total_time, mean_time,
+        max_time (times in seconds), rows and statement (the slowest
+        statement seen). Empty if the engine is not instrumented. Statements
+        run on a read replica are included.
+        """
+        from .query_stats import get_engine_query_stats, combine_summaries, sort_summary
+
+        stats_list = [get_engine_query_stats(self.get_bind())]
+        if self.read_bind is not None and self.read_bind is not self.get_bind():
+            stats_list.append(get_engine_query_stats(self.read_bind))
+        stats_list = [stats for stats in stats_list if stats is not None]
+
+        summary = sort_summary(combine_summaries([stats.summary() for stats in stats_list]),
+                               n=n, sort_by=sort_by)
+        if reset:
+            for stats in stats_list:
+                stats.reset()
+        return summary
+
+    def get_current_db_time(self, strict=None):
         '''
         A method to get the current time according to the database
 
+        By default this avoids a database round trip on every call: the offset
+        between the local and database clocks is measured once and refreshed
+        every db_clock_refresh_interval seconds, and the local time plus that
+        offset is returned.
+
+        Parameters:
+        ------------
+        strict: boolean
+            If True, query the database for the current time (and refresh the
+            cached offset). Defaults to the session's strict_db_time setting.
+
         Returns:
         --------
         current database time as an astropy time object
         '''
+        if strict is None:
+            strict = self.strict_db_time
+
+        if (not strict and self._db_clock_offset is not None
+                and (time.time() - self._db_clock_offset_checked
+                     < self.db_clock_refresh_interval)):
+            return Time(time.time() + self._db_clock_offset, format='unix')
+
+        local_before = time.time()
         db_timestamp = self.execute(func.current_timestamp()).scalar()
+        local_after = time.time()
 
         # convert to astropy time object
         db_time = Time(db_timestamp)
+
+        # assume the database read the clock halfway through the round trip
+        self._db_clock_offset = db_time.unix - (local_before + local_after) / 2.
+        self._db_clock_offset_checked = local_after
+
         return db_time
 
     def _time_filter(self, table_object, time_column, starttime, stoptime=None,
-                     filter_column=None, filter_value=None):
+                     filter_column=None, filter_value=None, columns=None,
+                     as_arrays=False):
         '''
         A helper method to fiter entries by time. Used by most get methods
         on this object.
@@ -71,9 +331,55 @@ class MCSession(Session):
         filter_value: type coresponding to filter_column, usually a string
             value to require that the filter_column is equal to
 
+        columns: list of strings
+            column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        as_arrays: boolean
+            If True, run a core SELECT and return a dict of numpy arrays
+            keyed by column name rather than a list of objects. This skips
+            the ORM entirely, which is much faster and uses much less memory
+            for large queries. Rows are ordered by time.
+
+        Returns:
+        --------
+        list of objects that match the filtering, or a dict of numpy arrays
+        if as_arrays is True or columns is set
+        '''
+        conditions = self._time_filter_conditions(table_object, time_column, starttime,
+                                                  stoptime=stoptime,
+                                                  filter_column=filter_column,
+                                                  filter_value=filter_value)
+        time_col = getattr(table_object, time_column)
+
+        if columns is None and not as_arrays:
+            query = self.query(table_object).filter(*conditions)
+            if stoptime is None:
+                query = query.order_by(time_col).limit(1)
+            return query.all()
+
+        if columns is None:
+            columns = table_object.__table__.columns.keys()
+        else:
+            columns = list(get_iterable(columns))
+        table_columns = [table_object.__table__.columns[name] for name in columns]
+
+        stmt = select(table_columns).where(and_(*conditions)).order_by(time_col)
+        if stoptime is None:
+            stmt = stmt.limit(1)
+
+        return _rows_to_arrays(self.execute(stmt).fetchall(), table_columns)
+
+    def _time_filter_conditions(self, table_object, time_column, starttime,
+                                stoptime=None, filter_column=None, filter_value=None):
+        '''
+        A helper method to build the filter conditions used by _time_filter.
+        See _time_filter for a description of the parameters. filter_column
+        and filter_value can also be lists to filter on several columns.
+
         Returns:
         --------
-        list of objects that match the filtering
+        list of SQLAlchemy filter conditions
         '''
         if not isinstance(starttime, Time):
             raise ValueError('starttime must be an astropy time object. '
@@ -84,28 +390,545 @@ class MCSession(Session):
                 raise ValueError('stoptime must be an astropy time object. '
                                  'value was: {t}'.format(t=stoptime))
 
+        time_col = getattr(table_object, time_column)
+
+        # Most tables store times as floored gps seconds, but a few (e.g.
+        # autocorrelations) use UTC DateTime columns.
+        if isinstance(table_object.__table__.columns[time_column].type, DateTime):
+            def time_value(t):
+                return t.utc.datetime
+        else:
+            def time_value(t):
+                return t.gps
+
+        conditions = []
+        if isinstance(filter_column, (list, tuple)):
+            # several filters, e.g. from iter_table
+            for column, value in zip(filter_column, filter_value):
+                if value is not None:
+                    conditions.append(getattr(table_object, column) == value)
+        elif filter_value is not None:
+            conditions.append(getattr(table_object, filter_column) == filter_value)
+
         if stoptime is not None:
-            if filter_value is not None:
-                result_list = self.query(table_object).filter(
-                    getattr(table_object, filter_column) == filter_value,
-                    getattr(table_object, time_column).between(
-                        starttime.gps, stoptime.gps)).all()
-            else:
-                result_list = self.query(table_object).filter(
-                    getattr(table_object, time_column).between(
-                        starttime.gps, stoptime.gps)).all()
+            conditions.append(time_col.between(time_value(starttime), time_value(stoptime)))
         else:
-            if filter_value is not None:
-                result_list = self.query(table_object).filter(
-                    getattr(table_object, filter_column) == filter_value,
-                    getattr(table_object, time_column) >= starttime.gps).order_by(
-                        getattr(table_object, time_column)).limit(1).all()
+            conditions.append(time_col >= time_value(starttime))
+
+        return conditions
+
+    def _iter_time_filter(self, table_object, time_column, starttime, stoptime=None,
+                          filter_column=None, filter_value=None, chunk_size=1000,
+                          columns=None, as_arrays=False):
+        '''
+        A streaming version of _time_filter. Used by the iter methods on
+        this object.
+
+        Rows are read through a server-side cursor (where the database
+        supports it) and yielded in chunks, so memory use stays constant no
+        matter how wide the time range is. Rows are ordered by time.
+
+        Parameters:
+        table_object: object
+            Table object to query.
+
+        time_column: string
+            column name holding the time to filter on.
+
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be streamed.
+
+        filter_column: string
+            column name to use as an additional filter (often a part of the primary key)
+
+        filter_value: type coresponding to filter_column, usually a string
+            value to require that the filter_column is equal to
+
+        chunk_size: integer
+            number of rows in each yielded chunk
+
+        columns: list of strings
+            column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name rather
+            than lists of objects.
+
+        Yields:
+        --------
+        lists of up to chunk_size objects, or dicts of numpy arrays if
+        as_arrays is True or columns is set
+        '''
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+
+        conditions = self._time_filter_conditions(table_object, time_column, starttime,
+                                                  stoptime=stoptime,
+                                                  filter_column=filter_column,
+                                                  filter_value=filter_value)
+        time_col = getattr(table_object, time_column)
+
+        if columns is None and not as_arrays:
+            query = (self.query(table_object).filter(*conditions).order_by(time_col)
+                     .yield_per(chunk_size))
+            chunk = []
+            for obj in query:
+                chunk.append(obj)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if len(chunk) > 0:
+                yield chunk
+            return
+
+        if columns is None:
+            columns = table_object.__table__.columns.keys()
+        else:
+            columns = list(get_iterable(columns))
+        table_columns = [table_object.__table__.columns[name] for name in columns]
+
+        stmt = (select(table_columns).where(and_(*conditions)).order_by(time_col)
+                .execution_options(stream_results=True))
+        result = self.execute(stmt)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+                yield _rows_to_arrays(rows, table_columns)
+        finally:
+            result.close()
+
+    def iter_table(self, table_name, starttime, stoptime=None, filters=None, columns=None,
+                   chunk_size=10000):
+        """
+        Stream the rows of any time-filtered table in chunks of numpy arrays,
+        e.g. for dumping them to files. Rows are read through a server-side
+        cursor (where the database supports it), so the first chunk arrives
+        quickly and memory use does not depend on the size of the time range.
+
+        Parameters:
+        ------------
+        table_name: string
+            name of the table, e.g. 'weather_data'. The time column is found
+            with hera_mc.get_time_column.
+
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        filters: dict
+            column names and values to require those columns to be equal to.
+
+        columns: list of strings
+            column names to return. Defaults to all columns.
+
+        chunk_size: integer
+            number of rows in each chunk
+
+        Yields:
+        --------
+        dicts of numpy arrays keyed by column name, ordered by time
+        """
+        from . import get_table_class, get_time_column
+
+        table_object = get_table_class(table_name)
+        if filters is None:
+            filters = {}
+        for name in list(filters.keys()) + list(get_iterable(columns or [])):
+            if name not in table_object.__table__.columns:
+                raise ValueError('no column {0!r} in table {1}'.format(name, table_name))
+
+        return self._iter_time_filter(table_object, get_time_column(table_name), starttime,
+                                      stoptime=stoptime, filter_column=list(filters.keys()),
+                                      filter_value=list(filters.values()),
+                                      chunk_size=chunk_size, as_arrays=True, columns=columns)
+
+    def _time_bucket(self, time_col, bin_seconds):
+        '''
+        A helper method to build an SQL expression flooring a time column to
+        the start of its bin. Used by get_aggregated.
+
+        Parameters:
+        time_col: SQLAlchemy column
+            column holding the time to bin. Either integer gps seconds or a
+            UTC DateTime.
+
+        bin_seconds: integer
+            width of the bins in seconds
+
+        Returns:
+        --------
+        SQLAlchemy expression giving the bin start in the same units as
+        time_col (gps seconds), or in unix seconds for DateTime columns.
+        '''
+        bin_literal = literal_column(str(int(bin_seconds)))
+
+        if not isinstance(time_col.type, DateTime):
+            # integer division floors for the (positive) gps times we store
+            return (time_col / bin_literal) * bin_literal
+
+        if self.get_bind().dialect.name == 'postgresql':
+            epoch = extract('epoch', time_col)
+            return cast(func.floor(epoch / bin_literal) * bin_literal, BigInteger)
+
+        # portable fallback (SQLite stores DateTimes as ISO strings)
+        epoch = cast(func.strftime('%s', time_col), BigInteger)
+        return (epoch / bin_literal) * bin_literal
+
+    @cached_query
+    def get_aggregated(self, table_object, time_column, bin_seconds, agg, starttime,
+                       stoptime, group_by=None, value_columns=None, filter_column=None,
+                       filter_value=None, use_rollups=True):
+        """
+        Get time-bucketed aggregates of a table from the M&C database.
+
+        The bucketing and aggregation are done in SQL so only one row per
+        time bin (and group) is returned from the database. On PostgreSQL
+        the 'last' aggregate uses DISTINCT ON; other databases use a
+        ROW_NUMBER() window over each bin. Rows tied at the last time in a
+        bin are broken by the rest of the primary key.
+
+        For tables handled by the retention system, the rollups of the
+        coarsest tier whose bins evenly divide bin_seconds are used where
+        they exist (see retention.get_rollup_aggregates), so aggregates keep
+        working after the raw rows are removed. 'last' cannot be computed from
+        the rollups, so it raises a ValueError for time ranges whose raw rows
+        have been removed.
+
+        Parameters:
+        ------------
+        table_object: object
+            Table object to query.
+
+        time_column: string
+            column name holding the time to bin on.
+
+        bin_seconds: integer
+            width of the time bins in seconds
+
+        agg: string
+            aggregate to compute for each bin. One of 'mean', 'min', 'max',
+            'sum', 'count' or 'last'.
+
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for.
+
+        group_by: string or list of strings
+            column name(s) to aggregate separately, e.g. hostname or roach.
+            If none, all rows in a bin are aggregated together.
+
+        value_columns: string or list of strings
+            column name(s) to aggregate. Defaults to all Float columns that
+            are not used for grouping.
+
+        filter_column: string
+            column name to use as an additional filter (often a part of the primary key)
+
+        filter_value: type coresponding to filter_column, usually a string
+            value to require that the filter_column is equal to
+
+        use_rollups: boolean
+            If False, always aggregate the raw rows.
+
+        Returns:
+        --------
+        dict of numpy arrays keyed by column name, ordered by bin. The bin
+        start times are under the time_column key, as gps seconds or as
+        datetime64 values for DateTime time columns.
+        """
+        if agg not in aggregate_functions and agg != 'last':
+            raise ValueError('agg must be one of: {aggs}'.format(
+                aggs=sorted(list(aggregate_functions.keys()) + ['last'])))
+        if int(bin_seconds) != bin_seconds or bin_seconds < 1:
+            raise ValueError('bin_seconds must be a positive integer')
+        if stoptime is None:
+            raise ValueError('stoptime must be specified for aggregated queries')
+
+        conditions = self._time_filter_conditions(table_object, time_column, starttime,
+                                                  stoptime=stoptime,
+                                                  filter_column=filter_column,
+                                                  filter_value=filter_value)
+
+        table = table_object.__table__
+        if use_rollups:
+            from .retention import get_rollup_aggregates
+
+            arrays = get_rollup_aggregates(
+                self, table, time_column, bin_seconds, agg, starttime, stoptime,
+                group_by=None if group_by is None else list(get_iterable(group_by)),
+                value_columns=(None if value_columns is None
+                               else list(get_iterable(value_columns))),
+                filter_column=filter_column, filter_value=filter_value)
+            if arrays is not None:
+                return arrays
+
+        time_col = table.columns[time_column]
+        if group_by is None:
+            group_cols = []
+        else:
+            group_cols = [table.columns[name] for name in get_iterable(group_by)]
+        if value_columns is None:
+            value_cols = [col for col in table.columns
+                          if isinstance(col.type, Float) and col not in group_cols]
+        else:
+            value_cols = [table.columns[name] for name in get_iterable(value_columns)]
+
+        bucket = self._time_bucket(time_col, bin_seconds).label(time_column)
+        # rows tied at the last time in a bin are ordered by the rest of the
+        # primary key so 'last' always keeps the same single row
+        tie_breakers = [col.desc() for col in table.primary_key.columns
+                        if col is not time_col and col not in group_cols]
+
+        if agg != 'last':
+            agg_func = aggregate_functions[agg]
+            value_cols = [agg_func(col).label(col.name) for col in value_cols]
+            stmt = (select([bucket] + group_cols + value_cols)
+                    .where(and_(*conditions))
+                    .group_by(self._time_bucket(time_col, bin_seconds), *group_cols)
+                    .order_by(bucket, *group_cols))
+        elif self.get_bind().dialect.name == 'postgresql':
+            stmt = (select([bucket] + group_cols + value_cols)
+                    .where(and_(*conditions))
+                    .distinct(self._time_bucket(time_col, bin_seconds), *group_cols)
+                    .order_by(self._time_bucket(time_col, bin_seconds), *group_cols)
+                    .order_by(time_col.desc(), *tie_breakers))
+        else:
+            row_number = func.row_number().over(
+                partition_by=[self._time_bucket(time_col, bin_seconds)] + group_cols,
+                order_by=[time_col.desc()] + tie_breakers).label('row_number')
+            ranked = (select([bucket] + group_cols + value_cols + [row_number])
+                      .where(and_(*conditions))
+                      .alias('ranked'))
+            ranked_cols = [ranked.c[col.name] for col in [bucket] + group_cols + value_cols]
+            stmt = (select(ranked_cols)
+                    .where(ranked.c.row_number == 1)
+                    .order_by(*ranked_cols[:len(group_cols) + 1]))
+
+        arrays = _rows_to_arrays(self.execute(stmt).fetchall(),
+                                 [bucket] + group_cols + value_cols)
+
+        if isinstance(time_col.type, DateTime):
+            arrays[time_column] = arrays[time_column].astype(np.int64).astype('datetime64[s]')
+        if agg == 'count':
+            # also int64 when there are no rows, as for the rollups
+            for col in value_cols:
+                arrays[col.name] = arrays[col.name].astype(np.int64)
+
+        return arrays
+
+    @cached_query
+    def get_latest(self, table_object, key_column, time_column='time', starttime=None):
+        """
+        Get the most recent record for each value of a key column (e.g. the
+        latest status of every host) in a single query.
+
+        On PostgreSQL this uses DISTINCT ON, other databases use a portable
+        join against the latest time for each key.
+
+        Parameters:
+        ------------
+        table_object: object
+            Table object to query.
+
+        key_column: string or list of strings
+            column name(s) to get the latest record for each value of.
+
+        time_column: string
+            column name holding the time to order by.
+
+        starttime: astropy time object
+            If set, only look at records after this time, which can make the
+            query much cheaper on large tables. Keys with no records after
+            starttime are not returned.
+
+        Returns:
+        --------
+        list of table_object objects, one per key, ordered by key
+        """
+        key_cols = [getattr(table_object, name) for name in get_iterable(key_column)]
+        time_col = getattr(table_object, time_column)
+
+        if starttime is None:
+            conditions = []
+        else:
+            if not isinstance(starttime, Time):
+                raise ValueError('starttime must be an astropy time object. '
+                                 'value was: {t}'.format(t=starttime))
+            if isinstance(time_col.type, DateTime):
+                conditions = [time_col >= starttime.utc.datetime]
             else:
-                result_list = self.query(table_object).filter(
-                    getattr(table_object, time_column) >= starttime.gps).order_by(
-                        getattr(table_object, time_column)).limit(1).all()
+                conditions = [time_col >= starttime.gps]
+
+        if self.get_bind().dialect.name == 'postgresql':
+            return (self.query(table_object).filter(*conditions)
+                    .distinct(*key_cols).order_by(*key_cols)
+                    .order_by(time_col.desc()).all())
+
+        latest = (self.query(func.max(time_col).label('latest_time'), *key_cols)
+                  .filter(*conditions).group_by(*key_cols).subquery('latest'))
+        join_conditions = [time_col == latest.c.latest_time]
+        join_conditions += [col == latest.c[col.key] for col in key_cols]
+        return (self.query(table_object).join(latest, and_(*join_conditions))
+                .order_by(*key_cols).all())
+
+    def apply_retention(self, raw_retention_days=None, tables=None, keep_raw=False,
+                        archive_dir=None):
+        """
+        Roll up raw telemetry rows older than the retention age into the
+        telemetry_rollup table, remove them and expire old rollups. See
+        retention.apply_retention for the tables, tiers and defaults.
+
+        Parameters:
+        ------------
+        raw_retention_days: float
+            age in days after which raw rows are rolled up and removed.
+            Defaults to retention.default_raw_retention_days.
+
+        tables: list of strings
+            tables to process. Defaults to all tables in retention.retention_tables.
 
-        return result_list
+        keep_raw: boolean
+            If True, compute the rollups but keep the raw rows.
+
+        archive_dir: string
+            If set, save the raw rows to numpy .npz files in this directory
+            before deleting them.
+
+        Returns:
+        --------
+        dict keyed by table name of dicts with the numbers of rollup records
+        computed, raw rows deleted and rollup records expired
+        """
+        from .retention import apply_retention
+
+        return apply_retention(self, raw_retention_days=raw_retention_days, tables=tables,
+                               keep_raw=keep_raw, archive_dir=archive_dir)
+
+    def export_archive(self, table_name, archive_dir, starttime, stoptime=None,
+                       partition_seconds=None):
+        """
+        Export the rows of a table in a time range to time-partitioned
+        columnar files that can be read back without the database with
+        archive.ArchiveReader. See archive.export_table for details.
+
+        Parameters:
+        ------------
+        table_name: string
+            name of the table to export, e.g. 'weather_data'.
+
+        archive_dir: string
+            directory of the archive.
+
+        starttime: astropy time object
+            export rows after this time. Widened to the start of its partition.
+
+        stoptime: astropy time object
+            export rows up to this time. Widened to the end of its partition.
+            If None, export all rows after starttime.
+
+        partition_seconds: integer
+            length of the partitions in seconds. Defaults to
+            archive.default_partition_seconds (one day).
+
+        Returns:
+        --------
+        list of dicts describing the partitions written
+        """
+        from .archive import export_table, default_partition_seconds
+
+        if partition_seconds is None:
+            partition_seconds = default_partition_seconds
+        return export_table(self, table_name, archive_dir, starttime, stoptime=stoptime,
+                            partition_seconds=partition_seconds)
+
+    def _bulk_insert(self, table_object, rows, ignore_duplicates=False):
+        '''
+        A helper method to insert many rows with a single executemany call,
+        bypassing the ORM unit of work. Used by the add_*_bulk methods on
+        this object.
+
+        Parameters:
+        table_object: object
+            Table object to insert into.
+
+        rows: list of dicts
+            One dict per row mapping column names to values. Values should be
+            plain python types rather than numpy scalars.
+
+        ignore_duplicates: boolean
+            If True, silently skip rows whose primary key is already in the
+            database (or earlier in rows). Uses multi-row
+            `INSERT ... ON CONFLICT DO NOTHING` on PostgreSQL and
+            `INSERT OR IGNORE` on SQLite.
+        '''
+        if len(rows) == 0:
+            return
+
+        # make sure any pending ORM objects (e.g. rows referenced by foreign
+        # keys) are written first
+        self.flush()
+
+        table = table_object.__table__
+        if not ignore_duplicates:
+            self.execute(table.insert(), rows)
+            return
+
+        dialect = self.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+
+            pkey_names = [col.name for col in table.primary_key.columns]
+            for start in range(0, len(rows), insert_chunk_size):
+                stmt = (insert(table).values(rows[start:start + insert_chunk_size])
+                        .on_conflict_do_nothing(index_elements=pkey_names))
+                self.execute(stmt)
+        elif dialect == 'sqlite':
+            self.execute(table.insert().prefix_with('OR IGNORE'), rows)
+        else:
+            raise NotImplementedError('ignoring duplicate rows is only supported on '
+                                      'PostgreSQL and SQLite, not {0}'.format(dialect))
+
+    def add_all_ignore_duplicates(self, obj_list):
+        """
+        Add table objects to the M&C database, skipping any whose primary key
+        is already present. The objects are written immediately with batched
+        inserts rather than through the ORM, so re-running dense sampling or
+        backfills is cheap and safe.
+
+        Parameters:
+        ------------
+        obj_list: list of table objects
+            objects to add, e.g. made with the create methods of the table
+            classes. Can be a mix of tables.
+        """
+        from sqlalchemy import inspect
+
+        rows_by_class = {}
+        class_order = []
+        for obj in obj_list:
+            mapper = inspect(obj).mapper
+            if mapper.class_ not in rows_by_class:
+                rows_by_class[mapper.class_] = []
+                class_order.append(mapper.class_)
+            rows_by_class[mapper.class_].append(
+                dict((col.expression.name, getattr(obj, col.key))
+                     for col in mapper.column_attrs))
+
+        for table_class in class_order:
+            self._bulk_insert(table_class, rows_by_class[table_class],
+                              ignore_duplicates=True)
 
     def add_obs(self, starttime, stoptime, obsid):
         """
@@ -128,6 +951,7 @@ class MCSession(Session):
 
         self.add(Observation.create(starttime, stoptime, obsid, hera_cofa))
 
+    @cached_query
     def get_obs(self, obsid=None):
         """
         Get observation(s) from the M&C database.
@@ -152,7 +976,8 @@ class MCSession(Session):
 
         return obs_list
 
-    def get_obs_by_time(self, starttime, stoptime=None):
+    @cached_query
+    def get_obs_by_time(self, starttime, stoptime=None, as_arrays=False, columns=None):
         """
         Get observation(s) from the M&C database.
 
@@ -165,13 +990,61 @@ class MCSession(Session):
             last time to get records for. If none, only the first record after
             starttime will be returned.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of Observation objects
+        list of Observation objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .observations import Observation
 
-        return self._time_filter(Observation, 'obsid', starttime, stoptime=stoptime)
+        return self._time_filter(Observation, 'obsid', starttime, stoptime=stoptime,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_obs_by_time(self, starttime, stoptime=None, chunk_size=1000,
+                         as_arrays=False, columns=None):
+        """
+        Stream observation record(s) from the M&C database in chunks. Unlike
+        get_obs_by_time, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of Observation objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .observations import Observation
+
+        return self._iter_time_filter(Observation, 'obsid', starttime,
+                                      stoptime=stoptime,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_server_status(self, subsystem, hostname, ip_address, system_time, num_cores,
                           cpu_load_pct, uptime_days, memory_used_pct, memory_size_gb,
@@ -220,7 +1093,10 @@ class MCSession(Session):
                                      memory_size_gb, disk_space_pct, disk_size_gb,
                                      network_bandwidth_mbs=network_bandwidth_mbs))
 
-    def get_server_status(self, subsystem, starttime, stoptime=None, hostname=None):
+    @cached_query
+    def get_server_status(self, subsystem, starttime, stoptime=None, hostname=None,
+                          as_arrays=False, columns=None, bin_seconds=None,
+                          agg='mean'):
         """
         Get subsystem server_status record(s) from the M&C database.
 
@@ -239,9 +1115,27 @@ class MCSession(Session):
         hostname: string
             hostname to get records for. If none, all hostnames will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        bin_seconds: integer
+            If set, return a dict of numpy arrays of time-bucketed aggregates
+            (one row per bin of this many seconds per hostname) computed in
+            SQL rather than raw records. Requires stoptime. See get_aggregated.
+
+        agg: string
+            aggregate to compute when bin_seconds is set. One of 'mean',
+            'min', 'max', 'sum', 'count' or 'last'.
+
         Returns:
         --------
-        list of ServerStatus objects
+        list of ServerStatus objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         if subsystem == 'rtp':
             from .rtp import RTPServerStatus as ServerStatus
@@ -250,9 +1144,92 @@ class MCSession(Session):
         else:
             raise ValueError('subsystem must be one of: ["rtp", "lib"]')
 
+        if bin_seconds is not None:
+            return self.get_aggregated(ServerStatus, 'mc_time', bin_seconds, agg,
+                                       starttime, stoptime, group_by='hostname',
+                                       filter_column='hostname', filter_value=hostname)
+
         return self._time_filter(ServerStatus, 'mc_time', starttime,
                                  stoptime=stoptime, filter_column='hostname',
-                                 filter_value=hostname)
+                                 filter_value=hostname,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_server_status(self, subsystem, starttime, stoptime=None, hostname=None,
+                           chunk_size=1000, as_arrays=False, columns=None):
+        """
+        Stream subsystem server_status record(s) from the M&C database in chunks. Unlike
+        get_server_status, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        subsystem: string
+            name of subsystem. Must be one of ['rtp', 'lib']
+
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        hostname: string
+            hostname to get records for. If none, all hostnames will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of ServerStatus objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        if subsystem == 'rtp':
+            from .rtp import RTPServerStatus as ServerStatus
+        elif subsystem == 'lib':
+            from .librarian import LibServerStatus as ServerStatus
+        else:
+            raise ValueError('subsystem must be one of: ["rtp", "lib"]')
+
+        return self._iter_time_filter(ServerStatus, 'mc_time', starttime,
+                                      stoptime=stoptime, filter_column='hostname',
+                                      filter_value=hostname,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
+
+    @cached_query
+    def get_latest_server_status(self, subsystem, starttime=None):
+        """
+        Get the most recent server_status record for each host of a subsystem.
+
+        Parameters:
+        ------------
+        subsystem: string
+            name of subsystem. Must be one of ['rtp', 'lib']
+
+        starttime: astropy time object
+            If set, only look at records after this time.
+
+        Returns:
+        --------
+        list of ServerStatus objects, one per hostname
+        """
+        if subsystem == 'rtp':
+            from .rtp import RTPServerStatus as ServerStatus
+        elif subsystem == 'lib':
+            from .librarian import LibServerStatus as ServerStatus
+        else:
+            raise ValueError('subsystem must be one of: ["rtp", "lib"]')
+
+        return self.get_latest(ServerStatus, 'hostname', time_column='mc_time',
+                               starttime=starttime)
 
     def add_subsystem_error(self, time, subsystem, severity, log):
         """
@@ -275,7 +1252,9 @@ class MCSession(Session):
 
         self.add(SubsystemError.create(db_time, time, subsystem, severity, log))
 
-    def get_subsystem_error(self, starttime, stoptime=None, subsystem=None):
+    @cached_query
+    def get_subsystem_error(self, starttime, stoptime=None, subsystem=None,
+                            as_arrays=False, columns=None):
         """
         Get subsystem server_status record(s) from the M&C database.
 
@@ -294,15 +1273,67 @@ class MCSession(Session):
         subsystem: string
             subsystem to get records for. If none, all subsystems will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of SubsystemError objects
+        list of SubsystemError objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .subsystem_error import SubsystemError
 
         return self._time_filter(SubsystemError, 'time', starttime,
                                  stoptime=stoptime, filter_column='subsystem',
-                                 filter_value=subsystem)
+                                 filter_value=subsystem,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_subsystem_error(self, starttime, stoptime=None, subsystem=None, chunk_size=1000,
+                             as_arrays=False, columns=None):
+        """
+        Stream subsystem_error record(s) from the M&C database in chunks. Unlike
+        get_subsystem_error, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        subsystem: string
+            subsystem to get records for. If none, all subsystems will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of SubsystemError objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .subsystem_error import SubsystemError
+
+        return self._iter_time_filter(SubsystemError, 'time', starttime,
+                                      stoptime=stoptime, filter_column='subsystem',
+                                      filter_value=subsystem,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_lib_status(self, time, num_files, data_volume_gb, free_space_gb,
                        upload_min_elapsed, num_processes, git_version, git_hash):
@@ -334,7 +1365,8 @@ class MCSession(Session):
                                   free_space_gb, upload_min_elapsed,
                                   num_processes, git_version, git_hash))
 
-    def get_lib_status(self, starttime, stoptime=None):
+    @cached_query
+    def get_lib_status(self, starttime, stoptime=None, as_arrays=False, columns=None):
         """
         Get lib_status record(s) from the M&C database.
 
@@ -347,14 +1379,62 @@ class MCSession(Session):
             last time to get records for. If none, only the first record after
             starttime will be returned.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of LibStatus objects
+        list of LibStatus objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .librarian import LibStatus
 
         return self._time_filter(LibStatus, 'time', starttime,
-                                 stoptime=stoptime)
+                                 stoptime=stoptime,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_lib_status(self, starttime, stoptime=None, chunk_size=1000,
+                        as_arrays=False, columns=None):
+        """
+        Stream lib_status record(s) from the M&C database in chunks. Unlike
+        get_lib_status, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of LibStatus objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .librarian import LibStatus
+
+        return self._iter_time_filter(LibStatus, 'time', starttime,
+                                      stoptime=stoptime,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_lib_raid_status(self, time, hostname, num_disks, info):
         """
@@ -375,7 +1455,9 @@ class MCSession(Session):
 
         self.add(LibRAIDStatus.create(time, hostname, num_disks, info))
 
-    def get_lib_raid_status(self, starttime, stoptime=None, hostname=None):
+    @cached_query
+    def get_lib_raid_status(self, starttime, stoptime=None, hostname=None,
+                            as_arrays=False, columns=None):
         """
         Get lib_raid_status record(s) from the M&C database.
 
@@ -391,15 +1473,67 @@ class MCSession(Session):
         hostname: string
             RAID hostname to get records for. If none, all hostnames will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of LibRAIDStatus objects
+        list of LibRAIDStatus objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .librarian import LibRAIDStatus
 
         return self._time_filter(LibRAIDStatus, 'time', starttime,
                                  stoptime=stoptime, filter_column='hostname',
-                                 filter_value=hostname)
+                                 filter_value=hostname,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_lib_raid_status(self, starttime, stoptime=None, hostname=None, chunk_size=1000,
+                             as_arrays=False, columns=None):
+        """
+        Stream lib_raid_status record(s) from the M&C database in chunks. Unlike
+        get_lib_raid_status, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        hostname: string
+            RAID hostname to get records for. If none, all hostnames will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of LibRAIDStatus objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .librarian import LibRAIDStatus
+
+        return self._iter_time_filter(LibRAIDStatus, 'time', starttime,
+                                      stoptime=stoptime, filter_column='hostname',
+                                      filter_value=hostname,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_lib_raid_error(self, time, hostname, disk, log):
         """
@@ -420,7 +1554,34 @@ class MCSession(Session):
 
         self.add(LibRAIDErrors.create(time, hostname, disk, log))
 
-    def get_lib_raid_error(self, starttime, stoptime=None, hostname=None):
+    def add_lib_raid_error_bulk(self, times, hostnames, disks, logs):
+        """
+        Add many lib_raid_error rows with a single executemany call.
+
+        Parameters:
+        ------------
+        times: astropy time object
+            (array valued) times of these errors
+        hostnames: string or sequence of strings
+            names of RAID servers with errors. A single string applies to all times.
+        disks: string or sequence of strings
+            names of disks with errors. A single string applies to all times.
+        logs: string or sequence of strings
+            error messages or log file names (TBD)
+        """
+        from .librarian import LibRAIDErrors
+
+        time_list = get_gps_floor_list(times)
+        hostname_list, disk_list, log_list = get_column_lists(len(time_list), hostnames,
+                                                              disks, logs)
+
+        rows = [dict(time=t, hostname=h, disk=d, log=l) for t, h, d, l
+                in zip(time_list, hostname_list, disk_list, log_list)]
+        self._bulk_insert(LibRAIDErrors, rows)
+
+    @cached_query
+    def get_lib_raid_error(self, starttime, stoptime=None, hostname=None,
+                           as_arrays=False, columns=None):
         """
         Get lib_raid_error record(s) from the M&C database.
 
@@ -436,15 +1597,67 @@ class MCSession(Session):
         hostname: string
             RAID hostname to get records for. If none, all hostnames will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of LibRAIDErrors objects
+        list of LibRAIDErrors objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .librarian import LibRAIDErrors
 
         return self._time_filter(LibRAIDErrors, 'time', starttime,
                                  stoptime=stoptime, filter_column='hostname',
-                                 filter_value=hostname)
+                                 filter_value=hostname,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_lib_raid_error(self, starttime, stoptime=None, hostname=None, chunk_size=1000,
+                            as_arrays=False, columns=None):
+        """
+        Stream lib_raid_error record(s) from the M&C database in chunks. Unlike
+        get_lib_raid_error, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        hostname: string
+            RAID hostname to get records for. If none, all hostnames will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of LibRAIDErrors objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .librarian import LibRAIDErrors
+
+        return self._iter_time_filter(LibRAIDErrors, 'time', starttime,
+                                      stoptime=stoptime, filter_column='hostname',
+                                      filter_value=hostname,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_lib_remote_status(self, time, remote_name, ping_time,
                               num_file_uploads, bandwidth_mbs):
@@ -469,7 +1682,9 @@ class MCSession(Session):
         self.add(LibRemoteStatus.create(time, remote_name, ping_time,
                                         num_file_uploads, bandwidth_mbs))
 
-    def get_lib_remote_status(self, starttime, stoptime=None, remote_name=None):
+    @cached_query
+    def get_lib_remote_status(self, starttime, stoptime=None, remote_name=None,
+                              as_arrays=False, columns=None):
         """
         Get lib_remote_status record(s) from the M&C database.
 
@@ -486,15 +1701,68 @@ class MCSession(Session):
             Name of remote librarian to get records for. If none, all
             remote_names will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of LibRemoteStatus objects
+        list of LibRemoteStatus objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .librarian import LibRemoteStatus
 
         return self._time_filter(LibRemoteStatus, 'time', starttime,
                                  stoptime=stoptime, filter_column='remote_name',
-                                 filter_value=remote_name)
+                                 filter_value=remote_name,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_lib_remote_status(self, starttime, stoptime=None, remote_name=None,
+                               chunk_size=1000, as_arrays=False, columns=None):
+        """
+        Stream lib_remote_status record(s) from the M&C database in chunks. Unlike
+        get_lib_remote_status, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        remote_name: string
+            Name of remote librarian to get records for. If none, all
+            remote_names will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of LibRemoteStatus objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .librarian import LibRemoteStatus
+
+        return self._iter_time_filter(LibRemoteStatus, 'time', starttime,
+                                      stoptime=stoptime, filter_column='remote_name',
+                                      filter_value=remote_name,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_lib_file(self, filename, obsid, time, size_gb):
         """
@@ -515,6 +1783,7 @@ class MCSession(Session):
 
         self.add(LibFiles.create(filename, obsid, time, size_gb))
 
+    @cached_query
     def get_lib_files(self, filename=None, obsid=None, starttime=None, stoptime=None):
         """
         Get lib_files record(s) from the M&C database.
@@ -584,7 +1853,8 @@ class MCSession(Session):
         self.add(RTPStatus.create(time, status, event_min_elapsed, num_processes,
                                   restart_hours_elapsed))
 
-    def get_rtp_status(self, starttime, stoptime=None):
+    @cached_query
+    def get_rtp_status(self, starttime, stoptime=None, as_arrays=False, columns=None):
         """
         Get rtp_status record(s) from the M&C database.
 
@@ -597,14 +1867,62 @@ class MCSession(Session):
             last time to get records for. If none, only the first record after
             starttime will be returned.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of RTPStatus objects
+        list of RTPStatus objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .rtp import RTPStatus
 
         return self._time_filter(RTPStatus, 'time', starttime,
-                                 stoptime=stoptime)
+                                 stoptime=stoptime,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_rtp_status(self, starttime, stoptime=None, chunk_size=1000,
+                        as_arrays=False, columns=None):
+        """
+        Stream rtp_status record(s) from the M&C database in chunks. Unlike
+        get_rtp_status, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of RTPStatus objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .rtp import RTPStatus
+
+        return self._iter_time_filter(RTPStatus, 'time', starttime,
+                                      stoptime=stoptime,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_rtp_process_event(self, time, obsid, event):
         """
@@ -623,9 +1941,49 @@ class MCSession(Session):
 
         self.add(RTPProcessEvent.create(time, obsid, event))
 
-    def get_rtp_process_event(self, starttime, stoptime=None, obsid=None):
+    @cached_query
+    def get_rtp_process_event(self, starttime, stoptime=None, obsid=None,
+                              as_arrays=False, columns=None):
+        """
+        Get rtp_process_event record(s) from the M&C database.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, only the first record after
+            starttime will be returned.
+
+        obsid: long
+            obsid to get records for. If none, all obsid will be included.
+
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Returns:
+        --------
+        list of RTPProcessEvent objects, or a dict of numpy arrays if as_arrays or columns is set
+        """
+        from .rtp import RTPProcessEvent
+
+        return self._time_filter(RTPProcessEvent, 'time', starttime,
+                                 stoptime=stoptime, filter_column='obsid',
+                                 filter_value=obsid,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_rtp_process_event(self, starttime, stoptime=None, obsid=None, chunk_size=1000,
+                               as_arrays=False, columns=None):
         """
-        Get rtp_process_event record(s) from the M&C database.
+        Stream rtp_process_event record(s) from the M&C database in chunks. Unlike
+        get_rtp_process_event, memory use does not grow with the width of the time range.
 
         Parameters:
         ------------
@@ -633,21 +1991,35 @@ class MCSession(Session):
             time to look for records after
 
         stoptime: astropy time object
-            last time to get records for. If none, only the first record after
-            starttime will be returned.
+            last time to get records for. If none, all records after
+            starttime will be included.
 
         obsid: long
             obsid to get records for. If none, all obsid will be included.
 
-        Returns:
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
         --------
-        list of RTPProcessEvent objects
+        lists of RTPProcessEvent objects, or dicts of numpy arrays if as_arrays or
+        columns is set
         """
         from .rtp import RTPProcessEvent
 
-        return self._time_filter(RTPProcessEvent, 'time', starttime,
-                                 stoptime=stoptime, filter_column='obsid',
-                                 filter_value=obsid)
+        return self._iter_time_filter(RTPProcessEvent, 'time', starttime,
+                                      stoptime=stoptime, filter_column='obsid',
+                                      filter_value=obsid,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_rtp_process_record(self, time, obsid, pipeline_list, rtp_git_version,
                                rtp_git_hash, hera_qm_git_version, hera_qm_git_hash,
@@ -689,7 +2061,9 @@ class MCSession(Session):
                                          hera_cal_git_version, hera_cal_git_hash,
                                          pyuvdata_git_version, pyuvdata_git_hash))
 
-    def get_rtp_process_record(self, starttime, stoptime=None, obsid=None):
+    @cached_query
+    def get_rtp_process_record(self, starttime, stoptime=None, obsid=None,
+                               as_arrays=False, columns=None):
         """
         Get rtp_process_record record(s) from the M&C database.
 
@@ -705,15 +2079,67 @@ class MCSession(Session):
         obsid: long
             obsid to get records for. If none, all obsid will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
         Returns:
         --------
-        list of RTPProcessEvent objects
+        list of RTPProcessEvent objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .rtp import RTPProcessRecord
 
         return self._time_filter(RTPProcessRecord, 'time', starttime,
                                  stoptime=stoptime, filter_column='obsid',
-                                 filter_value=obsid)
+                                 filter_value=obsid,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_rtp_process_record(self, starttime, stoptime=None, obsid=None, chunk_size=1000,
+                                as_arrays=False, columns=None):
+        """
+        Stream rtp_process_record record(s) from the M&C database in chunks. Unlike
+        get_rtp_process_record, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        obsid: long
+            obsid to get records for. If none, all obsid will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of RTPProcessRecord objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .rtp import RTPProcessRecord
+
+        return self._iter_time_filter(RTPProcessRecord, 'time', starttime,
+                                      stoptime=stoptime, filter_column='obsid',
+                                      filter_value=obsid,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_rtp_task_resource_record(self, obsid, task_name, start_time, stop_time,
                                      max_memory=None, avg_cpu_load=None):
@@ -740,6 +2166,7 @@ class MCSession(Session):
         self.add(RTPTaskResourceRecord.create(obsid, task_name, start_time, stop_time,
                                               max_memory, avg_cpu_load))
 
+    @cached_query
     def get_rtp_task_resource_record(self, starttime=None, stoptime=None, obsid=None,
                                      task_name=None):
         """
@@ -804,7 +2231,40 @@ class MCSession(Session):
 
         self.add(PaperTemperatures.new_from_text_row(read_time, temp_list))
 
-    def get_paper_temps(self, starttime, stoptime=None):
+    def add_paper_temps_bulk(self, read_times, temp_array, ignore_duplicates=False):
+        """
+        Add many PaperTemperatures records with a single executemany call.
+
+        Parameters:
+        ------------
+        read_times: astropy time object
+            (array valued) times of temperature reads
+
+        temp_array: 2-d array-like with one row per read time, each row
+            being a list of temperatures as parsed from the text file on
+            tmon. See temperatures.py for details.
+        ignore_duplicates: boolean
+            If True, skip rows that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .temperatures import PaperTemperatures, temp_colnames, temp_indices
+
+        time_list = get_gps_floor_list(read_times)
+        temp_array = np.asarray(temp_array, dtype=np.float64)
+        if temp_array.ndim != 2 or temp_array.shape[0] != len(time_list):
+            raise ValueError('temp_array must be 2-dimensional with one row per read time')
+
+        temp_values = temp_array[:, temp_indices].tolist()
+        rows = []
+        for time, values in zip(time_list, temp_values):
+            row = dict(zip(temp_colnames, values))
+            row['time'] = time
+            rows.append(row)
+        self._bulk_insert(PaperTemperatures, rows, ignore_duplicates=ignore_duplicates)
+
+    @cached_query
+    def get_paper_temps(self, starttime, stoptime=None, as_arrays=False, columns=None,
+                        bin_seconds=None, agg='mean'):
         """
         get sets of temperature records.
 
@@ -817,11 +2277,72 @@ class MCSession(Session):
             last time to get records for. If none, only the first record after
             starttime will be returned.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        bin_seconds: integer
+            If set, return a dict of numpy arrays of time-bucketed aggregates
+            (one row per bin of this many seconds) computed in SQL rather than
+            raw records. Requires stoptime. See get_aggregated.
+
+        agg: string
+            aggregate to compute when bin_seconds is set. One of 'mean',
+            'min', 'max', 'sum', 'count' or 'last'.
+
         """
         from .temperatures import PaperTemperatures
 
+        if bin_seconds is not None:
+            return self.get_aggregated(PaperTemperatures, 'time', bin_seconds, agg,
+                                       starttime, stoptime)
+
         return self._time_filter(PaperTemperatures, 'time', starttime,
-                                 stoptime=stoptime)
+                                 stoptime=stoptime,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_paper_temps(self, starttime, stoptime=None, chunk_size=1000,
+                         as_arrays=False, columns=None):
+        """
+        Stream paper_temperatures record(s) from the M&C database in chunks. Unlike
+        get_paper_temps, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of PaperTemperatures objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .temperatures import PaperTemperatures
+
+        return self._iter_time_filter(PaperTemperatures, 'time', starttime,
+                                      stoptime=stoptime,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
 
     def add_weather_data(self, time, variable, value):
         """
@@ -840,7 +2361,41 @@ class MCSession(Session):
 
         self.add(WeatherData.create(time, variable, value))
 
-    def add_weather_data_from_sensors(self, starttime, stoptime, variables=None):
+    def add_weather_data_bulk(self, times, variables, values, ignore_duplicates=False):
+        """
+        Add many weather data points to the M&C database with a single
+        executemany call. This is much faster than repeated calls to
+        add_weather_data when backfilling.
+
+        Parameters:
+        ------------
+        times: astropy time object
+            (array valued) astropy time object based on timestamps from the
+            katportal sensor.
+        variables: string or sequence of strings
+            must be keys in weather.weather_sensor_dict. A single string
+            applies to all times.
+        values: sequence or numpy array of floats
+            values from the sensor associated with the variables
+        ignore_duplicates: boolean
+            If True, skip rows that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .weather import weather_sensor_dict, WeatherData
+
+        time_list = get_gps_floor_list(times)
+        variable_list, value_list = get_column_lists(len(time_list), variables,
+                                                     np.asarray(values, dtype=np.float64))
+        for var in set(variable_list):
+            if var not in weather_sensor_dict.keys():
+                raise ValueError('variables must be keys in weather_sensor_dict.')
+
+        rows = [dict(time=t, variable=var, value=val) for t, var, val
+                in zip(time_list, variable_list, value_list)]
+        self._bulk_insert(WeatherData, rows, ignore_duplicates=ignore_duplicates)
+
+    def add_weather_data_from_sensors(self, starttime, stoptime, variables=None,
+                                      ignore_duplicates=False):
         """
         Add weather data for a given variable and timespan from KAT sensors.
         This function connects to the meerkat db and grabs the latest data
@@ -855,6 +2410,9 @@ class MCSession(Session):
         variable: string
             variable to get history for. Must be a key in weather.weather_sensor_dict,
             defaults to all keys in weather.weather_sensor_dict
+        ignore_duplicates: boolean
+            If True, skip data points that are already in the database (by primary
+            key) instead of raising an error.
         """
         from .weather import weather_sensor_dict, create_from_sensors
         if variables is not None:
@@ -867,10 +2425,58 @@ class MCSession(Session):
                     raise ValueError('variables must be a key in weather_sensor_dict.')
 
         weather_data_list = create_from_sensors(starttime, stoptime, variables=variables)
-        for obj in weather_data_list:
-            self.add(obj)
+        if ignore_duplicates:
+            self.add_all_ignore_duplicates(weather_data_list)
+        else:
+            for obj in weather_data_list:
+                self.add(obj)
+
+    def backfill_weather_data_from_sensors(self, starttime, stoptime=None, variables=None,
+                                           window_seconds=None, max_concurrent=4,
+                                           portal_client=None):
+        """
+        Incrementally add weather data from KAT sensors, resuming from the
+        latest data in the M&C database for each variable. The time range is
+        fetched in windows, several sensors at a time, and each window is
+        committed as it arrives, so long backfills use bounded memory and can
+        be restarted after an interruption. See weather.backfill_from_sensors.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            earliest time to get history for.
+        stoptime: astropy time object
+            time to stop getting history. Defaults to now.
+        variables: string or list of strings
+            variables to get history for. Must be keys in weather.weather_sensor_dict,
+            defaults to all keys in weather.weather_sensor_dict
+        window_seconds: integer
+            length of the windows fetched in one request. Defaults to
+            weather.default_window_seconds.
+        max_concurrent: integer
+            maximum number of sensor history requests in flight at once.
+        portal_client: KATPortalClient object
+            client to get the sensor histories from. Defaults to a new client.
+
+        Returns:
+        --------
+        dict giving the number of rows added (or already present) for each variable
+        """
+        import tornado.ioloop
+        from .weather import backfill_from_sensors, default_window_seconds
 
-    def get_weather_data(self, starttime, stoptime=None, variable=None):
+        if window_seconds is None:
+            window_seconds = default_window_seconds
+        io_loop = tornado.ioloop.IOLoop.current()
+        return io_loop.run_sync(lambda: backfill_from_sensors(
+            self, starttime, stoptime=stoptime, variables=variables,
+            window_seconds=window_seconds, max_concurrent=max_concurrent,
+            portal_client=portal_client))
+
+    @cached_query
+    def get_weather_data(self, starttime, stoptime=None, variable=None,
+                         as_arrays=False, columns=None, bin_seconds=None,
+                         agg='mean'):
         """
         Get weather_data record(s) from the M&C database.
 
@@ -887,18 +2493,106 @@ class MCSession(Session):
             Name of variable to get records for, must be a key in weather.weather_sensor_dict.
             If none, all variables will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        bin_seconds: integer
+            If set, return a dict of numpy arrays of time-bucketed aggregates
+            (one row per bin of this many seconds per variable) computed in
+            SQL rather than raw records. Requires stoptime. See get_aggregated.
+
+        agg: string
+            aggregate to compute when bin_seconds is set. One of 'mean',
+            'min', 'max', 'sum', 'count' or 'last'.
+
         Returns:
         --------
-        list of WeatherData objects
+        list of WeatherData objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .weather import weather_sensor_dict, WeatherData
         if variable is not None:
             if variable not in weather_sensor_dict.keys():
                 raise ValueError('variable must be a key in weather_sensor_dict.')
 
+        if bin_seconds is not None:
+            return self.get_aggregated(WeatherData, 'time', bin_seconds, agg,
+                                       starttime, stoptime, group_by='variable',
+                                       filter_column='variable', filter_value=variable)
+
         return self._time_filter(WeatherData, 'time', starttime,
                                  stoptime=stoptime, filter_column='variable',
-                                 filter_value=variable)
+                                 filter_value=variable,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_weather_data(self, starttime, stoptime=None, variable=None, chunk_size=1000,
+                          as_arrays=False, columns=None):
+        """
+        Stream weather_data record(s) from the M&C database in chunks. Unlike
+        get_weather_data, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        variable: string
+            Name of variable to get records for, must be a key in weather.weather_sensor_dict.
+            If none, all variables will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of WeatherData objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .weather import weather_sensor_dict, WeatherData
+        if variable is not None:
+            if variable not in weather_sensor_dict.keys():
+                raise ValueError('variable must be a key in weather_sensor_dict.')
+
+        return self._iter_time_filter(WeatherData, 'time', starttime,
+                                      stoptime=stoptime, filter_column='variable',
+                                      filter_value=variable,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
+
+    @cached_query
+    def get_latest_weather(self, starttime=None):
+        """
+        Get the most recent weather_data record for each variable.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            If set, only look at records after this time.
+
+        Returns:
+        --------
+        list of WeatherData objects, one per variable
+        """
+        from .weather import WeatherData
+
+        return self.get_latest(WeatherData, 'variable', starttime=starttime)
 
     def write_weather_files(self, start_time, stop_time, variables=None):
         """Dump the weather data to text files in the current directory, to aid in
@@ -942,7 +2636,8 @@ class MCSession(Session):
         elif stop_time is not None:
             q = q.filter(WeatherData.time <= stop_time.gps)
 
-        q = q.order_by(WeatherData.time)
+        # stream the rows rather than loading them all at once
+        q = q.order_by(WeatherData.time).yield_per(1000)
         files = dict((v, open(v + '.txt', 'wt')) for v in variables)
 
         for item in q:
@@ -975,46 +2670,73 @@ class MCSession(Session):
         self.add(RoachTemperature.create(time, roach, ambient_temp, inlet_temp,
                                          outlet_temp, fpga_temp, ppc_temp))
 
-    def add_roach_temperature_from_redis(self):
+    def add_roach_temperature_bulk(self, times, roaches, ambient_temps, inlet_temps,
+                                   outlet_temps, fpga_temps, ppc_temps, ignore_duplicates=False):
+        """
+        Add many roach (fpga correlator board) temperatures to the M&C
+        database with a single executemany call.
+
+        Parameters:
+        ------------
+        times: astropy time object
+            (array valued) astropy time object based on timestamps reported by the roaches.
+        roaches: string or sequence of strings
+            roach names. A single string applies to all times.
+        ambient_temps: sequence or numpy array of floats
+            ambient temperatures reported by the roaches in Celcius
+        inlet_temps: sequence or numpy array of floats
+            inlet temperatures reported by the roaches in Celcius
+        outlet_temps: sequence or numpy array of floats
+            outlet temperatures reported by the roaches in Celcius
+        fpga_temps: sequence or numpy array of floats
+            fpga temperatures reported by the roaches in Celcius
+        ppc_temps: sequence or numpy array of floats
+            ppc temperatures reported by the roaches in Celcius
+        ignore_duplicates: boolean
+            If True, skip rows that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .roach import RoachTemperature
+
+        time_list = get_gps_floor_list(times)
+        column_lists = get_column_lists(len(time_list), roaches, ambient_temps,
+                                        inlet_temps, outlet_temps, fpga_temps,
+                                        ppc_temps)
+
+        colnames = ['roach', 'ambient_temp', 'inlet_temp', 'outlet_temp',
+                    'fpga_temp', 'ppc_temp']
+        rows = []
+        for ind, time in enumerate(time_list):
+            row = dict((name, col[ind]) for name, col in zip(colnames, column_lists))
+            row['time'] = time
+            rows.append(row)
+        self._bulk_insert(RoachTemperature, rows, ignore_duplicates=ignore_duplicates)
+
+    def add_roach_temperature_from_redis(self, redis_session=None):
         """Read and add ROACH (FPGA correlator board) temperatures from the Redis
         database. This function connects to the Redis database and grabs the
-        latest data using the `create_from_redis` function.
+        latest data of all the ROACHes in one pipelined request (see
+        roach.RoachTemperatureCollector).
 
-        If the current database is PostgreSQL, this function will use a
-        special insertion method that will ignore records that are redundant
-        with ones already in the database. This makes it convenient to sample
-        the ROACH/Redis data densely on qmaster.
+        Records that are redundant with ones already in the database are
+        ignored. This makes it convenient to sample the ROACH/Redis data
+        densely on qmaster.
 
+        Parameters:
+        ------------
+        redis_session: redis.Redis object
+            Existing connection to the Redis database to use. Defaults to
+            connecting to roach.redis_dbname.
         """
-        from .roach import create_from_redis
-
-        roach_temperature_list = create_from_redis()
+        from .roach import RoachTemperatureCollector
 
-        if self.bind.dialect.name == 'postgresql':
-            from sqlalchemy import inspect
-            from sqlalchemy.dialects.postgresql import insert
-            from .roach import RoachTemperature
-
-            ies = [c.name for c in inspect(RoachTemperature).primary_key]
-            conn = self.connection()
-
-            for obj in roach_temperature_list:
-                # This appears to be the most correct way to map each row
-                # object into a dictionary:
-                values = {}
-                for col in inspect(obj).mapper.column_attrs:
-                    values[col.expression.name] = getattr(obj, col.key)
-
-                # The special PostgreSQL insert statement lets us ignore
-                # existing rows via `ON CONFLICT ... DO NOTHING` syntax.
-                stmt = insert(RoachTemperature).values(**values).on_conflict_do_nothing(index_elements=ies)
-                conn.execute(stmt)
-        else:
-            # Generic approach:
-            for obj in roach_temperature_list:
-                self.add(obj)
+        RoachTemperatureCollector(redis_session=redis_session).add_to_session(
+            self, changed_only=False)
 
-    def get_roach_temperature(self, starttime, stoptime=None, roach=None):
+    @cached_query
+    def get_roach_temperature(self, starttime, stoptime=None, roach=None,
+                              as_arrays=False, columns=None, bin_seconds=None,
+                              agg='mean'):
         """
         Get roach_temperature record(s) from the M&C database.
 
@@ -1030,15 +2752,351 @@ class MCSession(Session):
         roach: string
             Roach name to get records for. If none, all roaches will be included.
 
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        bin_seconds: integer
+            If set, return a dict of numpy arrays of time-bucketed aggregates
+            (one row per bin of this many seconds per roach) computed in
+            SQL rather than raw records. Requires stoptime. See get_aggregated.
+
+        agg: string
+            aggregate to compute when bin_seconds is set. One of 'mean',
+            'min', 'max', 'sum', 'count' or 'last'.
+
         Returns:
         --------
-        list of RoachTemperature objects
+        list of RoachTemperature objects, or a dict of numpy arrays if as_arrays or columns is set
         """
         from .roach import RoachTemperature
 
+        if bin_seconds is not None:
+            return self.get_aggregated(RoachTemperature, 'time', bin_seconds, agg,
+                                       starttime, stoptime, group_by='roach',
+                                       filter_column='roach', filter_value=roach)
+
         return self._time_filter(RoachTemperature, 'time', starttime,
                                  stoptime=stoptime, filter_column='roach',
-                                 filter_value=roach)
+                                 filter_value=roach,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_roach_temperature(self, starttime, stoptime=None, roach=None, chunk_size=1000,
+                               as_arrays=False, columns=None):
+        """
+        Stream roach_temperature record(s) from the M&C database in chunks. Unlike
+        get_roach_temperature, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        roach: string
+            Roach name to get records for. If none, all roaches will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of RoachTemperature objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .roach import RoachTemperature
+
+        return self._iter_time_filter(RoachTemperature, 'time', starttime,
+                                      stoptime=stoptime, filter_column='roach',
+                                      filter_value=roach,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
+
+    @cached_query
+    def get_latest_roach_temperature(self, starttime=None):
+        """
+        Get the most recent roach_temperature record for each roach.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            If set, only look at records after this time.
+
+        Returns:
+        --------
+        list of RoachTemperature objects, one per roach
+        """
+        from .roach import RoachTemperature
+
+        return self.get_latest(RoachTemperature, 'roach', starttime=starttime)
+
+    def add_autocorrelations_from_redis(self, redis_session=None, antnums=None, time=None,
+                                        spectra_decimation=None, spectra_dtype='float32',
+                                        spectra_codec='zlib'):
+        """
+        Read the antenna autocorrelation spectra from the Redis server (in one
+        pipelined request) and add all the MeasurementTypes statistics of them
+        to the M&C database in a single executemany call. Optionally also add
+        the decimated spectra to the autocorrelation_spectra table.
+
+        Parameters:
+        ------------
+        redis_session: redis.Redis object
+            Existing connection to the Redis server to use. Defaults to
+            connecting to autocorrelations.redis_host.
+        antnums: list of integers
+            antennas to read. Defaults to autocorrelations.default_antnums.
+        time: datetime object
+            time to give all the records. Defaults to the current UTC time.
+        spectra_decimation: integer
+            If set, also store the spectra with this many adjacent channels
+            averaged together (see add_autocorrelation_spectra).
+        spectra_dtype: string
+            type to store the spectra as, 'float32' or 'float16'.
+        spectra_codec: string
+            compression to store the spectra with, 'zlib' or 'none'. 'none'
+            takes more space but the spectra are faster to read back (see
+            get_autocorrelation_spectra).
+
+        Returns:
+        --------
+        number of autocorrelations records added, and list of the
+        (antnum, polarization) pairs that could not be read
+        """
+        from .autocorrelations import Autocorrelations, AutocorrelationSpectra, _get_rows
+
+        rows, spectra_rows, failures = _get_rows(redis_session=redis_session,
+                                                 antnums=antnums, time=time,
+                                                 spectra_decimation=spectra_decimation,
+                                                 spectra_dtype=spectra_dtype,
+                                                 spectra_codec=spectra_codec)
+        self._bulk_insert(Autocorrelations, rows)
+        self._bulk_insert(AutocorrelationSpectra, spectra_rows)
+        return len(rows), failures
+
+    @cached_query
+    def get_autocorrelations(self, starttime, stoptime=None, antnum=None,
+                             as_arrays=False, columns=None, bin_seconds=None,
+                             agg='mean'):
+        """
+        Get autocorrelations record(s) from the M&C database.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, only the first record after
+            starttime will be returned.
+
+        antnum: integer
+            Antenna number to get records for. If none, all antennas will be included.
+
+        as_arrays: boolean
+            If True, return a dict of numpy arrays keyed by column name
+            instead of a list of objects. This skips the ORM, which is much
+            faster and lighter on memory for long time ranges.
+
+        columns: list of strings
+            Column names to return as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        bin_seconds: integer
+            If set, return a dict of numpy arrays of time-bucketed aggregates
+            (one row per bin of this many seconds per antenna, polarization
+            and measurement type) computed in SQL rather than raw records.
+            Requires stoptime. See get_aggregated.
+
+        agg: string
+            aggregate to compute when bin_seconds is set. One of 'mean',
+            'min', 'max', 'sum', 'count' or 'last'.
+
+        Returns:
+        --------
+        list of Autocorrelations objects, or a dict of numpy arrays if as_arrays or columns is set
+        """
+        from .autocorrelations import Autocorrelations
+
+        if bin_seconds is not None:
+            return self.get_aggregated(Autocorrelations, 'time', bin_seconds, agg,
+                                       starttime, stoptime,
+                                       group_by=['antnum', 'polarization',
+                                                 'measurement_type'],
+                                       filter_column='antnum', filter_value=antnum)
+
+        return self._time_filter(Autocorrelations, 'time', starttime,
+                                 stoptime=stoptime, filter_column='antnum',
+                                 filter_value=antnum,
+                                 as_arrays=as_arrays, columns=columns)
+
+    def iter_autocorrelations(self, starttime, stoptime=None, antnum=None, chunk_size=1000,
+                              as_arrays=False, columns=None):
+        """
+        Stream autocorrelations record(s) from the M&C database in chunks. Unlike
+        get_autocorrelations, memory use does not grow with the width of the time range.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+
+        stoptime: astropy time object
+            last time to get records for. If none, all records after
+            starttime will be included.
+
+        antnum: integer
+            Antenna number to get records for. If none, all antennas will be included.
+
+        chunk_size: integer
+            number of records in each chunk
+
+        as_arrays: boolean
+            If True, yield dicts of numpy arrays keyed by column name instead
+            of lists of objects.
+
+        columns: list of strings
+            Column names to yield as numpy arrays. Implies as_arrays=True.
+            Defaults to all columns.
+
+        Yields:
+        --------
+        lists of Autocorrelations objects, or dicts of numpy arrays if as_arrays or
+        columns is set
+        """
+        from .autocorrelations import Autocorrelations
+
+        return self._iter_time_filter(Autocorrelations, 'time', starttime,
+                                      stoptime=stoptime, filter_column='antnum',
+                                      filter_value=antnum,
+                                      chunk_size=chunk_size, as_arrays=as_arrays,
+                                      columns=columns)
+
+    def add_autocorrelation_spectra(self, time, antnums, polarizations, spectra,
+                                    decimation=1, dtype='float32', codec='zlib'):
+        """
+        Add decimated autocorrelation spectra to the M&C database, as
+        compressed binary blobs (one row per spectrum).
+
+        Parameters:
+        ------------
+        time: astropy time object
+            time of the spectra.
+        antnums: integer or sequence of integers
+            antenna numbers, one per spectrum.
+        polarizations: string or sequence of strings
+            polarizations ("x" or "y"), one per spectrum.
+        spectra: 2-D numpy array
+            full resolution spectra, one per row.
+        decimation: integer
+            number of adjacent channels to average into each stored channel.
+            Channels left over at the end are dropped.
+        dtype: string
+            type to store the values as, 'float32' or 'float16'. float16
+            halves the size but only holds values up to 65504.
+        codec: string
+            compression to use, 'zlib' or 'none'.
+        """
+        from .autocorrelations import AutocorrelationSpectra, _get_spectra_rows
+
+        if not isinstance(time, Time):
+            raise ValueError('time must be an astropy Time object')
+        spectra = np.asarray(spectra)
+        if spectra.ndim != 2:
+            raise ValueError('spectra must be a 2-D array')
+        antnum_list, pol_list = get_column_lists(spectra.shape[0], antnums, polarizations)
+
+        rows = _get_spectra_rows(time.utc.datetime, list(zip(antnum_list, pol_list)),
+                                 spectra, decimation, dtype=dtype, codec=codec)
+        self._bulk_insert(AutocorrelationSpectra, rows)
+
+    def get_autocorrelation_spectra(self, starttime, stoptime=None, antnum=None,
+                                    polarization=None):
+        """
+        Get decimated autocorrelation spectra from the M&C database as one array.
+
+        Each stored spectrum is copied once, into the output array. Only
+        uncompressed float32 spectra are copied straight from the database
+        buffers. zlib spectra are decompressed first, and float16 spectra are
+        converted to float32 as they are copied.
+
+        Parameters:
+        ------------
+        starttime: astropy time object
+            time to look for records after
+        stoptime: astropy time object
+            last time to get records for. If none, only the spectra at the
+            first time after starttime will be returned.
+        antnum: integer
+            antenna number to get spectra for. If none, all antennas will be included.
+        polarization: string
+            polarization to get spectra for. If none, both will be included.
+
+        Returns:
+        --------
+        dict with numpy arrays of the sorted unique 'time' (datetime64),
+        'antnum' and 'polarization' values, the 'decimation' of the spectra
+        and the 'spectra' as a float32 array of shape (Ntimes, Nants, Npols,
+        Nchannels), with NaNs for missing spectra
+        """
+        from .autocorrelations import AutocorrelationSpectra, decode_spectrum
+
+        if stoptime is None:
+            first = self._time_filter(AutocorrelationSpectra, 'time', starttime,
+                                      filter_column=['antnum', 'polarization'],
+                                      filter_value=[antnum, polarization],
+                                      columns=['time'])['time']
+            if len(first) > 0:
+                starttime = stoptime = Time(first[0].item(), scale='utc')
+
+        table = AutocorrelationSpectra.__table__
+        columns = [table.c.time, table.c.antnum, table.c.polarization, table.c.decimation,
+                   table.c.n_channels, table.c.dtype, table.c.codec, table.c.spectrum]
+        rows = []
+        if stoptime is not None:
+            conditions = self._time_filter_conditions(
+                AutocorrelationSpectra, 'time', starttime, stoptime=stoptime,
+                filter_column=['antnum', 'polarization'], filter_value=[antnum, polarization])
+            stmt = select(columns).where(and_(*conditions)).order_by(table.c.time)
+            rows = self.execute(stmt).fetchall()
+
+        times = np.unique(np.array([row[0] for row in rows], dtype='datetime64[us]'))
+        antnums = np.unique(np.array([row[1] for row in rows], dtype=np.int64))
+        pols = np.unique(np.array([row[2] for row in rows], dtype=object)).astype(str)
+        decimations = set(row[3] for row in rows)
+        n_channels = set(row[4] for row in rows)
+        if len(decimations) > 1 or len(n_channels) > 1:
+            raise ValueError('the spectra in this time range have different decimations '
+                             'or numbers of channels')
+
+        spectra = np.full((len(times), len(antnums), len(pols),
+                           n_channels.pop() if n_channels else 0), np.nan, dtype=np.float32)
+        time_inds = np.searchsorted(times, np.array([row[0] for row in rows],
+                                                    dtype='datetime64[us]'))
+        ant_inds = np.searchsorted(antnums, [row[1] for row in rows])
+        pol_inds = np.searchsorted(pols, [row[2] for row in rows])
+        for row, time_ind, ant_ind, pol_ind in zip(rows, time_inds, ant_inds, pol_inds):
+            spectra[time_ind, ant_ind, pol_ind] = decode_spectrum(row[7], row[5], row[6])
+
+        return {'time': times, 'antnum': antnums, 'polarization': pols,
+                'decimation': decimations.pop() if decimations else None,
+                'spectra': spectra}
 
     def add_ant_metric(self, obsid, ant, pol, metric, val):
         """
@@ -1063,6 +3121,50 @@ class MCSession(Session):
 
         self.add(AntMetrics.create(obsid, ant, pol, metric, db_time, val))
 
+    def add_ant_metric_bulk(self, obsids, ants, pols, metrics, vals, ignore_duplicates=False):
+        """
+        Add many antenna metrics to the M&C database with a single
+        executemany call. All rows share one M&C time.
+
+        Parameters:
+        ------------
+        obsids: long integer or sequence of long integers
+            observation identification numbers
+        ants: integer or sequence of integers
+            antenna numbers
+        pols: string or sequence of strings ('x' or 'y')
+            polarizations
+        metrics: string or sequence of strings
+            metric names
+        vals: sequence or numpy array of floats
+            values of metrics
+        ignore_duplicates: boolean
+            If True, skip rows that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .qm import AntMetrics
+
+        vals = np.atleast_1d(np.asarray(vals, dtype=np.float64))
+        if np.asarray(obsids).dtype.kind not in 'iu':
+            raise ValueError('obsids must be integers.')
+        if np.asarray(ants).dtype.kind not in 'iu':
+            raise ValueError('antennas must be integers.')
+        if np.asarray(metrics).dtype.kind not in 'US':
+            raise ValueError('metrics must be strings.')
+        obsid_list, ant_list, pol_list, metric_list, val_list = get_column_lists(
+            vals.size, obsids, ants, pols, metrics, vals)
+
+        pol_list = [str(pol).lower() for pol in pol_list]
+        if not set(pol_list).issubset(('x', 'y')):
+            raise ValueError('pols must be strings "x" or "y".')
+
+        mc_time = get_gps_floor_list(self.get_current_db_time())[0]
+        rows = [dict(obsid=o, ant=a, pol=p, metric=m, mc_time=mc_time, val=v)
+                for o, a, p, m, v in zip(obsid_list, ant_list, pol_list,
+                                         metric_list, val_list)]
+        self._bulk_insert(AntMetrics, rows, ignore_duplicates=ignore_duplicates)
+
+    @cached_query
     def get_ant_metric(self, ant=None, pol=None, metric=None, starttime=None,
                        stoptime=None):
         """
@@ -1124,6 +3226,39 @@ class MCSession(Session):
 
         self.add(ArrayMetrics.create(obsid, metric, db_time, val))
 
+    def add_array_metric_bulk(self, obsids, metrics, vals, ignore_duplicates=False):
+        """
+        Add many array metrics to the M&C database with a single
+        executemany call. All rows share one M&C time.
+
+        Parameters:
+        ------------
+        obsids: long integer or sequence of long integers
+            observation identification numbers
+        metrics: string or sequence of strings
+            metric names
+        vals: sequence or numpy array of floats
+            values of metrics
+        ignore_duplicates: boolean
+            If True, skip rows that are already in the database (by primary
+            key) instead of raising an error.
+        """
+        from .qm import ArrayMetrics
+
+        vals = np.atleast_1d(np.asarray(vals, dtype=np.float64))
+        if np.asarray(obsids).dtype.kind not in 'iu':
+            raise ValueError('obsids must be integers.')
+        if np.asarray(metrics).dtype.kind not in 'US':
+            raise ValueError('metrics must be strings.')
+        obsid_list, metric_list, val_list = get_column_lists(vals.size, obsids,
+                                                             metrics, vals)
+
+        mc_time = get_gps_floor_list(self.get_current_db_time())[0]
+        rows = [dict(obsid=o, metric=m, mc_time=mc_time, val=v)
+                for o, m, v in zip(obsid_list, metric_list, val_list)]
+        self._bulk_insert(ArrayMetrics, rows, ignore_duplicates=ignore_duplicates)
+
+    @cached_query
     def get_array_metric(self, metric=None, starttime=None, stoptime=None):
         """
         Get array metric(s) from the M&C database.
@@ -1190,6 +3325,7 @@ class MCSession(Session):
         self.query(MetricList).filter(MetricList.metric == metric)[0].desc = desc
         self.commit()
 
+    @cached_query
     def get_metric_desc(self, metric=None):
         """
         Get metric description(s) from the M&C database.
@@ -13,7 +13,7 @@ from astropy.time import Time
 from astropy.coordinates import EarthLocation
 from math import floor
 from sqlalchemy import (Column, Integer, BigInteger, Float, ForeignKey,
-                        String, ForeignKeyConstraint)
+                        String, ForeignKeyConstraint, Index)
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from . import geo_handling
@@ -31,8 +31,11 @@ class AntMetrics(MCDeclarativeBase):
     metric:     Name of metric (str)
     mc_time:    time metric is reported to M&C in floor(gps seconds) (BigInteger)
     val:        Value of metric (double)
+
+    Indexed on (metric, obsid) for time range queries of a single metric.
     """
     __tablename__ = 'ant_metrics'
+    __table_args__ = (Index('ix_ant_metrics_metric_obsid', 'metric', 'obsid'),)
     obsid = Column(BigInteger, ForeignKey('hera_obs.obsid'), primary_key=True)
     ant = Column(Integer, primary_key=True)
     pol = Column(String, primary_key=True)
@@ -103,8 +106,11 @@ class ArrayMetrics(MCDeclarativeBase):
     metric:     Name of metric (str)
     mc_time:    time metric is reported to M&C in floor(gps seconds) (BigInteger)
     val:        Value of metric (double)
+
+    Indexed on (metric, obsid) for time range queries of a single metric.
     """
     __tablename__ = 'array_metrics'
+    __table_args__ = (Index('ix_array_metrics_metric_obsid', 'metric', 'obsid'),)
     obsid = Column(BigInteger, ForeignKey('hera_obs.obsid'), primary_key=True)
     metric = Column(String, ForeignKey('metric_list.metric'), primary_key=True)
     mc_time = Column(BigInteger, nullable=False)
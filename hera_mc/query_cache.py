@@ -0,0 +1,307 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Result cache for the MCSession get_* methods.
+
+Dashboards and status tools re-issue the same time-window queries every few
+minutes. When a session has a `QueryCache` (see the `query_cache_size` and
+`query_cache_ttl` settings in mc_config.json), the results of the methods
+decorated with `cached_query` are kept for `ttl` seconds, keyed by method and
+arguments, with the least recently used entries evicted once the cache is
+full. The cache is shared by all the sessions of a DB object.
+
+Each entry records the tables read to compute it (found from the SELECTs the
+session ran), and entries are invalidated when a session using the cache
+writes to one of those tables, whether through an ORM flush or a Core
+insert/update/delete (e.g. the add_*_bulk methods). Writes made by other
+processes or through other means are only picked up once entries expire.
+
+ORM objects are not shared between sessions: the cache keeps a copy of their
+column values and a cache hit returns objects attached to the calling
+session. Arrays are copied on a hit so callers can modify them freely.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import copy
+import time
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+
+import numpy as np
+from astropy.time import Time
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.base import _is_mapped_class
+from sqlalchemy.orm.session import make_transient_to_detached
+
+default_max_entries = 256
+default_ttl = 60.
+
+
+def _freeze_arg(value):
+    """Convert a method argument into a hashable cache key component."""
+    if isinstance(value, Time):
+        utc = value.utc
+        return ('Time', np.asarray(utc.jd1).tobytes(), np.asarray(utc.jd2).tobytes(),
+                utc.shape)
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_freeze_arg(val) for val in value)
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((key, _freeze_arg(val))
+                                        for key, val in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return ('set', frozenset(_freeze_arg(val) for val in value))
+    hash(value)  # raises TypeError for unhashable arguments
+    return value
+
+
+def _make_key(method, session, args, kwargs):
+    # normalize positional and keyword arguments and defaults
+    callargs = inspect.getcallargs(method, session, *args, **kwargs)
+    callargs = dict((name, value) for name, value in callargs.items()
+                    if value is not session)
+    return (method.__name__, tuple(sorted((name, _freeze_arg(value))
+                                          for name, value in callargs.items())))
+
+
+def _is_mapped_instance(obj):
+    return _is_mapped_class(type(obj))
+
+
+def _snapshot(result):
+    """Return a copy of a query result that does not depend on the session."""
+    if isinstance(result, list) and len(result) > 0 and all(
+            _is_mapped_instance(obj) for obj in result):
+        objects = []
+        for obj in result:
+            mapper = sa_inspect(obj).mapper
+            objects.append((mapper.class_, dict((attr.key, getattr(obj, attr.key))
+                                                for attr in mapper.column_attrs)))
+        return ('orm', objects)
+    if isinstance(result, dict) and all(isinstance(val, np.ndarray)
+                                        for val in result.values()):
+        return ('arrays', dict((key, val.copy()) for key, val in result.items()))
+    return ('other', copy.deepcopy(result))
+
+
+def _restore(session, snapshot):
+    """Turn a snapshot back into a result attached to session."""
+    kind, value = snapshot
+    if kind == 'orm':
+        objects = []
+        for table_class, values in value:
+            obj = sa_inspect(table_class).class_manager.new_instance()
+            for key, val in values.items():
+                setattr(obj, key, val)
+            make_transient_to_detached(obj)
+            objects.append(session.merge(obj, load=False))
+        return objects
+    if kind == 'arrays':
+        return dict((key, val.copy()) for key, val in value.items())
+    return copy.deepcopy(value)
+
+
+class QueryCache(object):
+    """
+    TTL and LRU cache of MCSession query results with hit and miss counters.
+
+    Parameters:
+    ------------
+    max_entries: integer
+        maximum number of results to keep. The least recently used result is
+        evicted when a new one is added to a full cache.
+    ttl: float
+        seconds a result stays valid for.
+    """
+
+    def __init__(self, max_entries=default_max_entries, ttl=default_ttl):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # number of invalidations so far, and the count when each table was
+        # last invalidated, so results read before a write are not stored
+        self._generation = 0
+        self._all_generation = -1
+        self._table_generation = {}
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset_stats(self):
+        """Reset the hit and miss counters."""
+        with self._lock:
+            self._methods = {}
+            self._evictions = 0
+            self._expirations = 0
+            self._invalidations = 0
+
+    def _count(self, method_name, outcome):
+        counts = self._methods.setdefault(method_name, {'hits': 0, 'misses': 0})
+        counts[outcome] += 1
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key, exclude_tables=frozenset()):
+        """
+        Get a cached entry.
+
+        Parameters:
+        ------------
+        key: tuple
+            cache key, starting with the method name.
+        exclude_tables: set of strings
+            tables the caller has uncommitted writes to. Entries read from
+            them are treated as misses (but kept for other callers).
+
+        Returns:
+        --------
+        (tables, snapshot) tuple, or None if the key is not cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self._expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries[key] = entry  # most recently used
+                if not exclude_tables.isdisjoint(entry[1]):
+                    entry = None
+            if entry is None:
+                self._count(key[0], 'misses')
+                return None
+            self._count(key[0], 'hits')
+            return entry[1], entry[2]
+
+    def put(self, key, tables, snapshot, generation):
+        """
+        Add an entry to the cache, evicting the least recently used entries
+        if needed.
+
+        Parameters:
+        ------------
+        key: tuple
+            cache key, starting with the method name.
+        tables: frozenset of strings
+            names of the tables the result was read from.
+        snapshot: tuple
+            the result, as returned by _snapshot.
+        generation: integer
+            value of `generation` before the result was read. The entry is
+            not stored if one of its tables has been written to since.
+
+        Returns:
+        --------
+        True if the entry was stored
+        """
+        with self._lock:
+            if self._all_generation >= generation or any(
+                    self._table_generation.get(name, -1) >= generation for name in tables):
+                return False
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), tables, snapshot)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return True
+
+    def invalidate(self, tables=None):
+        """
+        Remove the entries read from some tables.
+
+        Parameters:
+        ------------
+        tables: iterable of strings
+            names of the tables that were written to. If None, remove all entries.
+        """
+        with self._lock:
+            if tables is None:
+                self._invalidations += len(self._entries)
+                self._entries.clear()
+                self._all_generation = self._generation
+            else:
+                tables = set(tables)
+                for name in tables:
+                    self._table_generation[name] = self._generation
+                for key in [key for key, entry in self._entries.items()
+                            if not tables.isdisjoint(entry[1])]:
+                    del self._entries[key]
+                    self._invalidations += 1
+            self._generation += 1
+
+    def clear(self):
+        """Remove all entries (without counting them as invalidations)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+        --------
+        dict with keys entries, hits, misses, hit_rate, evictions (entries
+        removed to make room), expirations (entries found older than ttl),
+        invalidations (entries removed because of writes) and methods (a
+        dict keyed by method name of dicts with hits and misses)
+        """
+        with self._lock:
+            methods = dict((name, dict(counts)) for name, counts in self._methods.items())
+            hits = sum(counts['hits'] for counts in methods.values())
+            misses = sum(counts['misses'] for counts in methods.values())
+            return {'entries': len(self._entries), 'hits': hits, 'misses': misses,
+                    'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.,
+                    'evictions': self._evictions, 'expirations': self._expirations,
+                    'invalidations': self._invalidations, 'methods': methods}
+
+
+def cached_query(method):
+    """
+    Decorator for MCSession methods whose results can be cached by the
+    session's query_cache. Has no effect for sessions without a cache.
+    """
+    @functools.wraps(method)
+    def wrapper(session, *args, **kwargs):
+        cache = session.query_cache
+        if cache is None:
+            return method(session, *args, **kwargs)
+
+        try:
+            key = _make_key(method, session, args, kwargs)
+        except TypeError:
+            # unhashable arguments, e.g. arbitrary objects
+            return method(session, *args, **kwargs)
+
+        # a cached result must include this session's pending changes
+        session._autoflush()
+
+        entry = cache.get(key, exclude_tables=session._cache_written_tables)
+        if entry is not None:
+            tables, snapshot = entry
+            session._note_cache_reads(tables)
+            return _restore(session, snapshot)
+
+        generation = cache.generation
+        session._cache_read_stack.append(set())
+        try:
+            result = method(session, *args, **kwargs)
+        finally:
+            tables = frozenset(session._cache_read_stack.pop())
+        session._note_cache_reads(tables)
+
+        # results including this session's uncommitted writes are not shared
+        if session._cache_written_tables.isdisjoint(tables):
+            cache.put(key, tables, _snapshot(result), generation)
+        return result
+
+    return wrapper
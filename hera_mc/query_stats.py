@@ -0,0 +1,357 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Per-query instrumentation of the M&C database engines.
+
+`instrument_engine` hooks the SQLAlchemy cursor events of an engine so every
+statement it runs is timed and attributed to the MCSession method that issued
+it (the outermost one, so e.g. queries made by get_aggregated on behalf of
+get_weather_data count towards get_weather_data). Statements issued from
+outside MCSession methods are attributed to the first calling function outside
+SQLAlchemy. The accumulated statistics are available from
+`MCSession.query_stats` and can be dumped periodically to the log or to a
+file that the `mc_query_stats.py` script summarizes.
+
+Finding the call site walks the Python stack for every statement, so
+`mc.connect_to_mc_db` only instruments a database if `instrument_queries` is
+set in its mc_config.json entry.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import weakref
+
+from . import logger
+
+default_query_stats_file = os.path.expanduser('~/.hera_mc/query_stats.jsonl')
+
+sort_keys = ['total_time', 'mean_time', 'max_time', 'count', 'rows']
+
+# maximum length of the example statement kept for each call site
+max_statement_length = 500
+
+# registry of the QueryStats object for each instrumented engine
+_engine_stats = weakref.WeakKeyDictionary()
+_engine_stats_lock = threading.Lock()
+
+
+def _get_call_site():
+    """Return the name of the code that issued the statement being executed."""
+    frame = sys._getframe(2)
+    session_method = None
+    caller = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module == 'hera_mc.mc_session':
+            session_method = frame.f_code.co_name
+        elif (caller is None and session_method is None
+                and not module.startswith('sqlalchemy') and module != __name__):
+            caller = '{0}.{1}'.format(module, frame.f_code.co_name)
+        frame = frame.f_back
+
+    if session_method is not None:
+        return 'MCSession.' + session_method
+    if caller is not None:
+        return caller
+    return '<unknown>'
+
+
+class QueryStats(object):
+    """
+    Accumulated timing statistics for the statements run on an engine,
+    grouped by call site.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites = {}
+        self.start_time = time.time()
+        self._dump_thread = None
+        self._dump_stop = None
+
+    def record(self, call_site, statement, duration, rowcount):
+        """
+        Add a statement to the statistics.
+
+        Parameters:
+        ------------
+        call_site: string
+            name of the code that issued the statement.
+        statement: string
+            SQL statement.
+        duration: float
+            execution time in seconds.
+        rowcount: integer
+            number of rows reported by the DB driver, negative if unknown.
+        """
+        with self._lock:
+            site = self._sites.get(call_site)
+            if site is None:
+                site = {'call_site': call_site, 'count': 0, 'total_time': 0.,
+                        'max_time': 0., 'rows': 0, 'statement': None}
+                self._sites[call_site] = site
+            site['count'] += 1
+            site['total_time'] += duration
+            if duration >= site['max_time']:
+                site['max_time'] = duration
+                site['statement'] = statement[:max_statement_length]
+            if rowcount is not None and rowcount > 0:
+                site['rows'] += rowcount
+
+    def reset(self):
+        """Clear the statistics."""
+        with self._lock:
+            self._sites = {}
+            self.start_time = time.time()
+
+    def summary(self, n=None, sort_by='total_time'):
+        """
+        Get the statistics for each call site.
+
+        Parameters:
+        ------------
+        n: integer
+            only return the top n call sites. Defaults to all call sites.
+        sort_by: string
+            quantity to sort the call sites by (descending), one of sort_keys.
+
+        Returns:
+        --------
+        list of dicts with keys call_site, count, total_time, mean_time,
+        max_time (times in seconds), rows (rows reported by the DB driver,
+        which may not count selected rows for some drivers) and statement (the
+        slowest statement seen).
+        """
+        with self._lock:
+            sites = [dict(site) for site in self._sites.values()]
+        for site in sites:
+            site['mean_time'] = site['total_time'] / site['count']
+        return sort_summary(sites, n=n, sort_by=sort_by)
+
+    def dump(self, path=None):
+        """
+        Write the current statistics to the log or to a file.
+
+        Parameters:
+        ------------
+        path: string
+            file to append the statistics to, as one JSON line tagged with
+            the host, process id and program name. If None, the top call sites
+            are logged at INFO level instead.
+        """
+        sites = self.summary()
+        if path is None:
+            for site in sites[:10]:
+                logger.info('query stats: %s count=%d total=%.3fs mean=%.4fs max=%.4fs',
+                            site['call_site'], site['count'], site['total_time'],
+                            site['mean_time'], site['max_time'])
+            return
+
+        record = {'hostname': socket.gethostname(), 'pid': os.getpid(),
+                  'program': os.path.basename(sys.argv[0]) if sys.argv else '',
+                  'start_time': self.start_time, 'time': time.time(), 'sites': sites}
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def start_periodic_dump(self, interval, path=None):
+        """
+        Dump the statistics every interval seconds from a background thread.
+
+        Parameters:
+        ------------
+        interval: float
+            seconds between dumps.
+        path: string
+            file to append to, see dump. If None, the statistics are logged.
+        """
+        self.stop_periodic_dump()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.dump(path=path)
+                except Exception as e:
+                    logger.warning('could not dump query stats: %s', e)
+
+        self._dump_stop = stop
+        self._dump_thread = threading.Thread(target=run, name='hera_mc query stats dump')
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self):
+        """Stop the periodic dumps started by start_periodic_dump."""
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+            self._dump_stop = None
+
+
+def sort_summary(sites, n=None, sort_by='total_time'):
+    """
+    Sort call site statistics and keep the top n.
+
+    Parameters:
+    ------------
+    sites: list of dicts
+        call site statistics as returned by QueryStats.summary.
+    n: integer
+        only return the top n call sites. Defaults to all call sites.
+    sort_by: string
+        quantity to sort the call sites by (descending), one of sort_keys.
+
+    Returns:
+    --------
+    sorted list of dicts
+    """
+    if sort_by not in sort_keys:
+        raise ValueError('sort_by must be one of {0}'.format(sort_keys))
+    sites = sorted(sites, key=lambda site: site[sort_by], reverse=True)
+    if n is not None:
+        sites = sites[:n]
+    return sites
+
+
+def combine_summaries(summaries):
+    """
+    Combine the call site statistics of several engines or processes.
+
+    Parameters:
+    ------------
+    summaries: list of lists of dicts
+        call site statistics as returned by QueryStats.summary.
+
+    Returns:
+    --------
+    list of dicts with the same keys as QueryStats.summary, with the
+    statistics of call sites appearing in several summaries combined, in no
+    particular order.
+    """
+    combined = {}
+    for sites in summaries:
+        for site in sites:
+            total = combined.get(site['call_site'])
+            if total is None:
+                combined[site['call_site']] = dict(site)
+                continue
+            total['count'] += site['count']
+            total['total_time'] += site['total_time']
+            total['rows'] += site['rows']
+            if site['max_time'] > total['max_time']:
+                total['max_time'] = site['max_time']
+                total['statement'] = site['statement']
+
+    sites = list(combined.values())
+    for site in sites:
+        site['mean_time'] = site['total_time'] / site['count']
+    return sites
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute is not called for failed statements, so drop their
+    # start time here to keep the stack in step with the running statements.
+    # Statements that failed before getting an execution context never
+    # reached before_cursor_execute.
+    conn = exception_context.connection
+    if conn is None or exception_context.execution_context is None:
+        return
+    start_times = conn.info.get('query_start_time')
+    if start_times:
+        start_times.pop()
+
+
+def instrument_engine(engine):
+    """
+    Start recording statistics for the statements run on an engine.
+
+    Instrumenting an engine that is already instrumented has no effect.
+
+    Parameters:
+    ------------
+    engine: SQLAlchemy engine
+
+    Returns:
+    --------
+    QueryStats object for the engine
+    """
+    from sqlalchemy import event
+
+    with _engine_stats_lock:
+        stats = _engine_stats.get(engine)
+        if stats is not None:
+            return stats
+        stats = QueryStats()
+        _engine_stats[engine] = stats
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get('query_start_time')
+        if not start_times:
+            return
+        duration = time.time() - start_times.pop()
+        stats.record(_get_call_site(), statement, duration, cursor.rowcount)
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    return stats
+
+
+def get_engine_query_stats(engine):
+    """
+    Get the QueryStats object of an instrumented engine.
+
+    Parameters:
+    ------------
+    engine: SQLAlchemy engine or connection
+
+    Returns:
+    --------
+    QueryStats object, or None if the engine is not instrumented
+    """
+    engine = getattr(engine, 'engine', engine)
+    with _engine_stats_lock:
+        return _engine_stats.get(engine)
+
+
+def read_query_stats_files(paths):
+    """
+    Combine the statistics dumped to files by one or more processes.
+
+    The dumps of each process are cumulative, so only the latest dump from
+    each process is used.
+
+    Parameters:
+    ------------
+    paths: list of strings
+        files written by QueryStats.dump.
+
+    Returns:
+    --------
+    list of dicts with the same keys as QueryStats.summary, combined across
+    processes, in no particular order.
+    """
+    latest = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                key = (record['hostname'], record['pid'], record['start_time'])
+                if key not in latest or record['time'] >= latest[key]['time']:
+                    latest[key] = record
+
+    return combine_summaries([record['sites'] for record in latest.values()])
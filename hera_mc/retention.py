@@ -0,0 +1,564 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Tiered retention of the high-volume telemetry tables.
+
+Raw rows older than a configurable age are rolled up into the
+telemetry_rollup table, which holds the count, min, mean and max of every
+value column per time bin and group (e.g. per weather variable or per
+hostname) at each of the rollup tiers (5 minutes and 1 hour by default), and
+then the raw rows are deleted (optionally after archiving them to files).
+Rollups of the finer tiers can also be expired after a while.
+
+The get_* methods that take bin_seconds transparently use the coarsest tier
+whose bins evenly divide the requested bins, falling back to the raw rows for
+times that have not been rolled up yet.
+
+The columns in this module are documented in docs/mc_definition.tex,
+the documentation needs to be kept up to date with any changes.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+from math import floor
+
+import numpy as np
+from astropy.time import Time
+from sqlalchemy import (Column, BigInteger, Float, Integer, String, DateTime,
+                        select, and_, func)
+
+from . import MCDeclarativeBase, logger
+
+# widths of the rollup bins in seconds, finest first
+rollup_tiers = [300, 3600]
+
+# how long raw rows are kept before they are rolled up and removed
+default_raw_retention_days = 30.
+
+# how long each rollup tier is kept (None to keep forever)
+default_tier_retention_days = {300: 365., 3600: None}
+
+# the tables handled by the retention system, with the column holding the
+# time and the columns the rollups are computed separately for
+retention_tables = {
+    'weather_data': {'time_column': 'time', 'group_by': ['variable']},
+    'roach_temperature': {'time_column': 'time', 'group_by': ['roach']},
+    'autocorrelations': {'time_column': 'time',
+                         'group_by': ['antnum', 'polarization', 'measurement_type']},
+    'rtp_server_status': {'time_column': 'mc_time', 'group_by': ['hostname']},
+    'lib_server_status': {'time_column': 'mc_time', 'group_by': ['hostname']},
+    'paper_temperatures': {'time_column': 'time', 'group_by': []},
+}
+
+# aggregates that can be computed from the rollups
+rollup_aggregates = ['mean', 'min', 'max', 'sum', 'count']
+
+# separator for the group column values in TelemetryRollup.group_key
+group_key_separator = '|'
+
+# rolling up is done in windows of this many of the coarsest bins, with a
+# commit after each window
+bins_per_window = 24
+
+
+class TelemetryRollup(MCDeclarativeBase):
+    """
+    Definition of telemetry_rollup table, holding statistics of the values in
+    the telemetry tables over fixed time bins.
+
+    source_table: name of the table the statistics are computed from (String,
+        part of primary_key)
+    bin_seconds: width of the time bin in seconds (Integer, part of primary_key)
+    time: start of the time bin (BigInteger, part of primary_key). In floored
+        gps seconds, or unix seconds for tables with DateTime time columns
+    group_key: values of the source table's group columns (see
+        retention_tables) joined by '|' (String, part of primary_key)
+    column_name: name of the value column (String, part of primary_key)
+    num_values: number of non-null values in the bin (Integer)
+    min_value: minimum value in the bin (Float)
+    mean_value: mean value in the bin (Float)
+    max_value: maximum value in the bin (Float)
+    """
+    __tablename__ = 'telemetry_rollup'
+    source_table = Column(String(64), primary_key=True)
+    bin_seconds = Column(Integer, primary_key=True)
+    time = Column(BigInteger, primary_key=True)
+    group_key = Column(String(64), primary_key=True)
+    column_name = Column(String(64), primary_key=True)
+    num_values = Column(Integer, nullable=False)
+    min_value = Column(Float, nullable=False)
+    mean_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+
+
+def _is_datetime(time_col):
+    return isinstance(time_col.type, DateTime)
+
+
+def _to_units(time_col, t):
+    """Convert an astropy time to the units of the rollup bins for time_col."""
+    if _is_datetime(time_col):
+        return t.unix
+    return t.gps
+
+
+def _to_native(time_col, value):
+    """Convert a time in the units of the rollup bins to a value for time_col."""
+    if _is_datetime(time_col):
+        return Time(value, format='unix').utc.datetime
+    return int(value)
+
+
+def _value_columns(table, group_by):
+    return [col for col in table.columns
+            if isinstance(col.type, Float) and col.name not in group_by]
+
+
+def _make_group_key(values):
+    return group_key_separator.join(str(value) for value in values)
+
+
+def _parse_group_key(group_key, group_cols):
+    if len(group_cols) == 0:
+        return ()
+    return tuple(col.type.python_type(value)
+                 for col, value in zip(group_cols, group_key.split(group_key_separator)))
+
+
+def _bin_stats(session, table, time_column, bin_seconds, conditions, group_by):
+    """
+    Compute the count, min, mean and max of every value column of a table in
+    time bins with a single query.
+
+    Returns:
+    --------
+    list of dicts with the TelemetryRollup columns
+    """
+    time_col = table.columns[time_column]
+    group_cols = [table.columns[name] for name in group_by]
+    value_cols = _value_columns(table, group_by)
+
+    stats_cols = []
+    for col in value_cols:
+        stats_cols += [func.count(col), func.min(col), func.avg(col, type_=Float),
+                       func.max(col)]
+    stmt = (select([session._time_bucket(time_col, bin_seconds)] + group_cols + stats_cols)
+            .where(and_(*conditions))
+            .group_by(session._time_bucket(time_col, bin_seconds), *group_cols))
+
+    records = []
+    ngroup = len(group_cols)
+    for row in session.execute(stmt).fetchall():
+        group_key = _make_group_key(row[1:1 + ngroup])
+        for ind, col in enumerate(value_cols):
+            count, vmin, vmean, vmax = row[1 + ngroup + 4 * ind:5 + ngroup + 4 * ind]
+            if count == 0:
+                continue
+            records.append({'source_table': table.name, 'bin_seconds': bin_seconds,
+                            'time': int(row[0]), 'group_key': group_key,
+                            'column_name': col.name, 'num_values': int(count),
+                            'min_value': float(vmin), 'mean_value': float(vmean),
+                            'max_value': float(vmax)})
+    return records
+
+
+def _tier_coverage(session, table_name, tiers):
+    """Return a dict giving the end of the latest rollup bin of a table for each tier."""
+    coverage = {}
+    for tier in tiers:
+        # one query per tier so each is a single index lookup
+        last_time = session.execute(
+            select([func.max(TelemetryRollup.time)])
+            .where(TelemetryRollup.source_table == table_name)
+            .where(TelemetryRollup.bin_seconds == tier)).scalar()
+        if last_time is not None:
+            coverage[tier] = int(last_time) + tier
+    return coverage
+
+
+def _merge_rollups(session, records, bin_seconds, table_name):
+    """
+    Add rollup records, combining them with any existing rollups of the same
+    bins (from raw rows that arrived after their bins were rolled up).
+    """
+    if len(records) == 0:
+        return
+
+    times = [rec['time'] for rec in records]
+    existing = (session.query(TelemetryRollup)
+                .filter(TelemetryRollup.source_table == table_name)
+                .filter(TelemetryRollup.bin_seconds == bin_seconds)
+                .filter(TelemetryRollup.time.between(min(times), max(times))).all())
+    existing = dict(((obj.time, obj.group_key, obj.column_name), obj) for obj in existing)
+
+    new_records = []
+    for rec in records:
+        obj = existing.get((rec['time'], rec['group_key'], rec['column_name']))
+        if obj is None:
+            new_records.append(rec)
+            continue
+        total = obj.num_values + rec['num_values']
+        obj.mean_value = ((obj.mean_value * obj.num_values
+                           + rec['mean_value'] * rec['num_values']) / total)
+        obj.num_values = total
+        obj.min_value = min(obj.min_value, rec['min_value'])
+        obj.max_value = max(obj.max_value, rec['max_value'])
+
+    session._bulk_insert(TelemetryRollup, new_records)
+
+
+def _archive_rows(session, table, conditions, archive_dir, time_column, start, stop):
+    """Save the rows matching conditions to a numpy .npz file in archive_dir."""
+    from .mc_session import _rows_to_arrays
+
+    table_columns = list(table.columns)
+    stmt = select(table_columns).where(and_(*conditions)).order_by(table.columns[time_column])
+    rows = session.execute(stmt).fetchall()
+    if len(rows) == 0:
+        return
+    filename = os.path.join(archive_dir, '{table}_{start}_{stop}.npz'.format(
+        table=table.name, start=int(start), stop=int(stop)))
+    np.savez(filename, **_rows_to_arrays(rows, table_columns))
+
+
+def rollup_table(session, table_name, cutoff, tiers=None, keep_raw=False,
+                 archive_dir=None):
+    """
+    Roll up the raw rows of a table older than a cutoff time and remove them.
+
+    The rows are processed in windows (one day for hourly bins), committing
+    after each window. The cutoff is floored to the coarsest tier so that
+    only complete bins are rolled up.
+
+    Parameters:
+    ------------
+    session: MCSession object
+    table_name: string
+        name of the table, must be a key in retention_tables.
+    cutoff: astropy time object
+        roll up rows older than this.
+    tiers: list of integers
+        rollup bin widths in seconds. Defaults to rollup_tiers.
+    keep_raw: boolean
+        If True, keep the raw rows. Only rows newer than the existing rollups
+        are rolled up, so rows arriving late for bins that were already rolled
+        up are not added to the rollups.
+    archive_dir: string
+        If set, the raw rows are saved to numpy .npz files in this directory
+        (one per window) before they are deleted.
+
+    Returns:
+    --------
+    tuple of the number of rollup records computed and raw rows deleted
+    """
+    if table_name not in retention_tables:
+        raise ValueError('table_name must be one of {0}'.format(sorted(retention_tables.keys())))
+    if tiers is None:
+        tiers = rollup_tiers
+    tiers = sorted(tiers)
+
+    config = retention_tables[table_name]
+    time_column = config['time_column']
+    group_by = config['group_by']
+    table = MCDeclarativeBase.metadata.tables[table_name]
+    time_col = table.columns[time_column]
+
+    coarsest = tiers[-1]
+    cutoff = int(floor(_to_units(time_col, cutoff) / coarsest) * coarsest)
+
+    # core statements do not autoflush, make sure pending rows are included
+    session.flush()
+
+    first_time = session.execute(select([func.min(time_col)])
+                                 .where(time_col < _to_native(time_col, cutoff))).scalar()
+    if first_time is None:
+        return 0, 0
+    if _is_datetime(time_col):
+        first_time = _to_units(time_col, Time(first_time, scale='utc'))
+    start = int(floor(first_time / coarsest) * coarsest)
+
+    coverage = _tier_coverage(session, table_name, tiers)
+    window = coarsest * bins_per_window
+
+    n_rollups = 0
+    n_deleted = 0
+    for window_start in range(start, cutoff, window):
+        window_stop = min(window_start + window, cutoff)
+        window_conditions = [time_col >= _to_native(time_col, window_start),
+                             time_col < _to_native(time_col, window_stop)]
+
+        for tier in tiers:
+            conditions = list(window_conditions)
+            if keep_raw and tier in coverage:
+                if coverage[tier] >= window_stop:
+                    continue
+                conditions.append(time_col >= _to_native(time_col, coverage[tier]))
+            records = _bin_stats(session, table, time_column, tier, conditions, group_by)
+            _merge_rollups(session, records, tier, table_name)
+            n_rollups += len(records)
+
+        if not keep_raw:
+            if archive_dir is not None:
+                _archive_rows(session, table, window_conditions, archive_dir,
+                              time_column, window_start, window_stop)
+            result = session.execute(table.delete().where(and_(*window_conditions)))
+            n_deleted += result.rowcount
+        session.commit()
+
+    return n_rollups, n_deleted
+
+
+def expire_rollups(session, table_name, tier, cutoff):
+    """
+    Delete the rollups of one tier of a table that are older than a cutoff.
+
+    Parameters:
+    ------------
+    session: MCSession object
+    table_name: string
+        name of the table, must be a key in retention_tables.
+    tier: integer
+        rollup bin width in seconds.
+    cutoff: astropy time object
+        delete rollup bins that start before this.
+
+    Returns:
+    --------
+    number of rollup records deleted
+    """
+    table = MCDeclarativeBase.metadata.tables[table_name]
+    time_col = table.columns[retention_tables[table_name]['time_column']]
+    result = session.execute(
+        TelemetryRollup.__table__.delete()
+        .where(TelemetryRollup.source_table == table_name)
+        .where(TelemetryRollup.bin_seconds == tier)
+        .where(TelemetryRollup.time < _to_units(time_col, cutoff)))
+    session.commit()
+    return result.rowcount
+
+
+def apply_retention(session, raw_retention_days=None, tier_retention_days=None,
+                    tables=None, tiers=None, keep_raw=False, archive_dir=None, now=None):
+    """
+    Roll up and remove old raw rows and expire old rollups for the telemetry
+    tables. Meant to be run periodically (e.g. daily from cron with
+    mc_retention.py).
+
+    Parameters:
+    ------------
+    session: MCSession object
+    raw_retention_days: float
+        age in days after which raw rows are rolled up and removed. Defaults
+        to default_raw_retention_days.
+    tier_retention_days: dict
+        age in days after which the rollups of each tier are deleted, keyed
+        by tier, None to keep forever. Defaults to default_tier_retention_days.
+    tables: list of strings
+        tables to process. Defaults to all tables in retention_tables.
+    tiers: list of integers
+        rollup bin widths in seconds. Defaults to rollup_tiers.
+    keep_raw: boolean
+        If True, compute the rollups but keep the raw rows.
+    archive_dir: string
+        If set, save the raw rows to numpy .npz files in this directory
+        before deleting them.
+    now: astropy time object
+        time to compute ages from. Defaults to the current database time.
+
+    Returns:
+    --------
+    dict keyed by table name of dicts with the numbers of rollup records
+    computed ('rollups'), raw rows deleted ('deleted') and expired rollup
+    records ('expired')
+    """
+    from astropy.time import TimeDelta
+
+    if raw_retention_days is None:
+        raw_retention_days = default_raw_retention_days
+    if tier_retention_days is None:
+        tier_retention_days = default_tier_retention_days
+    if tables is None:
+        tables = sorted(retention_tables.keys())
+    if tiers is None:
+        tiers = rollup_tiers
+    if now is None:
+        now = session.get_current_db_time()
+
+    raw_cutoff = now - TimeDelta(raw_retention_days * 86400., format='sec')
+    results = {}
+    for table_name in tables:
+        n_rollups, n_deleted = rollup_table(session, table_name, raw_cutoff, tiers=tiers,
+                                            keep_raw=keep_raw, archive_dir=archive_dir)
+        n_expired = 0
+        for tier in tiers:
+            days = tier_retention_days.get(tier)
+            if days is not None:
+                n_expired += expire_rollups(session, table_name, tier,
+                                            now - TimeDelta(days * 86400., format='sec'))
+        results[table_name] = {'rollups': n_rollups, 'deleted': n_deleted,
+                               'expired': n_expired}
+        logger.info('retention for %s: %d rollups, %d raw rows deleted, %d rollups expired',
+                    table_name, n_rollups, n_deleted, n_expired)
+    return results
+
+
+def _check_raw_rows_kept(session, table, time_column, group_by, starttime, stoptime):
+    """
+    Raise a ValueError if raw rows between starttime and stoptime have been
+    removed after being rolled up, i.e. if the rollups of a tier in the range
+    hold more values (of one of the value columns) than there are raw rows
+    left over the same bins.
+    """
+    time_col = table.columns[time_column]
+    column_name = _value_columns(table, group_by)[0].name
+    start = _to_units(time_col, starttime)
+    stop = _to_units(time_col, stoptime)
+    tiers = session.execute(
+        select([TelemetryRollup.bin_seconds, func.min(TelemetryRollup.time),
+                func.max(TelemetryRollup.time), func.sum(TelemetryRollup.num_values)])
+        .where(TelemetryRollup.source_table == table.name)
+        .where(TelemetryRollup.column_name == column_name)
+        .where(TelemetryRollup.time <= stop)
+        .where(TelemetryRollup.time + TelemetryRollup.bin_seconds > start)
+        .group_by(TelemetryRollup.bin_seconds)).fetchall()
+    for tier, first_bin, last_bin, num_values in tiers:
+        num_raw = session.execute(
+            select([func.count()]).select_from(table)
+            .where(time_col >= _to_native(time_col, first_bin))
+            .where(time_col < _to_native(time_col, last_bin + tier))).scalar()
+        if num_raw < num_values:
+            raise ValueError('raw rows of {table} between {start} and {stop} have been '
+                             'removed by the retention system, this aggregate cannot be '
+                             'computed from the rollups'.format(
+                                 table=table.name, start=starttime.isot,
+                                 stop=stoptime.isot))
+
+
+def get_rollup_aggregates(session, table, time_column, bin_seconds, agg, starttime,
+                          stoptime, group_by=None, value_columns=None,
+                          filter_column=None, filter_value=None):
+    """
+    Compute time-bucketed aggregates from the rollups where possible. Used by
+    MCSession.get_aggregated, see that method for the parameters and return
+    value.
+
+    The coarsest tier whose bins evenly divide bin_seconds is used, with the
+    raw rows after the end of the rollups aggregated to the same tier. As the
+    rollup bins are not split, the first bin can include data from up to one
+    tier bin before starttime.
+
+    Aggregates that cannot be computed from the rollups ('last') use the raw
+    rows, so a ValueError is raised if any of them have been removed.
+
+    Returns:
+    --------
+    dict of numpy arrays as for get_aggregated, or None if the rollups cannot
+    be used (unsupported table or aggregate, or no suitable tier covering
+    starttime)
+    """
+    config = retention_tables.get(table.name)
+    if config is None or config['time_column'] != time_column:
+        return None
+    if agg not in rollup_aggregates:
+        _check_raw_rows_kept(session, table, time_column, config['group_by'],
+                             starttime, stoptime)
+        return None
+
+    group_by = [] if group_by is None else list(group_by)
+    stored_group_by = config['group_by']
+    if not set(group_by).issubset(stored_group_by):
+        return None
+    if filter_value is not None and filter_column not in stored_group_by:
+        return None
+
+    time_col = table.columns[time_column]
+    value_names = [col.name for col in _value_columns(table, stored_group_by)]
+    if value_columns is not None:
+        if not set(value_columns).issubset(value_names):
+            return None
+        value_names = list(value_columns)
+
+    start = _to_units(time_col, starttime)
+    stop = _to_units(time_col, stoptime)
+    coverage = _tier_coverage(session, table.name,
+                              [tier for tier in rollup_tiers if bin_seconds % tier == 0])
+    tiers = [tier for tier in coverage if start < coverage[tier]]
+    if len(tiers) == 0:
+        return None
+    tier = max(tiers)
+    rolled_until = coverage[tier]
+
+    rollup_cols = [TelemetryRollup.time, TelemetryRollup.group_key,
+                   TelemetryRollup.column_name, TelemetryRollup.num_values,
+                   TelemetryRollup.min_value, TelemetryRollup.mean_value,
+                   TelemetryRollup.max_value]
+    stmt = (select(rollup_cols)
+            .where(TelemetryRollup.source_table == table.name)
+            .where(TelemetryRollup.bin_seconds == tier)
+            .where(TelemetryRollup.time.between(int(floor(start / tier) * tier), stop))
+            .where(TelemetryRollup.column_name.in_(value_names)))
+    records = [tuple(row) for row in session.execute(stmt).fetchall()]
+
+    if stop >= rolled_until:
+        conditions = [time_col >= _to_native(time_col, rolled_until),
+                      time_col <= _to_native(time_col, stop)]
+        if filter_value is not None:
+            conditions.append(table.columns[filter_column] == filter_value)
+        for rec in _bin_stats(session, table, time_column, tier, conditions,
+                              stored_group_by):
+            if rec['column_name'] in value_names:
+                records.append((rec['time'], rec['group_key'], rec['column_name'],
+                                rec['num_values'], rec['min_value'], rec['mean_value'],
+                                rec['max_value']))
+
+    # combine the tier bins into the requested bins and groups
+    stored_group_cols = [table.columns[name] for name in stored_group_by]
+    group_inds = [stored_group_by.index(name) for name in group_by]
+    if filter_value is not None:
+        filter_ind = stored_group_by.index(filter_column)
+    bins = {}
+    for time, group_key, column_name, count, vmin, vmean, vmax in records:
+        group_values = _parse_group_key(group_key, stored_group_cols)
+        if filter_value is not None and group_values[filter_ind] != filter_value:
+            continue
+        key = ((time // bin_seconds) * bin_seconds,
+               tuple(group_values[ind] for ind in group_inds))
+        columns = bins.setdefault(key, {})
+        stats = columns.get(column_name)
+        if stats is None:
+            columns[column_name] = [count, vmin, vmean * count, vmax]
+        else:
+            stats[0] += count
+            stats[1] = min(stats[1], vmin)
+            stats[2] += vmean * count
+            stats[3] = max(stats[3], vmax)
+
+    keys = sorted(bins.keys())
+    arrays = {time_column: np.array([key[0] for key in keys], dtype=np.int64)}
+    if _is_datetime(time_col):
+        arrays[time_column] = arrays[time_column].astype('datetime64[s]')
+    for ind, name in enumerate(group_by):
+        arrays[name] = np.array([key[1][ind] for key in keys],
+                                dtype=object if len(keys) == 0 else None)
+    for name in value_names:
+        if agg == 'count':
+            values = np.zeros(len(keys), dtype=np.int64)
+        else:
+            values = np.full(len(keys), np.nan)
+        for ind, key in enumerate(keys):
+            stats = bins[key].get(name)
+            if stats is None:
+                continue
+            if agg == 'count':
+                values[ind] = stats[0]
+            elif agg == 'min':
+                values[ind] = stats[1]
+            elif agg == 'mean':
+                values[ind] = stats[2] / stats[0]
+            elif agg == 'sum':
+                values[ind] = stats[2]
+            else:
+                values[ind] = stats[3]
+        arrays[name] = values
+    return arrays
@@ -7,6 +7,7 @@
 """
 from __future__ import absolute_import, division, print_function
 
+import numpy as np
 from astropy.time import Time
 from math import floor
 from sqlalchemy import Column, BigInteger, Float, String
@@ -76,20 +77,78 @@ class RoachTemperature(MCDeclarativeBase):
                    fpga_temp=fpga_temp, ppc_temp=ppc_temp)
 
 
-def _get_redis_dict(roach_hostname):
-    import redis
+# columns of the roach_temperature table, in the order of the RoachTemperature.create arguments
+temperature_columns = ['ambient_temp', 'inlet_temp', 'outlet_temp', 'fpga_temp', 'ppc_temp']
 
-    redis_conn = redis.Redis(redis_dbname)
+
+def _get_redis_connection(redis_session=None):
+    if redis_session is None:
+        import redis
+
+        # the connection keeps a pool, so it is cheap to reuse
+        redis_session = redis.Redis(redis_dbname, decode_responses=True)
+    return redis_session
+
+
+def _to_str(value):
+    # connections made without decode_responses return bytes
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _get_redis_dict(roach_hostname, redis_session=None):
+    redis_conn = _get_redis_connection(redis_session)
 
     # Each key stores a hash table of different sensors
     # redis key names have the form "roachsensor:<roachhostname>"
     rkey = "roachsensor:%s" % roach_hostname
 
     # Get the entire hash table for this ROACH's key, returned as a dictionary
-    return redis_conn.hgetall(rkey)
+    return dict((_to_str(key), _to_str(val))
+                for key, val in redis_conn.hgetall(rkey).items())
+
+
+def _get_redis_dicts(redis_session=None):
+    """
+    Get the sensor hash tables of all the ROACHes in one pipelined round trip.
+
+    Returns:
+    --------
+    dict of the (string valued) hash tables keyed by roach hostname
+    """
+    redis_conn = _get_redis_connection(redis_session)
+
+    pipeline = redis_conn.pipeline(transaction=False)
+    for roach in roach_hostnames:
+        pipeline.hgetall("roachsensor:%s" % roach)
+    return dict((roach, dict((_to_str(key), _to_str(val)) for key, val in rdict.items()))
+                for roach, rdict in zip(roach_hostnames, pipeline.execute()))
+
+
+def _parse_redis_dicts(redis_dicts):
+    """
+    Convert the ROACH sensor hash tables to arrays, skipping ROACHes with no data.
+
+    Returns:
+    --------
+    dict of numpy arrays with the roach names, the unix 'timestamp' and the
+    temperature_columns in Celcius
+    """
+    roaches = [roach for roach in roach_hostnames if redis_dicts.get(roach)]
+    keys = ['timestamp'] + [roach_key_dict[col] for col in temperature_columns]
+    # one vectorized string to float conversion for all the values
+    values = np.array([[redis_dicts[roach][key] for key in keys] for roach in roaches],
+                      dtype=np.float64).reshape(len(roaches), len(keys))
+
+    arrays = {'roach': np.array(roaches, dtype=object), 'timestamp': values[:, 0]}
+    # temperatures are in millidegrees C. convert to degrees C
+    for ind, col in enumerate(temperature_columns):
+        arrays[col] = values[:, ind + 1] / 1000.
+    return arrays
 
 
-def create_from_redis(redis_dict=None):
+def create_from_redis(redis_dict=None, redis_session=None):
     """
     Return a list of roach temperature objects from the redis database.
 
@@ -97,32 +156,112 @@ def create_from_redis(redis_dict=None):
     ------------
     redis_dict: A dict spoofing the return dict from _get_redis_dict for testing
         purposes. Default: None
+    redis_session: redis.Redis object
+        Existing connection to the redis database to use, e.g. a persistent
+        one held by a daemon. Default: None (connect to redis_dbname)
 
     Returns:
     -----------
     A list of RoachTemperature objects
     """
 
+    if redis_dict is None:
+        redis_dict = _get_redis_dicts(redis_session=redis_session)
+    arrays = _parse_redis_dicts(redis_dict)
+
     roach_obj_list = []
-    for roach in roach_hostnames:
+    for ind, roach in enumerate(arrays['roach']):
+        time = Time(arrays['timestamp'][ind], format='unix')
+        temps = [float(arrays[col][ind]) for col in temperature_columns]
+        roach_obj_list.append(RoachTemperature.create(time, roach, *temps))
+
+    return roach_obj_list
 
-        if redis_dict is None:
-            # All items in this dictionary are strings.
-            rdict = _get_redis_dict(roach)
-        else:
-            rdict = redis_dict[roach]
 
-        time = Time(float(rdict['timestamp']), format='unix')
+class RoachTemperatureCollector(object):
+    """
+    Collect ROACH temperatures from Redis over one persistent connection.
 
-        # temperatures are in millidegrees C. convert to degrees C
-        ambient_temp = float(rdict[roach_key_dict['ambient_temp']]) / 1000.
-        inlet_temp = float(rdict[roach_key_dict['inlet_temp']]) / 1000.
-        outlet_temp = float(rdict[roach_key_dict['outlet_temp']]) / 1000.
-        fpga_temp = float(rdict[roach_key_dict['fpga_temp']]) / 1000.
-        ppc_temp = float(rdict[roach_key_dict['ppc_temp']]) / 1000.
+    Each read gets the hash tables of all the ROACHes in a single pipelined
+    round trip and parses them into arrays. The ROACHes update their hashes
+    every few seconds and the values expire after a minute, so the
+    temperatures can be polled at a high cadence with `sample`, which only
+    returns the ROACHes whose timestamps changed since the last sample that
+    was confirmed (see `confirm`) after it was written to the database.
 
-        roach_obj_list.append(RoachTemperature.create(time, roach, ambient_temp,
-                                                      inlet_temp, outlet_temp,
-                                                      fpga_temp, ppc_temp))
+    Parameters:
+    ------------
+    redis_session: redis.Redis object
+        Existing connection to the Redis database to use. Defaults to
+        connecting to redis_dbname.
+    """
 
-    return roach_obj_list
+    def __init__(self, redis_session=None):
+        self.redis = _get_redis_connection(redis_session)
+        self._last_timestamps = {}
+        self._pending_timestamps = {}
+
+    def read(self):
+        """
+        Read the current temperatures of all the ROACHes.
+
+        Returns:
+        --------
+        dict of numpy arrays with the roach names, the unix 'timestamp' and
+        the temperature_columns in Celcius, one entry per ROACH with data
+        """
+        return _parse_redis_dicts(_get_redis_dicts(redis_session=self.redis))
+
+    def sample(self):
+        """
+        Read the temperatures of the ROACHes whose timestamps changed since the
+        last confirmed sample. The new timestamps are only remembered once
+        `confirm` is called, so if writing the sample fails the same readings
+        are returned again by the next call.
+
+        Returns:
+        --------
+        dict of numpy arrays like `read`, only including the changed ROACHes
+        """
+        arrays = self.read()
+        changed = np.array([self._last_timestamps.get(roach) != timestamp
+                            for roach, timestamp in zip(arrays['roach'],
+                                                        arrays['timestamp'])], dtype=bool)
+        self._pending_timestamps = dict(zip(arrays['roach'][changed],
+                                            arrays['timestamp'][changed]))
+        return dict((col, values[changed]) for col, values in arrays.items())
+
+    def confirm(self):
+        """
+        Remember the timestamps of the last sample, call this once it has
+        been committed to the database.
+        """
+        self._last_timestamps.update(self._pending_timestamps)
+        self._pending_timestamps = {}
+
+    def add_to_session(self, session, changed_only=True):
+        """
+        Add the current temperatures to the M&C database, skipping records
+        that are already there.
+
+        Parameters:
+        ------------
+        session: MCSession object
+            session to add the records with (they are not committed).
+        changed_only: boolean
+            If True, only add the ROACHes whose timestamps changed since the
+            last confirmed call (see `sample`). Call `confirm` after the
+            session is committed.
+
+        Returns:
+        --------
+        number of records added
+        """
+        arrays = self.sample() if changed_only else self.read()
+        if len(arrays['roach']) == 0:
+            return 0
+        session.add_roach_temperature_bulk(Time(arrays['timestamp'], format='unix'),
+                                           arrays['roach'].tolist(),
+                                           *[arrays[col] for col in temperature_columns],
+                                           ignore_duplicates=True)
+        return len(arrays['roach'])
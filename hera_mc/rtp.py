@@ -185,7 +185,7 @@ class RTPTaskResourceRecord(MCDeclarativeBase):
 
     obsid: observation obsid (BigInteger). Part of primary_key. Foreign key into Observation table
     task_name: name of task in pipeline (e.g., OMNICAL) (String). Part of primary_key
-    start_time: start time of the task in floor(gps_seconds) (BigInteger)
+    start_time: start time of the task in floor(gps_seconds) (BigInteger). Indexed
     stop_time: stop time of the task in floor(gps_seconds) (BigInteger)
     max_memory: the maximum amount of memory consumed by a task, in MB (Float)
     avg_cpu_load: the average amount of CPU used by the task, as number of cores (e.g.,
@@ -194,7 +194,7 @@ class RTPTaskResourceRecord(MCDeclarativeBase):
     __tablename__ = 'rtp_task_resource_record'
     obsid = Column(BigInteger, ForeignKey('hera_obs.obsid'), primary_key=True)
     task_name = Column(Text, primary_key=True)
-    start_time = Column(BigInteger, nullable=False)
+    start_time = Column(BigInteger, nullable=False, index=True)
     stop_time = Column(BigInteger, nullable=False)
     max_memory = Column(Float, nullable=True)
     avg_cpu_load = Column(Float, nullable=True)
@@ -10,7 +10,11 @@ the documentation needs to be kept up to date with any changes.
 """
 from __future__ import absolute_import, division, print_function
 
+import os
+import time
+import socket
 from math import floor
+import numpy as np
 from astropy.time import Time
 from sqlalchemy import Column, Integer, String, Float, BigInteger
 
@@ -23,7 +27,7 @@ class ServerStatus(MCDeclarativeBase):
 
     hostname: name of server (String). Part of primary_key
     mc_time: time report received by M&C in floor(gps seconds) (BigInteger).
-        Part of primary_key
+        Part of primary_key. Indexed on its own for queries across all hosts
     ip_address: IP address of server (String)
     mc_system_timediff: difference between M&C time and time report sent by
         server in seconds (Float)
@@ -39,7 +43,7 @@ class ServerStatus(MCDeclarativeBase):
     """
     __abstract__ = True
     hostname = Column(String(32), primary_key=True)
-    mc_time = Column(BigInteger, primary_key=True)
+    mc_time = Column(BigInteger, primary_key=True, index=True)
     ip_address = Column(String(32), nullable=False)
     mc_system_timediff = Column(Float, nullable=False)
     num_cores = Column(Integer, nullable=False)
@@ -175,3 +179,96 @@ def plot_host_status_for_plotly(session):
         auto_open=False,
         filename='karoo_host_load_averages',
     )
+
+
+def get_ip_address():
+    """Return an IP address for this machine as a string.
+
+    This is not well defined -- machines have multiple interfaces, each with
+    its own IP address. We use eth0 if it exists, otherwise the first one
+    that isn't `lo`.
+
+    """
+    import netifaces
+
+    try:
+        addrs = netifaces.ifaddresses('eth0')
+    except ValueError:
+        for ifname in sorted(netifaces.interfaces()):
+            if ifname != 'lo':
+                addrs = netifaces.ifaddresses(ifname)
+                break
+        else:
+            return '?.?.?.?'
+
+    return addrs[netifaces.AF_INET][0]['addr']
+
+
+class ServerStatusMonitor(object):
+    """
+    Report the status of this machine. Memory and network use are sampled
+    at each call of `add_to_session` and a server_status record with their
+    averages is added every `report_every` calls.
+
+    Parameters:
+    ------------
+    report_every: integer
+        number of samples between reports.
+    """
+
+    def __init__(self, report_every=5):
+        self.report_every = report_every
+        self._samples = []
+
+    def sample(self):
+        """Record the current memory use and network byte counters."""
+        import psutil
+
+        # byte counters are unsigned 64 bit on current systems, so wrapping
+        # around is not a concern
+        net = psutil.net_io_counters()
+        self._samples.append((time.time(), psutil.virtual_memory().used,
+                              net.bytes_sent + net.bytes_recv))
+
+    def add_to_session(self, session, subsystem):
+        """
+        Take a sample and, if a report is due, add a server_status record
+        with the averages since the last report.
+
+        Parameters:
+        ------------
+        session: MCSession object
+            session to add the record with (it is not committed).
+        subsystem: string
+            name of the subsystem this machine is part of.
+
+        Returns:
+        --------
+        number of records added
+        """
+        import psutil
+
+        self.sample()
+        if len(self._samples) <= self.report_every:
+            return 0
+
+        sample_times, mem_used, net_bytes = [np.array(vals) for vals in zip(*self._samples)]
+        self._samples = self._samples[-1:]
+
+        num_cores = os.sysconf('SC_NPROCESSORS_ONLN')
+        vmem = psutil.virtual_memory()
+        memory_size_gb = vmem.total / 1024**3
+        # only the root filesystem is tracked, the pots report their status
+        # to M&C through the Librarian
+        disk = psutil.disk_usage('/')
+        network_bandwidth_mbs = ((net_bytes[-1] - net_bytes[0]) / 1024**2
+                                 / (sample_times[-1] - sample_times[0]))
+
+        session.add_server_status(subsystem, socket.gethostname(), get_ip_address(),
+                                  Time.now(), num_cores,
+                                  os.getloadavg()[1] / num_cores * 100.,
+                                  (time.time() - psutil.boot_time()) / 86400.,
+                                  (mem_used[1:].mean() / 1024**3) * 100. / memory_size_gb,
+                                  memory_size_gb, disk.percent, disk.total / 1024**3,
+                                  network_bandwidth_mbs=network_bandwidth_mbs)
+        return 1
@@ -22,7 +22,7 @@ class SubsystemError(MCDeclarativeBase):
     Definition of subsystem_error table.
 
     id: autoincrementing error id (BigInteger). Primary_key
-    time: time of error in floor(gps seconds) (BigInteger)
+    time: time of error in floor(gps seconds) (BigInteger). Indexed
     subsystem: name of subsystem (String)
     mc_time: time error was report to M&C in floor(gps seconds) (BigInteger)
     severity: integer indicating severity level, 1 is most severe (Integer)
@@ -30,7 +30,7 @@ class SubsystemError(MCDeclarativeBase):
     """
     __tablename__ = 'subsystem_error'
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    time = Column(BigInteger, nullable=False)
+    time = Column(BigInteger, nullable=False, index=True)
     subsystem = Column(String(32), nullable=False)
     mc_time = Column(BigInteger, nullable=False)
     severity = Column(Integer, nullable=False)
@@ -14,6 +14,17 @@ from sqlalchemy import Column, Float, BigInteger
 
 from . import MCDeclarativeBase
 
+# column names and their indices in the temperature list written to the text
+# file on tmon (see PaperTemperatures.new_from_text_row)
+temp_colnames = ['balun_east', 'cable_east',
+                 'balun_west', 'cable_west',
+                 'rcvr_1a', 'rcvr_1b', 'rcvr_2a', 'rcvr_2b',
+                 'rcvr_3a', 'rcvr_3b', 'rcvr_4a', 'rcvr_4b',
+                 'rcvr_5a', 'rcvr_5b', 'rcvr_6a', 'rcvr_6b',
+                 'rcvr_7a', 'rcvr_7b', 'rcvr_8a', 'rcvr_8b']
+temp_indices = (np.array([1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18,
+                          19, 20, 22, 23, 24, 25]) - 1).tolist()
+
 
 class PaperTemperatures(MCDeclarativeBase):
     """
@@ -105,14 +116,6 @@ class PaperTemperatures(MCDeclarativeBase):
             raise ValueError('time must be an astropy Time object')
         time = floor(time.gps)
 
-        temp_colnames = ['balun_east', 'cable_east',
-                         'balun_west', 'cable_west',
-                         'rcvr_1a', 'rcvr_1b', 'rcvr_2a', 'rcvr_2b',
-                         'rcvr_3a', 'rcvr_3b', 'rcvr_4a', 'rcvr_4b',
-                         'rcvr_5a', 'rcvr_5b', 'rcvr_6a', 'rcvr_6b',
-                         'rcvr_7a', 'rcvr_7b', 'rcvr_8a', 'rcvr_8b']
-        temp_indices = (np.array([1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18,
-                                  19, 20, 22, 23, 24, 25]) - 1).tolist()
         temp_values = [temp_list[i] for i in temp_indices]
         temp_dict = dict(zip(temp_colnames, temp_values))
         return cls(time=time, **temp_dict)
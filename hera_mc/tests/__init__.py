@@ -8,10 +8,13 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
 import unittest
 import socket
 import warnings
+import shutil
 import sys
+import tempfile
 import collections
 
 from .. import mc, cm_transfer
@@ -53,6 +56,19 @@ class TestHERAMC(unittest.TestCase):
         self.test_conn.close()
 
 
+# a class for tests that commit or use the database from other threads, which
+# the single rolled-back transaction of TestHERAMC does not allow
+class TestHERAMCScratchDB(unittest.TestCase):
+
+    def setUp(self):
+        # each test gets an empty database in a temporary directory
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.db = mc.DeclarativeDB('sqlite:///' + os.path.join(self.temp_dir, 'scratch.db'))
+        self.addCleanup(self.db.engine.dispose)
+        self.db.create_tables()
+
+
 # Functions that are useful for testing:
 def clearWarnings():
     """Quick code to make warnings reproducible."""
@@ -0,0 +1,161 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.archive`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+
+from .. import archive
+from ..autocorrelations import Autocorrelations
+from ..weather import WeatherData
+from . import TestHERAMC
+
+
+class TestArchive(TestHERAMC):
+
+    def setUp(self):
+        super(TestArchive, self).setUp()
+        self.archive_dir = tempfile.mkdtemp()
+
+        # two days of ten minute weather data for two variables
+        self.t0 = Time('2016-01-10 00:00:00', scale='utc')
+        self.times = self.t0 + TimeDelta(np.arange(288) * 600., format='sec')
+        self.stop = self.times[-1]
+        np.random.seed(0)
+        self.test_session.add_weather_data_bulk(self.times, 'wind_speed',
+                                                np.random.uniform(0, 20, 288))
+        self.test_session.add_weather_data_bulk(self.times, 'temperature',
+                                                np.random.uniform(10, 30, 288))
+        self.test_session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+        super(TestArchive, self).tearDown()
+
+    def check_same(self, result, expected):
+        self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+        for key, values in expected.items():
+            self.assertEqual(len(result[key]), len(values))
+            self.assertTrue(np.all(result[key] == values))
+
+    def test_weather_roundtrip(self):
+        partitions = self.test_session.export_archive('weather_data', self.archive_dir,
+                                                      self.t0, stoptime=self.stop,
+                                                      partition_seconds=43200)
+        self.assertEqual(sum(part['nrows'] for part in partitions), 576)
+        # partitions are aligned to gps time, 17 s before the start of each day
+        self.assertEqual(len(partitions), 4)
+        table_dir = os.path.join(self.archive_dir, 'weather_data')
+        self.assertTrue(os.path.exists(os.path.join(table_dir, partitions[0]['name'],
+                                                    'value.npy')))
+
+        reader = archive.ArchiveReader(self.archive_dir, 'weather_data')
+        self.assertEqual(reader.time_column, 'time')
+        self.assertEqual(reader.columns, ['time', 'variable', 'value'])
+
+        queries = [(self.t0, self.stop, None),
+                   (self.times[10], self.times[200], 'temperature'),
+                   (self.times[100], self.times[110], None),
+                   (self.times[5], None, 'wind_speed'),
+                   (self.stop + TimeDelta(60., format='sec'),
+                    self.stop + TimeDelta(600., format='sec'), None)]
+        for starttime, stoptime, variable in queries:
+            expected = self.test_session.get_weather_data(starttime, stoptime=stoptime,
+                                                          variable=variable,
+                                                          as_arrays=True)
+            result = reader.read(starttime, stoptime=stoptime, filter_column='variable',
+                                 filter_value=variable)
+            self.check_same(result, expected)
+
+        values = archive.read_archive(self.archive_dir, 'weather_data', self.t0,
+                                      stoptime=self.stop, filter_column='variable',
+                                      filter_value='wind_speed', columns=['value'])
+        self.assertEqual(list(values.keys()), ['value'])
+        self.assertTrue(np.allclose(values['value'], self.test_session.get_weather_data(
+            self.t0, stoptime=self.stop, variable='wind_speed', columns=['value'])['value']))
+        self.assertEqual(len(reader.read(self.t0, stoptime=self.stop, filter_column='variable',
+                                         filter_value='pressure')['time']), 0)
+
+        # plain columns of a single partition are memory-mapped
+        chunks = list(reader.iter_partitions(self.times[1], stoptime=self.times[2]))
+        self.assertEqual(len(chunks), 1)
+        self.assertIsInstance(chunks[0]['value'].base, np.memmap)
+
+        self.assertRaises(ValueError, reader.read, self.t0, stoptime=self.stop,
+                          columns=['foo'])
+        self.assertRaises(ValueError, reader.read, 'foo')
+        self.assertRaises(ValueError, archive.ArchiveReader, self.archive_dir, 'hera_obs')
+
+    def test_incremental_export(self):
+        # the first export is widened to the whole day
+        first_day = self.t0 + TimeDelta(3600., format='sec')
+        partitions = self.test_session.export_archive('weather_data', self.archive_dir,
+                                                      first_day, stoptime=first_day)
+        self.assertEqual(len(partitions), 1)
+
+        # re-exporting replaces partitions, and later ones are added
+        self.test_session.add_weather_data_bulk(self.times[:1], 'humidity', [50.])
+        self.test_session.commit()
+        self.test_session.export_archive('weather_data', self.archive_dir, self.t0,
+                                         stoptime=self.stop)
+        reader = archive.ArchiveReader(self.archive_dir, 'weather_data')
+        self.assertEqual(sum(part['nrows'] for part in reader.partitions), 577)
+        self.assertEqual(reader.read(self.t0, stoptime=self.stop, filter_column='variable',
+                                     filter_value='humidity')['value'].tolist(), [50.])
+        names = [part['name'] for part in reader.partitions]
+        self.assertEqual(names, sorted(set(names), key=int))
+
+        # partitions in the exported range that have no rows left are removed
+        self.test_session.query(WeatherData).filter(
+            WeatherData.time >= int(names[-1])).delete()
+        self.test_session.commit()
+        self.test_session.export_archive('weather_data', self.archive_dir, self.t0,
+                                         stoptime=self.stop)
+        reader = archive.ArchiveReader(self.archive_dir, 'weather_data')
+        self.assertEqual([part['name'] for part in reader.partitions], names[:-1])
+        self.assertTrue(len(names) > 1)
+        self.assertFalse(os.path.exists(os.path.join(self.archive_dir, 'weather_data',
+                                                     names[-1])))
+
+        self.assertRaises(ValueError, self.test_session.export_archive, 'weather_data',
+                          self.archive_dir, self.t0, partition_seconds=3600)
+        self.assertRaises(ValueError, self.test_session.export_archive, 'foo',
+                          self.archive_dir, self.t0)
+
+    def test_autocorrelations(self):
+        # DateTime time column
+        times = self.t0 + TimeDelta(np.arange(0, 86400 * 2, 3600), format='sec')
+        ind = 0
+        for time in times:
+            for antnum in [9, 10]:
+                self.test_session.add(Autocorrelations(
+                    id=ind, time=time.datetime, antnum=antnum, polarization='x',
+                    measurement_type=0, value=float(ind)))
+                ind += 1
+        self.test_session.commit()
+
+        partitions = archive.export_table(self.test_session, 'autocorrelations',
+                                          self.archive_dir, times[3], stoptime=times[30],
+                                          chunk_size=7)
+        self.assertEqual([part['nrows'] for part in partitions], [48, 48])
+
+        result = archive.read_archive(self.archive_dir, 'autocorrelations', times[3],
+                                      stoptime=times[30], filter_column='antnum',
+                                      filter_value=10)
+        expected = self.test_session.get_autocorrelations(times[3], stoptime=times[30],
+                                                          antnum=10, as_arrays=True)
+        self.check_same(result, expected)
+        self.assertEqual(result['time'].dtype, np.dtype('datetime64[us]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.autocorrelations`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+
+from .. import autocorrelations
+from ..tests import TestHERAMC
+
+try:
+    import fakeredis
+    have_fakeredis = True
+except ImportError:
+    have_fakeredis = False
+
+
+class TestAutocorrelations(TestHERAMC):
+
+    def setUp(self):
+        super(TestAutocorrelations, self).setUp()
+
+        self.t1 = Time('2018-02-10 01:15:23', scale='utc')
+        self.times = self.t1 + TimeDelta(np.arange(5) * 60., format='sec')
+        record_id = 0
+        for time in self.times:
+            for ant in [9, 10]:
+                for pol in 'xy':
+                    ac = autocorrelations.Autocorrelations()
+                    ac.id = record_id
+                    ac.time = time.datetime
+                    ac.antnum = ant
+                    ac.polarization = pol
+                    ac.measurement_type = autocorrelations.MeasurementTypes.median
+                    ac.value = float(ant + record_id)
+                    self.test_session.add(ac)
+                    record_id += 1
+        self.test_session.commit()
+
+    def test_get_autocorrelations(self):
+        result = self.test_session.get_autocorrelations(self.t1 - TimeDelta(3.0, format='sec'))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].time, self.t1.datetime)
+
+        result = self.test_session.get_autocorrelations(self.t1, stoptime=self.times[-1],
+                                                        antnum=9)
+        self.assertEqual(len(result), 10)
+
+        result = self.test_session.get_autocorrelations(self.t1, stoptime=self.times[1],
+                                                        as_arrays=True)
+        self.assertEqual(len(result['value']), 8)
+        self.assertEqual(result['time'].dtype, np.dtype('datetime64[us]'))
+
+    def test_get_autocorrelations_aggregated(self):
+        result = self.test_session.get_autocorrelations(self.t1, stoptime=self.times[-1],
+                                                        antnum=9, bin_seconds=120,
+                                                        agg='max')
+        bins = (np.floor(self.times.unix).astype(np.int64) // 120) * 120
+        unique_bins = np.unique(bins)
+        self.assertEqual(result['time'].dtype, np.dtype('datetime64[s]'))
+        self.assertTrue(np.all(result['time'][::2].astype(np.int64) == unique_bins))
+        self.assertTrue(np.all(result['antnum'] == 9))
+        self.assertEqual(result['polarization'].tolist(), ['x', 'y'] * len(unique_bins))
+
+        # values are ant + record id, ant 9 x is record 4 * time index
+        expected = np.array([9. + 4 * np.nonzero(bins == b)[0][-1] for b in unique_bins])
+        self.assertTrue(np.allclose(result['value'][::2], expected))
+
+    def test_iter_autocorrelations(self):
+        chunks = list(self.test_session.iter_autocorrelations(self.t1, antnum=10,
+                                                              chunk_size=4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertTrue(all(obj.antnum == 10 for chunk in chunks for obj in chunk))
+
+        chunks = list(self.test_session.iter_autocorrelations(self.t1, chunk_size=8,
+                                                              columns=['time', 'value']))
+        self.assertEqual(len(chunks), 3)
+        times = np.concatenate([chunk['time'] for chunk in chunks])
+        self.assertTrue(np.all(np.diff(times) >= np.timedelta64(0)))
+
+    def test_get_statistics(self):
+        np.random.seed(0)
+        spectra = np.random.uniform(0, 10, (6, 1024)).astype(np.float32)
+        stats = autocorrelations.get_statistics(spectra)
+        mtypes = autocorrelations.MeasurementTypes
+        self.assertEqual(sorted(stats.keys()), list(range(len(mtypes.names))))
+        for ind, spectrum in enumerate(spectra):
+            self.assertAlmostEqual(stats[mtypes.median][ind], np.median(spectrum))
+            self.assertAlmostEqual(stats[mtypes.mean][ind], np.mean(spectrum), places=5)
+            self.assertAlmostEqual(stats[mtypes.rms][ind], np.sqrt(np.mean(spectrum**2)),
+                                   places=5)
+            self.assertEqual(stats[mtypes.min][ind], spectrum.min())
+            self.assertEqual(stats[mtypes.max][ind], spectrum.max())
+            self.assertAlmostEqual(stats[mtypes.median_band2][ind],
+                                   np.median(spectrum[512:768]))
+
+    @unittest.skipIf(not have_fakeredis, 'fakeredis is not installed')
+    def test_add_from_redis(self):
+        redis_session = fakeredis.FakeStrictRedis()
+        redis_session.flushall()
+        np.random.seed(1)
+        spectra = {}
+        for ant in [9, 10, 20]:
+            for pol in 'xy':
+                spectra[(ant, pol)] = np.random.uniform(0, 10, 256).astype(np.float32)
+                redis_session.hmset('visdata://%d/%d/%s%s' % (ant, ant, pol, pol),
+                                    {'data': spectra[(ant, pol)].tobytes()})
+        # 20y has no data, 21 is missing
+        redis_session.hdel('visdata://20/20/yy', 'data')
+        redis_session.hset('visdata://20/20/yy', 'foo', 'bar')
+
+        time = (self.t1 + TimeDelta(3600., format='sec')).datetime
+        autos, failures = autocorrelations.create_from_redis(
+            redis_session=redis_session, antnums=[9, 10, 20, 21], time=time)
+        self.assertEqual(sorted(failures), [(20, 'y'), (21, 'x'), (21, 'y')])
+        nstats = len(autocorrelations.MeasurementTypes.names)
+        self.assertEqual(len(autos), 5 * nstats)
+        medians = dict(((obj.antnum, obj.polarization), obj.value) for obj in autos
+                       if obj.measurement_type == autocorrelations.MeasurementTypes.median)
+        for key, value in medians.items():
+            self.assertAlmostEqual(value, float(np.median(spectra[key])))
+
+        n_records, failures = self.test_session.add_autocorrelations_from_redis(
+            redis_session=redis_session, antnums=[9, 10, 20, 21], time=time,
+            spectra_decimation=16)
+        self.assertEqual(n_records, 5 * nstats)
+        self.assertEqual(len(failures), 3)
+        result = self.test_session.get_autocorrelations(
+            self.t1 + TimeDelta(3000., format='sec'),
+            stoptime=self.t1 + TimeDelta(4000., format='sec'), antnum=10, as_arrays=True)
+        self.assertEqual(sorted(result['measurement_type'].tolist()),
+                         sorted(list(range(nstats)) * 2))
+        maxes = result['value'][result['measurement_type']
+                                == autocorrelations.MeasurementTypes.max]
+        self.assertEqual(sorted(maxes.tolist()),
+                         sorted([float(spectra[(10, 'x')].max()),
+                                 float(spectra[(10, 'y')].max())]))
+
+        result = self.test_session.get_autocorrelation_spectra(
+            self.t1 + TimeDelta(3000., format='sec'))
+        self.assertEqual(result['spectra'].shape, (1, 3, 2, 16))
+        self.assertTrue(np.allclose(result['spectra'][0, 0, 0],
+                                    spectra[(9, 'x')].reshape(16, 16).mean(axis=1)))
+        self.assertTrue(np.all(np.isnan(result['spectra'][0, 2, 1])))
+
+    def test_encode_spectrum(self):
+        spectrum = np.linspace(0, 100, 64)
+        for dtype in autocorrelations.spectrum_dtypes:
+            for codec in autocorrelations.spectrum_codecs:
+                data = autocorrelations.encode_spectrum(spectrum, dtype=dtype, codec=codec)
+                decoded = autocorrelations.decode_spectrum(data, dtype, codec)
+                self.assertEqual(decoded.dtype, np.dtype(dtype))
+                self.assertTrue(np.allclose(decoded, spectrum, rtol=1e-3))
+        self.assertEqual(len(autocorrelations.encode_spectrum(spectrum, dtype='float16',
+                                                              codec='none')), 128)
+        self.assertRaises(ValueError, autocorrelations.encode_spectrum, spectrum,
+                          dtype='float64')
+        self.assertRaises(ValueError, autocorrelations.encode_spectrum, spectrum,
+                          codec='lz4')
+
+        decimated = autocorrelations.decimate_spectra(np.arange(10.)[np.newaxis], 3)
+        self.assertEqual(decimated.tolist(), [[1., 4., 7.]])
+        self.assertRaises(ValueError, autocorrelations.decimate_spectra, np.arange(2.), 3)
+
+    def test_autocorrelation_spectra(self):
+        np.random.seed(2)
+        spectra = np.random.uniform(0, 10, (len(self.times), 3, 2, 1024))
+        antnums = [9, 10, 20]
+        for time_ind, time in enumerate(self.times[:-1]):
+            self.test_session.add_autocorrelation_spectra(
+                time, np.repeat(antnums, 2), ['x', 'y'] * 3,
+                spectra[time_ind].reshape(6, 1024), decimation=8)
+        # 20y is missing at the last time
+        self.test_session.add_autocorrelation_spectra(
+            self.times[-1], [9, 9, 10, 10, 20], ['x', 'y', 'x', 'y', 'x'],
+            spectra[-1].reshape(6, 1024)[:5], decimation=8)
+        self.test_session.commit()
+
+        expected = spectra.reshape(len(self.times), 3, 2, 128, 8).mean(axis=-1)
+        result = self.test_session.get_autocorrelation_spectra(self.t1,
+                                                               stoptime=self.times[-1])
+        self.assertEqual(result['spectra'].shape, (len(self.times), 3, 2, 128))
+        self.assertEqual(result['spectra'].dtype, np.float32)
+        self.assertEqual(result['antnum'].tolist(), antnums)
+        self.assertEqual(result['polarization'].tolist(), ['x', 'y'])
+        self.assertEqual(result['decimation'], 8)
+        self.assertTrue(np.all(result['time'] == self.times.datetime.astype('datetime64[us]')))
+        self.assertTrue(np.all(np.isnan(result['spectra'][-1, 2, 1])))
+        self.assertTrue(np.allclose(result['spectra'][:-1], expected[:-1]))
+        self.assertTrue(np.allclose(result['spectra'][-1, :2], expected[-1, :2]))
+
+        result = self.test_session.get_autocorrelation_spectra(
+            self.t1 + TimeDelta(1., format='sec'), antnum=10, polarization='y')
+        self.assertEqual(result['spectra'].shape, (1, 1, 1, 128))
+        self.assertEqual(result['time'][0], self.times[1].datetime)
+        self.assertTrue(np.allclose(result['spectra'][0, 0, 0], expected[1, 1, 1]))
+
+        result = self.test_session.get_autocorrelation_spectra(
+            self.times[-1] + TimeDelta(1., format='sec'))
+        self.assertEqual(result['spectra'].shape, (0, 0, 0, 0))
+
+        # float16 without compression, different decimation
+        later = self.times[-1] + TimeDelta(60., format='sec')
+        self.test_session.add_autocorrelation_spectra(later, 9, 'x', spectra[0, :1, 0],
+                                                      decimation=4, dtype='float16',
+                                                      codec='none')
+        result = self.test_session.get_autocorrelation_spectra(later)
+        self.assertEqual(result['spectra'].shape, (1, 1, 1, 256))
+        self.assertTrue(np.allclose(result['spectra'][0, 0, 0],
+                                    spectra[0, 0, 0].reshape(256, 4).mean(axis=1),
+                                    rtol=1e-3))
+        self.assertRaises(ValueError, self.test_session.get_autocorrelation_spectra,
+                          self.t1, stoptime=later)
+        self.assertRaises(ValueError, self.test_session.add_autocorrelation_spectra,
+                          later.datetime, 9, 'x', spectra[0, :1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.buffered_writer`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+import unittest
+import numpy as np
+from six.moves import queue
+from astropy.time import Time, TimeDelta
+
+from ..buffered_writer import BufferedWriter
+from . import TestHERAMCScratchDB
+
+
+class TestBufferedWriter(TestHERAMCScratchDB):
+
+    def setUp(self):
+        # the writer commits, so use a scratch database
+        super(TestBufferedWriter, self).setUp()
+        self.t1 = Time('2016-01-10 01:15:23', scale='utc')
+        self.times = self.t1 + TimeDelta(np.arange(20) * 60., format='sec')
+
+    def get_weather_values(self):
+        with self.db.sessionmaker() as session:
+            return [obj.value for obj in
+                    session.get_weather_data(self.t1, stoptime=self.times[-1])]
+
+    def test_batches(self):
+        with BufferedWriter(self.db, max_batch_size=5, max_batch_interval=60.) as writer:
+            for ind in range(12):
+                writer.add_weather_data(self.times[ind], 'wind_speed', float(ind))
+            self.assertTrue(writer.flush(timeout=10))
+            self.assertEqual(len(self.get_weather_values()), 12)
+
+            stats = writer.stats()
+            self.assertEqual(stats['n_queued'], 12)
+            self.assertEqual(stats['n_written'], 12)
+            self.assertEqual(stats['n_batches'], 3)
+            self.assertEqual(stats['queue_depth'], 0)
+            self.assertTrue(stats['max_flush_latency'] >= stats['mean_flush_latency'] > 0)
+
+            writer.add_weather_data_bulk(self.times[12:], 'wind_speed', np.arange(12., 20.))
+        self.assertEqual(self.get_weather_values(), list(np.arange(20.)))
+        self.assertRaises(RuntimeError, writer.add_weather_data, self.t1, 'wind_speed', 1.)
+        self.assertTrue(writer.flush())
+
+    def test_interval(self):
+        writer = BufferedWriter(self.db, max_batch_size=100, max_batch_interval=0.1)
+        writer.add_weather_data(self.times[0], 'wind_speed', 1.)
+        for _ in range(100):
+            if writer.stats()['n_written'] == 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(self.get_weather_values()), 1)
+        writer.close()
+
+    def test_errors(self):
+        writer = BufferedWriter(self.db, max_batch_size=10)
+        writer.add_weather_data(self.times[0], 'wind_speed', 1.)
+        writer.add_weather_data(self.times[1], 'foo', 2.)
+        writer.add_weather_data(self.times[0], 'wind_speed', 3.)
+        writer.add_weather_data(self.times[2], 'wind_speed', 4.)
+        writer.close()
+
+        # the bad variable and the duplicate are lost, the others are written
+        self.assertEqual(self.get_weather_values(), [1., 4.])
+        stats = writer.stats()
+        self.assertEqual(stats['n_written'], 2)
+        self.assertEqual(stats['n_errors'], 2)
+
+        self.assertRaises(AttributeError, getattr, writer, 'get_weather_data')
+        self.assertRaises(ValueError, BufferedWriter, self.db, overflow='foo')
+        self.assertRaises(ValueError, BufferedWriter, self.db, max_batch_size=0)
+
+    def test_overflow(self):
+        for overflow in ['drop', 'raise']:
+            writer = BufferedWriter(self.db, max_batch_size=1, max_queue_size=2,
+                                    overflow=overflow)
+            # stall the writer thread on the first call so the queue fills up
+            release = threading.Event()
+            writer._apply = lambda session, call: release.wait()
+            writer.add_weather_data(self.times[0], 'wind_speed', 1.)
+            while writer.stats()['queue_depth'] > 0:
+                time.sleep(0.01)
+            writer.add_weather_data(self.times[1], 'wind_speed', 2.)
+            writer.add_weather_data(self.times[2], 'wind_speed', 3.)
+            self.assertEqual(writer.stats()['max_queue_depth'], 2)
+            if overflow == 'drop':
+                writer.add_weather_data(self.times[3], 'wind_speed', 4.)
+                self.assertEqual(writer.stats()['n_dropped'], 1)
+            else:
+                self.assertRaises(queue.Full, writer.add_weather_data, self.times[3],
+                                  'wind_speed', 4.)
+            release.set()
+            writer.close()
+            self.assertEqual(writer.stats()['n_queued'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
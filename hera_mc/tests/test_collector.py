@@ -0,0 +1,110 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.collector`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import time
+import unittest
+from astropy.time import Time
+
+from ..roach import roach_hostnames, roach_key_dict, RoachTemperature
+from . import TestHERAMCScratchDB
+
+try:
+    from .. import collector
+    have_tornado = True
+except ImportError:
+    have_tornado = False
+
+try:
+    import fakeredis
+    have_fakeredis = True
+except ImportError:
+    have_fakeredis = False
+
+
+if have_tornado:
+    class FailingSource(collector.Source):
+
+        def collect(self, session):
+            raise RuntimeError('no data')
+
+
+@unittest.skipIf(not have_tornado, 'tornado is not installed')
+@unittest.skipIf(not have_fakeredis, 'fakeredis is not installed')
+class TestCollector(TestHERAMCScratchDB):
+
+    def setUp(self):
+        # use a scratch database so the sessions can be used from worker threads
+        super(TestCollector, self).setUp()
+        collector.collector_sources['failing'] = FailingSource
+
+        self.redis = fakeredis.FakeStrictRedis(decode_responses=True)
+        self.redis.flushall()
+        self.timestamp = Time('2016-01-10 01:15:23', scale='utc').unix
+        for roach in roach_hostnames:
+            sensors = dict((key, 40000.) for key in roach_key_dict.values())
+            sensors['timestamp'] = self.timestamp
+            self.redis.hmset('roachsensor:' + roach, sensors)
+
+    def tearDown(self):
+        collector.collector_sources.pop('failing', None)
+
+    def test_run(self):
+        config = {'stats_interval': 0.1,
+                  'sources': {'roach_temperatures': {'cadence': 0.05},
+                              'failing': {'cadence': 0.05}}}
+        daemon = collector.CollectorDaemon(self.db, config, redis_session=self.redis)
+        self.assertEqual([source.name for source in daemon.sources],
+                         ['failing', 'roach_temperatures'])
+        start = time.time()
+        daemon.run(duration=0.3)
+        self.assertLess(time.time() - start, 1.)
+
+        stats = daemon.stats()
+        roach_stats = stats['roach_temperatures']
+        self.assertGreater(roach_stats['runs'], 2)
+        self.assertEqual(roach_stats['failures'], 0)
+        # the timestamps don't change, so only the first run adds records
+        self.assertEqual(roach_stats['records'], len(roach_hostnames))
+        self.assertGreater(roach_stats['mean_duration'], 0.)
+
+        failing_stats = stats['failing']
+        self.assertEqual(failing_stats['failures'], failing_stats['runs'])
+        self.assertEqual(failing_stats['consecutive_failures'], failing_stats['runs'])
+        self.assertEqual(failing_stats['last_error'], 'RuntimeError: no data')
+
+        with self.db.sessionmaker() as session:
+            self.assertEqual(session.query(RoachTemperature).count(), len(roach_hostnames))
+
+        published = self.redis.hgetall('mc_collector:' + daemon.hostname)
+        self.assertEqual(sorted(published.keys()), ['failing', 'roach_temperatures'])
+        self.assertEqual(json.loads(published['failing'])['last_error'],
+                         'RuntimeError: no data')
+
+    def test_config(self):
+        self.assertRaises(ValueError, collector.CollectorDaemon, self.db,
+                          {'sources': {'foo': {}}})
+        self.assertRaises(ValueError, collector.CollectorDaemon, self.db, {'sources': {}})
+
+        config_path = os.path.join(self.temp_dir, 'mc_config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'default_db_name': 'testing'}, f)
+        self.assertRaises(RuntimeError, collector.get_collector_config, config_path)
+
+        with open(config_path, 'w') as f:
+            json.dump({'collector': {'sources': {'weather': {'cadence': 100}}}}, f)
+        daemon = collector.CollectorDaemon(self.db, collector.get_collector_config(config_path))
+        self.assertEqual(daemon.sources[0].cadence, 100.)
+        self.assertEqual(daemon.sources[0].lookback, 300.)
+        self.assertRaises(RuntimeError, getattr, daemon, 'redis')
+
+
+if __name__ == '__main__':
+    unittest.main()
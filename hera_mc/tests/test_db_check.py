@@ -1,5 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
+import os
+import json
+import shutil
+import tempfile
+import threading
+import nose.tools as nt
 from sqlalchemy import create_engine, Column, Integer, String
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
@@ -9,6 +15,8 @@ from sqlalchemy import ForeignKey
 
 from ..db_check import is_valid_database
 from ..db_check import check_connection
+from ..db_check import (is_valid_database_cached, get_alembic_revision,
+                        schema_fingerprint)
 from .. import mc
 
 
@@ -196,3 +204,183 @@ def test_check_connection():
     db = mc.DeclarativeDB('postgresql://hera@localhost/foo')
     with db.sessionmaker() as s:
         assert check_connection(s) is False
+
+
+def test_engine_registry():
+    """ Check that repeated connections share the same DB object and engine. """
+    db = mc.connect_to_mc_testing_db()
+    db2 = mc.connect_to_mc_testing_db()
+    assert db2 is db
+    assert db2.engine is db.engine
+
+    url = str(db.engine.url)
+    engine = mc.get_engine(url, pool_settings={'pool_pre_ping': True,
+                                               'pool_size': 3})
+    assert engine is not db.engine
+    assert engine is mc.get_engine(url, pool_settings={'pool_size': 3,
+                                                       'pool_pre_ping': True})
+    assert engine.pool._pre_ping is True
+
+    engines = []
+    threads = [threading.Thread(target=lambda: engines.append(mc.get_engine(url)))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(e is db.engine for e in engines)
+
+    nt.assert_raises(ValueError, mc.get_engine, url, pool_settings={'foo': 1})
+
+
+def test_pool_settings_from_config():
+    """ Check that pool settings are read from the config file. """
+    url = str(mc.connect_to_mc_testing_db().engine.url)
+    config = {'default_db_name': 'pooled',
+              'databases': {'pooled': {'url': url, 'mode': 'testing',
+                                       'pool_pre_ping': True, 'pool_recycle': 300}}}
+    config_dir = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(config_dir, 'mc_config.json')
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        args = mc.get_mc_argument_parser().parse_args(['--config', config_path])
+        db = mc.connect_to_mc_db(args)
+        assert db.engine.pool._pre_ping is True
+        assert db.engine.pool._recycle == 300
+        assert mc.connect_to_mc_db(args) is db
+    finally:
+        shutil.rmtree(config_dir)
+
+
+def test_read_replica():
+    """ Check that reads go to the replica and writes to the primary. """
+    from astropy.time import Time, TimeDelta
+    from ..weather import WeatherData
+
+    db_dir = tempfile.mkdtemp()
+    try:
+        primary_url = 'sqlite:///' + os.path.join(db_dir, 'primary.db')
+        replica_url = 'sqlite:///' + os.path.join(db_dir, 'replica.db')
+        config = {'default_db_name': 'replicated',
+                  'databases': {'replicated': {'url': primary_url, 'mode': 'testing',
+                                               'read_url': replica_url,
+                                               'read_after_write': None,
+                                               'instrument_queries': True}}}
+        config_path = os.path.join(db_dir, 'mc_config.json')
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        args = mc.get_mc_argument_parser().parse_args(['--config', config_path])
+        db = mc.connect_to_mc_db(args)
+        assert str(db.read_engine.url) == replica_url
+        db.create_tables()
+        mc.DeclarativeDB(replica_url).create_tables()
+
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        t2 = Time('2016-01-10 01:16:23', scale='utc')
+        t3 = t2 + TimeDelta(60., format='sec')
+        t4 = t3 + TimeDelta(60., format='sec')
+        with db.sessionmaker() as session:
+            session.add_weather_data(t1, 'wind_speed', 1.)
+
+        # without read-after-write consistency the session reads the (empty) replica
+        with db.sessionmaker() as session:
+            assert session.get_weather_data(t1) == []
+            assert session.query(WeatherData).count() == 0
+            session.add_weather_data(t2, 'wind_speed', 2.)
+            session.flush()
+            assert session.get_weather_data(t2) == []
+            assert session.get_latest_weather() == []
+
+        # "replicate" one row
+        db.read_engine.execute(WeatherData.__table__.insert(),
+                               {'time': int(t1.gps), 'variable': 'wind_speed',
+                                'value': 1.})
+        with db.sessionmaker() as session:
+            assert [obj.value for obj in session.get_weather_data(t1, stoptime=t2)] == [1.]
+            assert session.get_weather_data(t1, stoptime=t2, as_arrays=True)['value'] == [1.]
+
+        # with it, reads go to the primary after a write, including uncommitted ones
+        session = db.sessionmaker(read_after_write=60.)
+        assert len(session.get_weather_data(t1, stoptime=t2)) == 1
+        session.add_weather_data(t3, 'wind_speed', 3.)
+        assert len(session.get_weather_data(t1, stoptime=t3)) == 3
+        session.commit()
+        assert len(session.get_weather_data(t1, stoptime=t3)) == 3
+        session.read_after_write = 0.
+        assert len(session.get_weather_data(t1, stoptime=t3)) == 1
+        session.close()
+
+        session = db.sessionmaker(read_after_write=0.)
+        session.add_weather_data(t4, 'wind_speed', 4.)
+        session.flush()
+        assert len(session.get_weather_data(t1, stoptime=t4)) == 4
+        session.rollback()
+        assert len(session.get_weather_data(t1, stoptime=t4)) == 1
+        session.close()
+
+        # textual and function SELECTs are reads too
+        session = db.sessionmaker(read_after_write=60.)
+        session.get_current_db_time(strict=True)
+        assert session.execute('  select count(*) from weather_data').scalar() == 1
+        assert get_alembic_revision(session) is None
+        assert session._last_write_time is None
+        assert session.get_bind(clause=sqlalchemy.text('SELECT 1')) is db.read_engine
+        session.execute("DELETE FROM weather_data WHERE variable = 'foo'")
+        assert session._last_write_time is not None
+        session.close()
+
+        # reads on both databases show up in the query stats
+        with db.sessionmaker() as session:
+            stats = dict((site['call_site'], site) for site in session.query_stats())
+        assert stats['MCSession.get_weather_data']['count'] >= 7
+    finally:
+        shutil.rmtree(db_dir)
+
+
+def test_validity_cached():
+    """ Check that validated schemas are cached and the cache is used. """
+    engine = mc.connect_to_mc_testing_db().engine
+    conn = engine.connect()
+    Session = sessionmaker(bind=conn)
+    session = Session()
+
+    cache_dir = tempfile.mkdtemp()
+    cache_file = os.path.join(cache_dir, 'hera_mc', 'schema_cache.json')
+    Base, ValidTestModel = gen_test_model()
+    Base.metadata.drop_all(conn, tables=[ValidTestModel.__table__])
+    try:
+        # without alembic there is nothing to key the cache on
+        assert get_alembic_revision(session) is None
+        assert is_valid_database_cached(Base, session, cache_file=cache_file) is False
+        assert not os.path.exists(cache_file)
+
+        conn.execute('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)')
+        conn.execute("INSERT INTO alembic_version VALUES ('abc123')")
+        assert get_alembic_revision(session) == 'abc123'
+
+        Base.metadata.create_all(conn, tables=[ValidTestModel.__table__])
+        assert is_valid_database_cached(Base, session, cache_file=cache_file) is True
+        with open(cache_file) as f:
+            cache = json.load(f)
+        assert cache[repr(engine.url)] == {'revision': 'abc123',
+                                           'fingerprint': schema_fingerprint(Base)}
+
+        # with a matching entry the database is not reflected again, so the
+        # missing table is only noticed when validation is forced
+        Base.metadata.drop_all(conn, tables=[ValidTestModel.__table__])
+        assert is_valid_database_cached(Base, session, cache_file=cache_file) is True
+        assert is_valid_database_cached(Base, session, force=True,
+                                        cache_file=cache_file) is False
+
+        # a new revision or a different declared schema invalidates the entry
+        conn.execute("UPDATE alembic_version SET version_num = 'def456'")
+        assert is_valid_database_cached(Base, session, cache_file=cache_file) is False
+        Base2, RelationTestModel, RelationTestModel2 = gen_relation_models()
+        assert schema_fingerprint(Base2) != schema_fingerprint(Base)
+    finally:
+        session.close()
+        Base.metadata.drop_all(conn, tables=[ValidTestModel.__table__])
+        conn.execute('DROP TABLE IF EXISTS alembic_version')
+        conn.close()
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,40 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for the lazy imports in `hera_mc`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import sys
+import unittest
+import subprocess
+import nose.tools as nt
+
+import hera_mc
+
+
+def test_lazy_import():
+    if sys.version_info < (3, 7):
+        raise unittest.SkipTest('lazy imports require python 3.7 or later')
+
+    code = ('import sys, hera_mc; '
+            'print(sorted(m for m in ["pandas", "astropy", "tornado", "hera_mc.weather"] '
+            'if m in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    nt.assert_equal(output.strip(), '[]')
+
+
+def test_lazy_attributes():
+    nt.assert_equal(hera_mc.weather.WeatherData.__tablename__, 'weather_data')
+    nt.assert_true(hasattr(hera_mc.mc, 'connect_to_mc_db'))
+    nt.assert_raises(AttributeError, getattr, hera_mc, 'foo')
+
+
+def test_load_table_modules():
+    hera_mc._load_table_modules()
+    tables = hera_mc.MCDeclarativeBase.metadata.tables
+    for name in ['hera_obs', 'weather_data', 'roach_temperature', 'cm_version',
+                 'autocorrelations', 'ant_metrics']:
+        nt.assert_true(name in tables)
@@ -89,6 +89,24 @@ class TestLibrarian(TestHERAMC):
         result2 = result2[0]
         self.assertFalse(result2.isclose(expected))
 
+    def test_add_ignore_duplicates(self):
+        status = LibStatus.create(*self.status_values)
+        remote_status = LibRemoteStatus.create(*self.remote_status_values)
+        self.test_session.add_all_ignore_duplicates([status, remote_status])
+        self.test_session.add_all_ignore_duplicates([LibStatus.create(*self.status_values),
+                                                     remote_status])
+
+        result = self.test_session.get_lib_status(self.status_columns['time']
+                                                  - TimeDelta(2, format='sec'),
+                                                  stoptime=self.status_columns['time'])
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].isclose(status))
+        result = self.test_session.get_lib_remote_status(
+            self.remote_status_columns['time'] - TimeDelta(2, format='sec'),
+            stoptime=self.remote_status_columns['time'])
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].isclose(remote_status))
+
     def test_errors_lib_status(self):
         self.assertRaises(ValueError, self.test_session.add_lib_status, 'foo',
                           *self.status_values[1:])
@@ -0,0 +1,130 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.mc_async`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+from sqlalchemy import inspect
+
+from .. import mc
+from . import TestHERAMCScratchDB
+
+try:
+    import tornado.gen
+    import tornado.ioloop
+    from .. import mc_async
+    from ..mc_async import AsyncMCSession
+    have_tornado = True
+except ImportError:
+    have_tornado = False
+
+
+@unittest.skipIf(not have_tornado, 'tornado (or futures on python 2) is not installed')
+class TestAsyncMCSession(TestHERAMCScratchDB):
+
+    def setUp(self):
+        # use a scratch database so the session can be used from the worker thread
+        super(TestAsyncMCSession, self).setUp()
+        self.session = self.db.sessionmaker()
+        self.t1 = Time('2016-01-10 01:15:23', scale='utc')
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_add_get(self):
+        times = self.t1 + TimeDelta(np.arange(5) * 60., format='sec')
+        async_session = AsyncMCSession(session=self.session)
+
+        @tornado.gen.coroutine
+        def run():
+            yield async_session.add_weather_data_bulk(times, 'wind_speed', np.arange(5.))
+            yield async_session.add_weather_data(times[0], 'temperature', 20.)
+            yield async_session.commit()
+            # several calls can be in flight at once, they run in order
+            results = yield [async_session.get_weather_data(self.t1, stoptime=times[-1],
+                                                            variable='wind_speed'),
+                             async_session.get_latest_weather()]
+            raise tornado.gen.Return(results)
+
+        weather, latest = tornado.ioloop.IOLoop.current().run_sync(run)
+        self.assertEqual([obj.value for obj in weather], list(np.arange(5.)))
+        self.assertEqual([obj.variable for obj in latest], ['temperature', 'wind_speed'])
+
+        thread_name = tornado.ioloop.IOLoop.current().run_sync(
+            lambda: async_session.run(lambda session: threading.current_thread().name))
+        self.assertNotEqual(thread_name, threading.current_thread().name)
+
+        tornado.ioloop.IOLoop.current().run_sync(async_session.close)
+        self.assertEqual(len(self.session.get_weather_data(self.t1, stoptime=times[-1])), 6)
+
+    def test_results_detached(self):
+        async_session = AsyncMCSession(session=self.session)
+
+        @tornado.gen.coroutine
+        def run():
+            yield async_session.add_weather_data(self.t1, 'temperature', 20.)
+            yield async_session.commit()
+            weather = yield async_session.get_weather_data(self.t1)
+            # a later commit would expire objects still bound to the session
+            yield async_session.add_weather_data(self.t1, 'wind_speed', 3.)
+            yield async_session.commit()
+            raise tornado.gen.Return(weather)
+
+        weather = tornado.ioloop.IOLoop.current().run_sync(run)
+        self.assertTrue(inspect(weather[0]).detached)
+        self.assertEqual([(obj.variable, obj.value) for obj in weather],
+                         [('temperature', 20.)])
+        tornado.ioloop.IOLoop.current().run_sync(async_session.close)
+
+    def test_shared_workers(self):
+        # many sessions share the worker pool, the calls on each run in order
+        sessions = [AsyncMCSession(self.db) for _ in range(3 * mc_async.default_max_workers)]
+        threads = set()
+
+        def record(session, ind):
+            threads.add(threading.current_thread().name)
+            return ind
+
+        @tornado.gen.coroutine
+        def run():
+            results = yield [[async_session.run(record, ind) for ind in range(5)]
+                             for async_session in sessions]
+            yield [async_session.close() for async_session in sessions]
+            raise tornado.gen.Return(results)
+
+        results = tornado.ioloop.IOLoop.current().run_sync(run)
+        self.assertEqual(results, [list(range(5))] * len(sessions))
+        self.assertLessEqual(len(threads), mc_async.default_max_workers)
+        self.assertNotIn(threading.current_thread().name, threads)
+
+    def test_errors(self):
+        async_session = AsyncMCSession(session=self.session)
+        self.assertRaises(AttributeError, getattr, async_session, 'query')
+        self.assertRaises(AttributeError, getattr, async_session, 'iter_weather_data')
+        self.assertRaises(ValueError, AsyncMCSession)
+        self.assertRaises(ValueError, AsyncMCSession, db=mc.connect_to_mc_testing_db(),
+                          session=self.session)
+
+        # exceptions from the session are raised in the caller
+        self.assertRaises(ValueError, tornado.ioloop.IOLoop.current().run_sync,
+                          lambda: async_session.add_weather_data(self.t1, 'foo', 1.))
+        tornado.ioloop.IOLoop.current().run_sync(async_session.close)
+
+    def test_from_db(self):
+        db = mc.connect_to_mc_testing_db()
+        async_session = AsyncMCSession(db)
+        db_time = tornado.ioloop.IOLoop.current().run_sync(
+            lambda: async_session.get_current_db_time(strict=True))
+        self.assertTrue(abs((db_time - Time.now()).sec) < 60)
+        tornado.ioloop.IOLoop.current().run_sync(async_session.close)
+
+
+if __name__ == '__main__':
+    unittest.main()
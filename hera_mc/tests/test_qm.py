@@ -141,6 +141,38 @@ class TestQM(TestHERAMC):
         self.assertRaises(ValueError, ArrayMetrics.create, self.obsid,
                           'test', self.obsid, 4.5)
 
+    def test_metrics_bulk(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        t2 = t1 + TimeDelta(120.0, format='sec')
+        self.obsid = utils.calculate_obsid(t1)
+        self.test_session.add_obs(t1, t2, self.obsid)
+        self.test_session.add_metric_desc('test', 'Test metric')
+        self.test_session.commit()
+
+        ants = np.arange(10)
+        self.test_session.add_ant_metric_bulk(self.obsid, ants, 'x', 'test',
+                                              ants * 0.5)
+        r = self.test_session.get_ant_metric(metric='test')
+        self.assertEqual(len(r), 10)
+        self.assertEqual(sorted([obj.val for obj in r]), (ants * 0.5).tolist())
+        self.assertRaises(ValueError, self.test_session.add_ant_metric_bulk,
+                          self.obsid, ants, 'z', 'test', ants * 0.5)
+        self.assertRaises(ValueError, self.test_session.add_ant_metric_bulk,
+                          float(self.obsid), ants, 'x', 'test', ants * 0.5)
+        self.assertRaises(ValueError, self.test_session.add_ant_metric_bulk,
+                          self.obsid, ants * 1.0, 'x', 'test', ants * 0.5)
+        self.assertRaises(ValueError, self.test_session.add_ant_metric_bulk,
+                          self.obsid, ants, 'x', 4, ants * 0.5)
+
+        self.test_session.add_array_metric_bulk([self.obsid], 'test', [6.2])
+        self.assertRaises(ValueError, self.test_session.add_array_metric_bulk,
+                          [float(self.obsid)], 'test', [6.2])
+        self.assertRaises(ValueError, self.test_session.add_array_metric_bulk,
+                          [self.obsid], 4, [6.2])
+        r = self.test_session.get_array_metric(metric='test')
+        self.assertEqual(len(r), 1)
+        self.assertEqual(r[0].val, 6.2)
+
     def test_MetricList(self):
         # Initialize
         t1 = Time('2016-01-10 01:15:23', scale='utc')
@@ -0,0 +1,147 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.query_cache`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+from sqlalchemy.orm import sessionmaker
+
+from .. import mc
+from ..query_cache import QueryCache
+from . import TestHERAMC
+
+
+class TestQueryCache(TestHERAMC):
+
+    def setUp(self):
+        super(TestQueryCache, self).setUp()
+        self.cache = QueryCache(max_entries=10, ttl=600.)
+        self.sessionmaker = sessionmaker(class_=mc.MCSession, bind=self.test_conn,
+                                         query_cache=self.cache)
+        self.t1 = Time('2016-01-10 01:15:23', scale='utc')
+        self.times = self.t1 + TimeDelta(np.arange(5) * 60., format='sec')
+        with self.sessionmaker() as session:
+            session.add_weather_data_bulk(self.times, 'wind_speed', np.arange(5.))
+
+    def test_hits(self):
+        with self.sessionmaker() as session:
+            result = session.get_weather_data(self.t1, stoptime=self.times[-1])
+            self.assertEqual(len(result), 5)
+            expected_times = [obj.time for obj in result]
+            # same arguments given differently
+            cached = session.get_weather_data(self.t1, self.times[-1],
+                                              variable=None)
+            self.assertEqual([obj.value for obj in cached], list(np.arange(5.)))
+            session.get_weather_data(self.t1, stoptime=self.times[2])
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['methods']['get_weather_data'], {'hits': 1, 'misses': 2})
+
+        # a cache hit in a new session returns objects attached to it
+        with self.sessionmaker() as session:
+            cached = session.get_weather_data(self.t1, stoptime=self.times[-1])
+            self.assertTrue(all(obj in session for obj in cached))
+            self.assertEqual([obj.time for obj in cached], expected_times)
+            self.assertEqual(session.query_cache_stats(reset=True)['hits'], 2)
+            self.assertEqual(session.query_cache_stats()['hits'], 0)
+
+        # arrays are copied so callers can change them
+        with self.sessionmaker() as session:
+            arrays = session.get_weather_data(self.t1, stoptime=self.times[-1],
+                                              as_arrays=True)
+            arrays['value'][:] = -1
+            arrays = session.get_weather_data(self.t1, stoptime=self.times[-1],
+                                              as_arrays=True)
+            self.assertTrue(np.allclose(arrays['value'], np.arange(5.)))
+
+        # sessions without a cache are unaffected
+        self.assertIsNone(self.test_session.query_cache_stats())
+        self.assertEqual(len(self.test_session.get_weather_data(self.t1,
+                                                                stoptime=self.times[-1])), 5)
+
+    def test_invalidation(self):
+        new_time = self.times[-1] + TimeDelta(60., format='sec')
+        stoptime = new_time + TimeDelta(60., format='sec')
+        with self.sessionmaker() as session:
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 5)
+            binned = session.get_weather_data(self.t1, stoptime=stoptime, bin_seconds=600)
+            self.assertEqual(binned['value'].tolist(), [2.])
+            session.get_roach_temperature(self.t1, stoptime=stoptime)
+            self.assertEqual(len(self.cache), 4)
+
+            # flushed ORM writes are seen by the writing session
+            session.add_weather_data(new_time, 'wind_speed', 5.)
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 6)
+            binned = session.get_weather_data(self.t1, stoptime=stoptime, bin_seconds=600)
+            self.assertEqual(binned['value'].tolist(), [2., 5.])
+            # results read after uncommitted writes are not shared
+            self.assertEqual(len(self.cache), 1)
+
+        # the roach temperatures were not invalidated
+        self.assertEqual(self.cache.stats()['invalidations'], 3)
+        with self.sessionmaker() as session:
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 6)
+            session.get_roach_temperature(self.t1, stoptime=stoptime)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+        # bulk inserts from another session invalidate the entries
+        with self.sessionmaker() as session:
+            session.add_weather_data_bulk(stoptime.reshape(1), 'wind_speed', [6.])
+        with self.sessionmaker() as session:
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 7)
+
+        # rolled back writes are not seen. Roll back to a savepoint so the
+        # test transaction (and the rows written above) is kept.
+        with self.sessionmaker() as session:
+            session.begin_nested()
+            session.add_weather_data_bulk(stoptime.reshape(1), 'temperature', [20.])
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 8)
+            session.rollback()
+            self.assertEqual(len(session.get_weather_data(self.t1, stoptime=stoptime)), 7)
+
+    def test_ttl_lru(self):
+        cache = QueryCache(max_entries=2, ttl=600.)
+        cache.put(('a', 1), frozenset(['weather_data']), ('other', 1), cache.generation)
+        cache.put(('a', 2), frozenset(['weather_data']), ('other', 2), cache.generation)
+        self.assertIsNotNone(cache.get(('a', 1)))
+        cache.put(('a', 3), frozenset(['roach_temperature']), ('other', 3), cache.generation)
+        # the least recently used entry was evicted
+        self.assertIsNone(cache.get(('a', 2)))
+        self.assertIsNotNone(cache.get(('a', 1)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        # results read before an invalidation are not stored
+        generation = cache.generation
+        cache.invalidate(['weather_data'])
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(cache.put(('a', 4), frozenset(['weather_data']), ('other', 4),
+                                   generation))
+        self.assertTrue(cache.put(('a', 4), frozenset(['roach_temperature']),
+                                  ('other', 4), generation))
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+        cache.ttl = 0.
+        cache.put(('a', 5), frozenset(), ('other', 5), cache.generation)
+        self.assertIsNone(cache.get(('a', 5)))
+        stats = cache.stats()
+        self.assertEqual(stats['expirations'], 1)
+        self.assertEqual(stats['invalidations'], 3)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertAlmostEqual(stats['hit_rate'], 0.5)
+
+        self.assertRaises(ValueError, QueryCache, max_entries=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.query_stats`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+from sqlalchemy import create_engine
+
+from .. import mc
+from ..query_stats import (QueryStats, instrument_engine, get_engine_query_stats,
+                           read_query_stats_files)
+from . import TestHERAMC
+
+
+class TestQueryStats(TestHERAMC):
+
+    def setUp(self):
+        super(TestQueryStats, self).setUp()
+        self.t1 = Time('2016-01-10 01:15:23', scale='utc')
+
+    def test_instrument(self):
+        # sessions on engines that are not instrumented have no statistics
+        self.assertEqual(mc.MCSession(bind=create_engine('sqlite://')).query_stats(), [])
+
+        stats = instrument_engine(self.test_db.engine)
+        self.assertIs(instrument_engine(self.test_db.engine), stats)
+        self.assertIs(get_engine_query_stats(self.test_conn), stats)
+        session = self.test_session
+        session.query_stats(reset=True)
+        self.assertEqual(session.query_stats(), [])
+
+        times = self.t1 + TimeDelta(np.arange(5) * 60., format='sec')
+        session.add_weather_data_bulk(times, 'wind_speed', np.arange(5.))
+        for _ in range(3):
+            session.get_weather_data(self.t1, stoptime=times[-1])
+        # internal helpers are attributed to the method that was called
+        session.get_weather_data(self.t1, stoptime=times[-1], bin_seconds=120)
+        session.get_current_db_time(strict=True)
+
+        summary = dict((site['call_site'], site) for site in session.query_stats())
+        self.assertEqual(summary['MCSession.add_weather_data_bulk']['count'], 1)
+        self.assertEqual(summary['MCSession.add_weather_data_bulk']['rows'], 5)
+        self.assertEqual(summary['MCSession.get_weather_data']['count'], 4)
+        self.assertIn('MCSession.get_current_db_time', summary)
+        self.assertNotIn('MCSession.get_aggregated', summary)
+        site = summary['MCSession.get_weather_data']
+        self.assertTrue(site['max_time'] >= site['mean_time'] > 0)
+        self.assertIn('weather_data', site['statement'])
+
+        top = session.query_stats(n=1, sort_by='count', reset=True)
+        self.assertEqual(top[0]['call_site'], 'MCSession.get_weather_data')
+        self.assertEqual(session.query_stats(), [])
+
+        # statements from outside MCSession methods name the calling function
+        self.test_conn.execute('select 1')
+        self.assertEqual(session.query_stats()[0]['call_site'],
+                         __name__ + '.test_instrument')
+
+        self.assertRaises(ValueError, session.query_stats, sort_by='foo')
+
+        # failed statements do not leave their start time behind
+        self.assertRaises(Exception, self.test_conn.execute, 'select * from no_such_table')
+        self.assertEqual(self.test_conn.info.get('query_start_time'), [])
+
+    def test_dump(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'stats.jsonl')
+        stats1 = QueryStats()
+        stats1.record('MCSession.get_weather_data', 'SELECT 1', 0.5, -1)
+        stats1.dump(path)
+        stats1.record('MCSession.get_weather_data', 'SELECT 2', 1.5, -1)
+        stats1.dump(path)
+        stats2 = QueryStats()
+        stats2.record('MCSession.get_weather_data', 'SELECT 3', 1., 2)
+        stats2.record('MCSession.add_weather_data', 'INSERT', 0.1, 1)
+        stats2.dump(path)
+        stats2.dump()
+
+        sites = dict((site['call_site'], site) for site in read_query_stats_files([path]))
+        # only the latest dump of the first process is used
+        self.assertEqual(sites['MCSession.get_weather_data']['count'], 3)
+        self.assertEqual(sites['MCSession.get_weather_data']['total_time'], 3.)
+        self.assertEqual(sites['MCSession.get_weather_data']['max_time'], 1.5)
+        self.assertEqual(sites['MCSession.get_weather_data']['statement'], 'SELECT 2')
+        self.assertEqual(sites['MCSession.get_weather_data']['rows'], 2)
+        self.assertEqual(sites['MCSession.add_weather_data']['mean_time'], 0.1)
+
+        stats2.start_periodic_dump(0.01, path=path)
+        stats2.stop_periodic_dump()
+
+    def test_db(self):
+        # instrumentation is opt-in
+        db = mc.DeclarativeDB('sqlite://')
+        self.assertIsNone(db.query_stats)
+        self.assertIsNone(get_engine_query_stats(db.engine))
+        db = mc.DeclarativeDB('sqlite://', instrument_queries=True)
+        self.assertIs(db.query_stats, get_engine_query_stats(db.engine))
+
+
+if __name__ == '__main__':
+    unittest.main()
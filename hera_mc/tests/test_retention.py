@@ -0,0 +1,198 @@
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Testing for `hera_mc.retention`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.time import Time, TimeDelta
+
+from .. import retention
+from ..autocorrelations import Autocorrelations
+from ..retention import TelemetryRollup
+from . import TestHERAMC
+
+
+class TestRetention(TestHERAMC):
+
+    def setUp(self):
+        super(TestRetention, self).setUp()
+
+        # six hours of one minute weather data for two variables
+        self.t0 = Time('2016-01-10 00:00:00', scale='utc')
+        self.times = self.t0 + TimeDelta(np.arange(360) * 60., format='sec')
+        self.stop = self.times[-1]
+        np.random.seed(0)
+        self.test_session.add_weather_data_bulk(self.times, 'wind_speed',
+                                                np.random.uniform(0, 20, 360))
+        self.test_session.add_weather_data_bulk(self.times, 'temperature',
+                                                np.random.uniform(10, 30, 360))
+
+        # roll up everything older than 4 hours after the start
+        self.now = self.t0 + TimeDelta(4 * 3600. + 86400., format='sec')
+
+    def check_same(self, result, expected):
+        self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+        for key, values in expected.items():
+            if values.dtype.kind == 'f':
+                self.assertTrue(np.allclose(result[key], values, equal_nan=True))
+            else:
+                self.assertTrue(np.all(result[key] == values))
+
+    def test_weather_rollups(self):
+        queries = [(3600, 'mean', None), (3600, 'min', None), (600, 'max', 'temperature'),
+                   (300, 'sum', 'wind_speed'), (7200, 'count', None)]
+        expected = [self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                       variable=variable,
+                                                       bin_seconds=bin_seconds, agg=agg)
+                    for bin_seconds, agg, variable in queries]
+
+        results = retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                            tables=['weather_data'], now=self.now)
+        cutoff = np.floor((self.now - TimeDelta(86400., format='sec')).gps / 3600) * 3600
+        n_old = np.sum(self.times.gps < cutoff)
+        self.assertEqual(results['weather_data']['deleted'], 2 * n_old)
+        self.assertEqual(results['weather_data']['expired'], 0)
+        raw = self.test_session.get_weather_data(self.t0, stoptime=self.stop, as_arrays=True)
+        self.assertEqual(len(raw['time']), 2 * (360 - n_old))
+        self.assertTrue(np.all(raw['time'] >= cutoff))
+
+        # the aggregates are the same when computed from the rollups and the remaining raw rows
+        for (bin_seconds, agg, variable), exp in zip(queries, expected):
+            result = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                        variable=variable,
+                                                        bin_seconds=bin_seconds, agg=agg)
+            self.check_same(result, exp)
+
+        # the coarsest tier that divides the bins is used
+        rollups = self.test_session.query(TelemetryRollup).filter(
+            TelemetryRollup.source_table == 'weather_data').all()
+        self.assertEqual(sorted(set(obj.bin_seconds for obj in rollups)), [300, 3600])
+        self.assertEqual(sum(obj.num_values for obj in rollups if obj.bin_seconds == 3600),
+                         2 * n_old)
+
+        # 'last' needs the raw rows, so it fails for times that were removed
+        self.assertRaises(ValueError, self.test_session.get_weather_data, self.t0,
+                          stoptime=self.stop, bin_seconds=3600, agg='last')
+        last = self.test_session.get_weather_data(Time(cutoff, format='gps'),
+                                                  stoptime=self.stop, bin_seconds=3600,
+                                                  agg='last')
+        self.assertEqual(last['time'].tolist(), [cutoff] * 2 + [cutoff + 3600] * 2)
+        self.assertEqual(self.test_session.get_weather_data(
+            self.t0, stoptime=self.stop, bin_seconds=7200, agg='count')['value'].dtype,
+            np.int64)
+
+        # bins that are not multiples of a tier use the raw rows
+        result = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                    bin_seconds=120)
+        self.assertTrue(np.all(result['time'] >= cutoff))
+
+        # rerunning does nothing, late data is merged into the existing rollups
+        results = retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                            tables=['weather_data'], now=self.now)
+        self.assertEqual(results['weather_data']['deleted'], 0)
+        self.test_session.add_weather_data(self.t0, 'wind_speed', 1000.)
+        retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                  tables=['weather_data'], now=self.now)
+        result = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                    variable='wind_speed', bin_seconds=3600,
+                                                    agg='max')
+        self.assertEqual(result['value'][0], 1000.)
+
+        # expire the 5 minute rollups
+        results = retention.apply_retention(
+            self.test_session, raw_retention_days=1., tier_retention_days={300: 1.},
+            tables=['weather_data'], now=self.now)
+        self.assertTrue(results['weather_data']['expired'] > 0)
+        result = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                    bin_seconds=300)
+        self.assertTrue(np.all(result['time'] >= cutoff))
+
+    def test_keep_raw_and_archive(self):
+        expected = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                      bin_seconds=3600)
+        archive_dir = tempfile.mkdtemp()
+        try:
+            results = retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                                tables=['weather_data'], now=self.now,
+                                                keep_raw=True, archive_dir=archive_dir)
+            self.assertEqual(results['weather_data']['deleted'], 0)
+            self.assertEqual(os.listdir(archive_dir), [])
+            raw = self.test_session.get_weather_data(self.t0, stoptime=self.stop,
+                                                     as_arrays=True)
+            self.assertEqual(len(raw['time']), 720)
+            self.check_same(self.test_session.get_weather_data(
+                self.t0, stoptime=self.stop, bin_seconds=3600), expected)
+
+            # with keep_raw, later runs only roll up newer rows
+            now = self.now + TimeDelta(3600., format='sec')
+            retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                      tables=['weather_data'], now=now, keep_raw=True)
+            self.check_same(self.test_session.get_weather_data(
+                self.t0, stoptime=self.stop, bin_seconds=3600), expected)
+
+            results = retention.apply_retention(self.test_session, raw_retention_days=1.,
+                                                tables=['weather_data'], now=now,
+                                                archive_dir=archive_dir)
+            archived = [np.load(os.path.join(archive_dir, name))
+                        for name in sorted(os.listdir(archive_dir))]
+            self.assertEqual(sum(len(arrays['time']) for arrays in archived),
+                             results['weather_data']['deleted'])
+            self.assertEqual(archived[0]['variable'][0], 'temperature')
+        finally:
+            shutil.rmtree(archive_dir)
+
+    def test_autocorrelation_rollups(self):
+        # DateTime time column and several group columns
+        times = self.t0 + TimeDelta(np.arange(0, 21600, 600), format='sec')
+        ind = 0
+        for time in times:
+            for antnum in [9, 10]:
+                for pol in ['x', 'y']:
+                    self.test_session.add(Autocorrelations(
+                        id=ind, time=time.datetime, antnum=antnum, polarization=pol,
+                        measurement_type=0, value=float(ind)))
+                    ind += 1
+        self.test_session.commit()
+
+        expected = [self.test_session.get_autocorrelations(self.t0, stoptime=self.stop,
+                                                           antnum=antnum, bin_seconds=3600,
+                                                           agg=agg)
+                    for antnum, agg in [(9, 'mean'), (None, 'max')]]
+        # everything is older than a day compared to the database time
+        results = self.test_session.apply_retention(raw_retention_days=1.,
+                                                    tables=['autocorrelations'])
+        self.assertEqual(results['autocorrelations']['deleted'], 144)
+
+        results = [self.test_session.get_autocorrelations(self.t0, stoptime=self.stop,
+                                                          antnum=antnum, bin_seconds=3600,
+                                                          agg=agg)
+                   for antnum, agg in [(9, 'mean'), (None, 'max')]]
+        for result, exp in zip(results, expected):
+            self.check_same(result, exp)
+        self.assertEqual(results[1]['measurement_type'].dtype.kind, 'i')
+
+        # different grouping than the rollups
+        result = self.test_session.get_aggregated(
+            Autocorrelations, 'time', 3600, 'count', self.t0, self.stop, group_by='antnum')
+        self.assertEqual(result['value'].tolist(), [12.] * 12)
+        self.assertTrue(np.all(result['antnum'] == [9, 10] * 6))
+        result = self.test_session.get_aggregated(
+            Autocorrelations, 'time', 3600, 'count', self.t0, self.stop, group_by='antnum',
+            use_rollups=False)
+        self.assertEqual(len(result['value']), 0)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, retention.rollup_table, self.test_session,
+                          'hera_obs', self.now)
+
+
+if __name__ == '__main__':
+    unittest.main()
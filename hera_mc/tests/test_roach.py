@@ -10,11 +10,18 @@ from __future__ import absolute_import, division, print_function
 import unittest
 import nose.tools as nt
 from math import floor
+import numpy as np
 from astropy.time import Time, TimeDelta
 
 from .. import mc, roach
 from ..tests import TestHERAMC, is_onsite
 
+try:
+    import fakeredis
+    have_fakeredis = True
+except ImportError:
+    have_fakeredis = False
+
 
 roach_example_dict = {
     'pf1': {'raw.current.1v5': '10162', 'raw.temp.outlet': '31750',
@@ -175,6 +182,55 @@ class TestRoach(TestHERAMC):
         result = self.test_session.get_roach_temperature(t1 + TimeDelta(200.0, format='sec'))
         self.assertEqual(result, [])
 
+    def test_add_roach_bulk(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = Time([t1.jd, t1.jd], format='jd')
+        roaches = ['pf1', 'pf2']
+        temps = {}
+        for name, key in roach.roach_key_dict.items():
+            temps[name] = [float(roach_example_dict[r][key]) / 1000. for r in roaches]
+        self.test_session.add_roach_temperature_bulk(
+            times, roaches, temps['ambient_temp'], temps['inlet_temp'],
+            temps['outlet_temp'], temps['fpga_temp'], temps['ppc_temp'])
+
+        expected = roach.RoachTemperature(time=int(floor(t1.gps)), roach='pf1',
+                                          ambient_temp=30., inlet_temp=32.,
+                                          outlet_temp=31.75, fpga_temp=57.,
+                                          ppc_temp=45.)
+        result = self.test_session.get_roach_temperature(t1 - TimeDelta(3.0, format='sec'),
+                                                         roach='pf1')
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].isclose(expected))
+
+        result = self.test_session.get_roach_temperature(t1 - TimeDelta(3.0, format='sec'),
+                                                         stoptime=t1)
+        self.assertEqual(len(result), 2)
+
+        result = self.test_session.get_roach_temperature(t1 - TimeDelta(3.0, format='sec'),
+                                                         stoptime=t1, bin_seconds=60)
+        self.assertEqual(result['roach'].tolist(), roaches)
+        self.assertTrue(np.all(result['time'] == (int(floor(t1.gps)) // 60) * 60))
+        self.assertTrue(np.allclose(result['fpga_temp'], temps['fpga_temp']))
+
+        # both roaches are tied at the last time in the bin, only one is kept
+        result = self.test_session.get_aggregated(
+            roach.RoachTemperature, 'time', 60, 'last', t1 - TimeDelta(3.0, format='sec'),
+            t1, value_columns='fpga_temp')
+        self.assertEqual(len(result['time']), 1)
+        self.assertEqual(result['fpga_temp'].tolist(), [temps['fpga_temp'][1]])
+
+    def test_get_latest_roach(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        t2 = t1 + TimeDelta(60., format='sec')
+        self.test_session.add_roach_temperature(t1, 'pf1', 30., 32., 31.75, 57., 45.)
+        self.test_session.add_roach_temperature(t2, 'pf1', 31., 33., 32.75, 58., 46.)
+        self.test_session.add_roach_temperature(t1, 'pf2', 29., 31., 30.75, 56., 44.)
+
+        result = self.test_session.get_latest_roach_temperature()
+        self.assertEqual([(obj.roach, obj.time) for obj in result],
+                         [('pf1', int(floor(t2.gps))), ('pf2', int(floor(t1.gps)))])
+        self.assertEqual(result[0].fpga_temp, 58.)
+
     def test_create_from_redis(self):
         roach_obj_list = roach.create_from_redis(roach_example_dict)
 
@@ -197,6 +253,50 @@ class TestRoach(TestHERAMC):
                                                          stoptime=t1 + TimeDelta(5.0, format='sec'))
         self.assertEqual(len(result), 8)
 
+    @unittest.skipIf(not have_fakeredis, 'fakeredis is not installed')
+    def test_collector(self):
+        # a connection without decode_responses, as a user might pass in
+        redis_session = fakeredis.FakeStrictRedis()
+        redis_session.flushall()
+        for roach_name in roach.roach_hostnames[:-1]:
+            redis_session.hmset('roachsensor:' + roach_name, roach_example_dict[roach_name])
+
+        collector = roach.RoachTemperatureCollector(redis_session=redis_session)
+        arrays = collector.read()
+        # pf8 has no data
+        self.assertEqual(arrays['roach'].tolist(), roach.roach_hostnames[:-1])
+        self.assertEqual(arrays['timestamp'][0], 1512770942.726777)
+        self.assertEqual(arrays['fpga_temp'][0], 57.)
+        self.assertEqual(arrays['outlet_temp'][0], 31.75)
+
+        self.assertEqual(len(collector.sample()['roach']), 7)
+        # unconfirmed samples (e.g. the write failed) are returned again
+        self.assertEqual(len(collector.sample()['roach']), 7)
+        collector.confirm()
+        self.assertEqual(len(collector.sample()['roach']), 0)
+        collector.confirm()
+        redis_session.hset('roachsensor:pf3', 'timestamp', '1512770952.5')
+        redis_session.hset('roachsensor:pf3', 'raw.temp.fpga', '58000')
+        changed = collector.sample()
+        self.assertEqual(changed['roach'].tolist(), ['pf3'])
+        self.assertEqual(changed['fpga_temp'].tolist(), [58.])
+        collector.confirm()
+
+        self.test_session.add_roach_temperature_from_redis(redis_session=redis_session)
+        self.test_session.add_roach_temperature_from_redis(redis_session=redis_session)
+        redis_session.hset('roachsensor:pf3', 'timestamp', '1512770962.5')
+        self.assertEqual(collector.add_to_session(self.test_session), 1)
+        # not confirmed, as if the commit failed, so the record is added again
+        self.assertEqual(collector.add_to_session(self.test_session), 1)
+        collector.confirm()
+        self.assertEqual(collector.add_to_session(self.test_session), 0)
+
+        t1 = Time(1512770942.726777, format='unix')
+        result = self.test_session.get_roach_temperature(
+            t1 - TimeDelta(3.0, format='sec'), stoptime=t1 + TimeDelta(30.0, format='sec'))
+        self.assertEqual(len(result), 8)
+        self.assertEqual([obj.fpga_temp for obj in result if obj.roach == 'pf3'], [58., 58.])
+
     def test_add_from_redis(self):
 
         if is_onsite():
@@ -106,6 +106,49 @@ class TestServerStatus(TestHERAMC):
             expected.mc_time = result2.mc_time
             self.assertFalse(result2.isclose(expected))
 
+    def test_get_latest_server_status(self):
+        for sub in ['rtp', 'lib']:
+            self.test_session.add_server_status(sub, 'host_a', *self.column_values[2:11])
+            self.test_session.add_server_status(sub, 'host_b', *self.column_values[2:11])
+            result = self.test_session.get_latest_server_status(sub)
+            self.assertEqual([obj.hostname for obj in result], ['host_a', 'host_b'])
+
+            db_time = self.test_session.get_current_db_time()
+            self.test_session.add(result[0].__class__.create(
+                db_time + TimeDelta(120, format='sec'), 'host_a',
+                *self.column_values[2:11]))
+            result = self.test_session.get_latest_server_status(
+                sub, starttime=db_time + TimeDelta(60, format='sec'))
+            self.assertEqual(len(result), 1)
+            self.assertEqual(result[0].hostname, 'host_a')
+            self.assertEqual(result[0].mc_time, int(floor(db_time.gps)) + 120)
+
+        self.assertRaises(ValueError, self.test_session.get_latest_server_status, 'foo')
+
+    def test_db_time_cache(self):
+        db_time = self.test_session.get_current_db_time(strict=True)
+        self.assertTrue(abs(self.test_session._db_clock_offset) < 5)
+
+        cached_time = self.test_session.get_current_db_time()
+        self.assertTrue(abs((cached_time - db_time).sec) < 5)
+
+        # the cached offset is used until the refresh interval passes
+        self.test_session._db_clock_offset += 100.
+        cached_time = self.test_session.get_current_db_time()
+        self.assertTrue(abs((cached_time - db_time).sec - 100) < 5)
+        strict_time = self.test_session.get_current_db_time(strict=True)
+        self.assertTrue(abs((strict_time - db_time).sec) < 5)
+
+        self.test_session._db_clock_offset += 100.
+        self.test_session.db_clock_refresh_interval = 0
+        cached_time = self.test_session.get_current_db_time()
+        self.assertTrue(abs((cached_time - db_time).sec) < 5)
+
+        strict_session = mc.MCSession(bind=self.test_conn, strict_db_time=True)
+        strict_time = strict_session.get_current_db_time()
+        strict_session._db_clock_offset += 100.
+        self.assertTrue(abs((strict_session.get_current_db_time() - strict_time).sec) < 5)
+
     def test_errors_server_status(self):
         for sub in ['rtp', 'lib']:
             self.assertRaises(ValueError, self.test_session.add_server_status, sub,
@@ -61,6 +61,24 @@ class TestTemperatures(TestHERAMC):
         for i in range(0, len(result)):
             self.assertTrue(result[i].isclose(expected2[i]))
 
+    def test_add_paper_temps_bulk(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta([0., 120.], format='sec')
+
+        temp_array = np.stack([np.arange(28) + 300., np.arange(28) + 310.])
+        self.test_session.add_paper_temps_bulk(times, temp_array)
+
+        result = self.test_session.get_paper_temps(t1 - TimeDelta(3.0, format='sec'),
+                                                   stoptime=times[1])
+        self.assertEqual(len(result), 2)
+        for ind, obj in enumerate(sorted(result, key=lambda obj: obj.time)):
+            expected = temperatures.PaperTemperatures.new_from_text_row(
+                times[ind], temp_array[ind].tolist())
+            self.assertTrue(obj.isclose(expected))
+
+        self.assertRaises(ValueError, self.test_session.add_paper_temps_bulk,
+                          times, temp_array[0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -8,10 +8,13 @@
 from __future__ import absolute_import, division, print_function
 
 import unittest
+import collections
 import nose.tools as nt
+import tornado.gen
 from math import floor
 import numpy as np
 from astropy.time import Time, TimeDelta
+from sqlalchemy.exc import IntegrityError
 
 from .. import mc, weather
 from . import TestHERAMC, is_onsite
@@ -69,6 +72,80 @@ def test_reduce_time_vals():
     nt.assert_raises(ValueError, weather._reduce_time_vals, times, values, 10, strategy='foo')
 
 
+def _loop_reduce_time_vals(times, vals, period, strategy):
+    # straightforward per-bucket reference for the vectorized reductions
+    times_keep, inds = np.unique((times // period) * period, return_index=True)
+    if times_keep[0] < np.min(times):
+        times_keep = times_keep[1:]
+        inds = inds[1:]
+    if len(inds) < 2:
+        return None, None
+    if strategy == 'decimate':
+        return times_keep, vals[inds]
+    funcs = {'max': np.max, 'min': np.min, 'sum': np.sum, 'mean': np.mean,
+             'median': np.median, 'std': np.std, 'last': lambda x, axis: x[-1]}
+    vals_keep = [funcs[strategy](vals[inds[count]:inds[count + 1]], axis=0)
+                 for count in range(len(inds) - 1)]
+    return times_keep[:-1], np.array(vals_keep)
+
+
+def test_reduce_time_vals_strategies():
+    np.random.seed(0)
+    for trial in range(20):
+        # irregular sampling with gaps, several variables
+        ntimes = np.random.randint(1, 300)
+        times = 1e9 + np.cumsum(np.random.exponential(np.random.uniform(0.5, 20), ntimes))
+        values = np.random.normal(size=(ntimes, 3))
+        values[:, 2] = np.round(values[:, 2])  # ties for the median
+        period = int(np.random.choice([1, 10, 60, 300]))
+
+        for strategy in weather.reduction_strategies:
+            exp_times, exp_vals = _loop_reduce_time_vals(times, values, period, strategy)
+            dec_times, dec_vals = weather._reduce_time_vals(times, values, period,
+                                                            strategy=strategy)
+            if exp_times is None:
+                nt.assert_true(dec_times is None and dec_vals is None)
+                continue
+            nt.assert_true(np.array_equal(dec_times, exp_times))
+            nt.assert_equal(dec_vals.shape, exp_vals.shape)
+            nt.assert_true(np.allclose(dec_vals, exp_vals))
+
+            # reducing the variables one at a time gives the same result
+            for col in range(values.shape[1]):
+                col_times, col_vals = weather._reduce_time_vals(
+                    times, values[:, col], np.int64(period), strategy=strategy)
+                nt.assert_true(np.allclose(col_vals, dec_vals[:, col]))
+
+
+SensorSample = collections.namedtuple('SensorSample',
+                                      ['timestamp', 'value_timestamp', 'value', 'status'])
+
+
+class FakePortalClient(object):
+    """Stands in for KATPortalClient, serving 10 s samples of a smooth signal."""
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @tornado.gen.coroutine
+    def sensors_histories(self, sensor_names, start_time_sec, end_time_sec, timeout_sec=0):
+        self.requests.append((list(sensor_names), start_time_sec, end_time_sec))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        yield tornado.gen.sleep(0.001)
+        self.in_flight -= 1
+
+        times = np.arange(np.ceil(start_time_sec / 10.) * 10., end_time_sec, 10.) + 0.5
+        histories = {}
+        for sensor_name in sensor_names:
+            values = 10. + np.sin(times / 1000. + len(sensor_name))
+            histories[sensor_name] = [SensorSample(time, time, value, 'nominal')
+                                      for time, value in zip(times, values)]
+        raise tornado.gen.Return(histories)
+
+
 class TestWeather(TestHERAMC):
 
     def test_add_weather(self):
@@ -123,6 +200,203 @@ class TestWeather(TestHERAMC):
         for i in range(0, len(result)):
             self.assertTrue(result[i].isclose(expected3[i]))
 
+    def test_add_weather_bulk(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(10) * 60., format='sec')
+        wind_speeds = np.linspace(1., 2., 10)
+
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', wind_speeds)
+        self.test_session.add_weather_data_bulk(times[:2], ['temperature', 'humidity'],
+                                                [11.505, 30.])
+
+        result = self.test_session.get_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                    stoptime=times[-1],
+                                                    variable='wind_speed')
+        self.assertEqual(len(result), 10)
+        for ind, obj in enumerate(sorted(result, key=lambda obj: obj.time)):
+            expected = weather.WeatherData(time=int(floor(times[ind].gps)),
+                                           variable='wind_speed', value=wind_speeds[ind])
+            self.assertTrue(obj.isclose(expected))
+
+        result = self.test_session.get_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                    stoptime=times[1],
+                                                    variable='humidity')
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].time, int(floor(times[1].gps)))
+
+        self.assertRaises(ValueError, self.test_session.add_weather_data_bulk,
+                          times, 'foo', wind_speeds)
+        self.assertRaises(ValueError, self.test_session.add_weather_data_bulk,
+                          times.gps, 'wind_speed', wind_speeds)
+        self.assertRaises(ValueError, self.test_session.add_weather_data_bulk,
+                          times, 'wind_speed', wind_speeds[:5])
+
+    def test_add_weather_bulk_ignore_duplicates(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(10) * 60., format='sec')
+        values = np.linspace(1., 2., 10)
+        self.test_session.add_weather_data_bulk(times[:5], 'wind_speed', values[:5])
+        self.assertRaises(IntegrityError, self.test_session.add_weather_data_bulk,
+                          times[:5], 'wind_speed', values[:5])
+        self.test_session.rollback()
+
+        self.test_session.add_weather_data_bulk(times[:5], 'wind_speed', values[:5])
+        # re-adding overlapping data (including repeats within the batch) is safe
+        self.test_session.add_weather_data_bulk(times[[3, 4, 5, 6, 7, 8, 9, 9]],
+                                                'wind_speed',
+                                                np.concatenate([values[3:], [0.]]),
+                                                ignore_duplicates=True)
+        result = self.test_session.get_weather_data(t1, stoptime=times[-1])
+        self.assertEqual([obj.time for obj in result], np.floor(times.gps).astype(int).tolist())
+        self.assertTrue(np.allclose([obj.value for obj in result], values))
+
+    def test_get_weather_arrays(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(10) * 60., format='sec')
+        wind_speeds = np.linspace(1., 2., 10)
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', wind_speeds)
+        self.test_session.add_weather_data_bulk(times, 'temperature', wind_speeds + 10.)
+
+        result = self.test_session.get_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                    stoptime=times[-1],
+                                                    variable='wind_speed',
+                                                    as_arrays=True)
+        self.assertEqual(set(result.keys()), set(['time', 'variable', 'value']))
+        self.assertEqual(result['time'].dtype, np.int64)
+        self.assertTrue(np.all(result['time'] == np.floor(times.gps)))
+        self.assertTrue(np.allclose(result['value'], wind_speeds))
+        self.assertTrue(np.all(result['variable'] == 'wind_speed'))
+
+        result = self.test_session.get_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                    stoptime=times[-1],
+                                                    columns=['time', 'value'])
+        self.assertEqual(set(result.keys()), set(['time', 'value']))
+        self.assertEqual(len(result['value']), 20)
+        self.assertTrue(np.all(np.diff(result['time']) >= 0))
+
+        # without a stoptime only the first record is returned
+        result = self.test_session.get_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                    columns='value')
+        self.assertEqual(len(result['value']), 1)
+
+        result = self.test_session.get_weather_data(t1 + TimeDelta(1000.0, format='sec'),
+                                                    as_arrays=True)
+        self.assertEqual(len(result['value']), 0)
+        self.assertEqual(result['value'].dtype, np.float64)
+
+    def test_iter_weather(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(25) * 60., format='sec')
+        values = np.linspace(1., 2., 25)
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', values)
+        self.test_session.add_weather_data_bulk(times, 'temperature', values + 10.)
+
+        chunks = list(self.test_session.iter_weather_data(t1 - TimeDelta(3.0, format='sec'),
+                                                          stoptime=times[-1],
+                                                          variable='wind_speed',
+                                                          chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        result = [obj for chunk in chunks for obj in chunk]
+        self.assertEqual([obj.time for obj in result], np.floor(times.gps).astype(int).tolist())
+        self.assertTrue(np.allclose([obj.value for obj in result], values))
+
+        # without a stoptime everything after the starttime is streamed
+        chunks = list(self.test_session.iter_weather_data(times[5], chunk_size=100,
+                                                          columns=['time', 'value']))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(chunks[0]['value']), 40)
+
+        chunks = list(self.test_session.iter_weather_data(times[-1] + TimeDelta(3.0, format='sec')))
+        self.assertEqual(chunks, [])
+
+        self.assertRaises(ValueError, self.test_session.iter_weather_data, t1,
+                          variable='foo')
+        self.assertRaises(ValueError, list, self.test_session.iter_weather_data(t1, chunk_size=0))
+
+    def test_iter_table(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(25) * 60., format='sec')
+        values = np.linspace(1., 2., 25)
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', values)
+        self.test_session.add_weather_data_bulk(times, 'temperature', values + 10.)
+
+        chunks = list(self.test_session.iter_table('weather_data', t1, stoptime=times[-1],
+                                                   filters={'variable': 'temperature'},
+                                                   columns=['time', 'value'], chunk_size=10))
+        self.assertEqual([len(chunk['value']) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(chunks[0].keys()), ['time', 'value'])
+        self.assertTrue(np.allclose(np.concatenate([chunk['value'] for chunk in chunks]),
+                                    values + 10.))
+
+        chunks = list(self.test_session.iter_table('weather_data', times[20],
+                                                   filters={'variable': None}))
+        self.assertEqual(len(chunks[0]['variable']), 10)
+
+        self.assertRaises(ValueError, self.test_session.iter_table, 'foo', t1)
+        self.assertRaises(ValueError, self.test_session.iter_table, 'weather_data', t1,
+                          filters={'foo': 1})
+
+    def test_get_weather_aggregated(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(25) * 60., format='sec')
+        values = np.linspace(1., 2., 25)
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', values)
+        self.test_session.add_weather_data_bulk(times, 'temperature', values + 10.)
+
+        gps = np.floor(times.gps).astype(np.int64)
+        bins = (gps // 300) * 300
+        unique_bins = np.unique(bins)
+        expected_mean = np.array([np.mean(values[bins == b]) for b in unique_bins])
+        expected_last = np.array([values[bins == b][-1] for b in unique_bins])
+        expected_count = np.array([np.sum(bins == b) for b in unique_bins])
+
+        result = self.test_session.get_weather_data(t1, stoptime=times[-1],
+                                                    variable='wind_speed',
+                                                    bin_seconds=300)
+        self.assertEqual(set(result.keys()), set(['time', 'variable', 'value']))
+        self.assertTrue(np.all(result['time'] == unique_bins))
+        self.assertTrue(np.all(result['variable'] == 'wind_speed'))
+        self.assertTrue(np.allclose(result['value'], expected_mean))
+
+        result = self.test_session.get_weather_data(t1, stoptime=times[-1],
+                                                    bin_seconds=300, agg='last')
+        self.assertEqual(len(result['value']), 2 * len(unique_bins))
+        self.assertTrue(np.all(result['time'][::2] == unique_bins))
+        self.assertTrue(np.all(result['variable'][::2] == 'temperature'))
+        self.assertTrue(np.allclose(result['value'][::2], expected_last + 10.))
+        self.assertTrue(np.allclose(result['value'][1::2], expected_last))
+
+        result = self.test_session.get_weather_data(t1, stoptime=times[-1],
+                                                    variable='temperature',
+                                                    bin_seconds=300, agg='count')
+        self.assertTrue(np.all(result['value'] == expected_count))
+
+        self.assertRaises(ValueError, self.test_session.get_weather_data, t1,
+                          stoptime=times[-1], bin_seconds=300, agg='foo')
+        self.assertRaises(ValueError, self.test_session.get_weather_data, t1,
+                          stoptime=times[-1], bin_seconds=0.5)
+        self.assertRaises(ValueError, self.test_session.get_weather_data, t1,
+                          bin_seconds=300)
+
+    def test_get_latest_weather(self):
+        t1 = Time('2016-01-10 01:15:23', scale='utc')
+        times = t1 + TimeDelta(np.arange(10) * 60., format='sec')
+        values = np.linspace(1., 2., 10)
+        self.test_session.add_weather_data_bulk(times, 'wind_speed', values)
+        self.test_session.add_weather_data_bulk(times[:5], 'temperature', values[:5] + 10.)
+
+        result = self.test_session.get_latest_weather()
+        self.assertEqual([obj.variable for obj in result], ['temperature', 'wind_speed'])
+        self.assertEqual(result[0].time, int(floor(times[4].gps)))
+        self.assertEqual(result[0].value, values[4] + 10.)
+        self.assertEqual(result[1].time, int(floor(times[-1].gps)))
+        self.assertEqual(result[1].value, values[-1])
+
+        result = self.test_session.get_latest_weather(starttime=times[6])
+        self.assertEqual([obj.variable for obj in result], ['wind_speed'])
+
+        self.assertRaises(ValueError, self.test_session.get_latest_weather, starttime='foo')
+
     def test_add_from_sensor(self):
         t1 = Time('2017-11-10 01:15:23', scale='utc')
         t2 = t1 + TimeDelta(280.0, format='sec')
@@ -158,6 +432,56 @@ class TestWeather(TestHERAMC):
 
             self.assertRaises(ValueError, weather.create_from_sensors, t1, t2, variables='foo')
 
+    def test_backfill_from_sensor(self):
+        t1 = Time('2017-11-10 01:15:23', scale='utc')
+        t2 = t1 + TimeDelta(3 * 3600., format='sec')
+        variables = ['wind_speed', 'wind_gust', 'temperature']
+
+        # all at once, for comparison
+        expected = weather.create_from_sensors(t1, t2, variables=variables,
+                                               portal_client=FakePortalClient())
+        expected = dict(((obj.time, obj.variable), obj.value) for obj in expected)
+
+        client = FakePortalClient()
+        n_rows = self.test_session.backfill_weather_data_from_sensors(
+            t1, stoptime=t1 + TimeDelta(5000., format='sec'), variables=variables,
+            window_seconds=1800, max_concurrent=2, portal_client=client)
+        self.assertEqual(sorted(n_rows.keys()), sorted(variables))
+        self.assertTrue(1 < client.max_in_flight <= 2)
+        # the windows are aligned to multiples of 1800 s, so there are four per variable
+        self.assertEqual(len(client.requests), 12)
+        self.assertTrue(all(len(names) == 1 for names, start, stop in client.requests))
+
+        # resume from the high water marks
+        client = FakePortalClient()
+        self.test_session.backfill_weather_data_from_sensors(
+            t1, stoptime=t2, variables=variables, window_seconds=1800, portal_client=client)
+        latest = dict((obj.variable, obj.astropy_time.unix)
+                      for obj in self.test_session.get_latest_weather())
+        for names, start, stop in client.requests:
+            variable = [var for var in variables
+                        if weather.weather_sensor_dict[var]['sensor_name'] == names[0]][0]
+            self.assertTrue(start >= t1.unix + 5000. - 1800.)
+            self.assertTrue(stop <= latest[variable] + 1800.)
+
+        result = self.test_session.get_weather_data(t1, stoptime=t2)
+        result = dict(((obj.time, obj.variable), obj.value) for obj in result)
+        # the windows do not lose the buckets at their edges. The padding also
+        # keeps the complete buckets at the ends of the range that a single
+        # request drops.
+        self.assertTrue(set(expected.keys()) <= set(result.keys()))
+        for time, variable in set(result.keys()) - set(expected.keys()):
+            self.assertTrue(time < t1.gps + 60 or time > t2.gps - 300)
+        for key, value in expected.items():
+            self.assertAlmostEqual(result[key], value)
+
+        # nothing left to do
+        self.assertEqual(self.test_session.backfill_weather_data_from_sensors(
+            t2, stoptime=t2, variables=variables, portal_client=FakePortalClient()),
+            dict((var, 0) for var in variables))
+        self.assertRaises(ValueError, self.test_session.backfill_weather_data_from_sensors,
+                          t1, variables='foo', portal_client=FakePortalClient())
+
     def test_dump_weather_table(self):
         # Just make sure it doesn't crash.
         t1 = Time('2016-01-10 01:15:23', scale='utc')
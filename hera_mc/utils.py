@@ -9,6 +9,7 @@ from __future__ import absolute_import, division, print_function
 
 import collections
 from math import floor
+import numpy as np
 import six
 from astropy.time import Time
 
@@ -56,3 +57,49 @@ def get_iterable(x):
         except TypeError:
             return (x,)
     return x
+
+
+def get_gps_floor_list(times):
+    """
+    Helper function to get a list of floored gps seconds from an astropy
+    Time object, which may be scalar or array valued.
+
+    Parameters:
+    ------------
+    times: astropy time object
+
+    Returns:
+    --------
+    list of integer gps seconds
+    """
+    if not isinstance(times, Time):
+        raise ValueError('times must be an astropy Time object')
+
+    return np.floor(np.atleast_1d(times.gps)).astype(np.int64).tolist()
+
+
+def get_column_lists(nrows, *columns):
+    """
+    Helper function to turn scalars, sequences or numpy arrays of column
+    values into lists of plain python values, each of length nrows. Scalars
+    are repeated for every row.
+
+    Parameters:
+    ------------
+    nrows: integer
+        number of rows
+    columns: scalars, sequences or numpy arrays
+        column values
+
+    Returns:
+    --------
+    list of lists, one per column
+    """
+    column_lists = []
+    for col in columns:
+        col = np.asarray(col)
+        if col.ndim > 0 and col.shape != (nrows,):
+            raise ValueError('all columns must have the same length as times '
+                             '({n}), got shape {s}'.format(n=nrows, s=col.shape))
+        column_lists.append(np.broadcast_to(col, (nrows,)).tolist())
+    return column_lists
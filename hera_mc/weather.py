@@ -51,40 +51,102 @@ weather_sensor_dict = {'wind_speed': {'sensor_name': 'anc_mean_wind_speed',
                                 'description': "Rainfall (report period: 10s)"}}
 
 
+# reduction strategies supported by _reduce_time_vals
+reduction_strategies = ('decimate', 'max', 'min', 'sum', 'mean', 'median', 'std', 'last')
+# the strategies that are plain numpy ufunc reductions over each bucket
+_ufunc_reductions = {'max': np.maximum, 'min': np.minimum, 'sum': np.add}
+
+
+def _segment_median(vals, starts, counts):
+    # vals is split into contiguous segments of the given starts and counts.
+    # Sort within each segment by sorting on (segment, value), then take the
+    # middle element(s) of each segment
+    seg_ids = np.repeat(np.arange(len(starts)), counts)
+    medians = np.empty((len(starts),) + vals.shape[1:])
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    for col in np.ndindex(*vals.shape[1:]):
+        col_vals = vals[(slice(None),) + col]
+        sorted_vals = col_vals[np.lexsort((col_vals, seg_ids))]
+        medians[(slice(None),) + col] = (sorted_vals[lower] + sorted_vals[upper]) / 2.
+    return medians
+
+
 def _reduce_time_vals(times, vals, period, strategy='decimate'):
-    if not isinstance(period, (int, np.int)):
-        raise ValueError('period must be an integer')
+    """
+    Reduce time ordered data to one value per period.
+
+    Times are floored to multiples of period to give the bucket of each
+    sample. The first bucket is dropped if it starts before the first time
+    (so it is incomplete). 'decimate' keeps the first value in each bucket,
+    the other strategies reduce all the values in a bucket and drop the last
+    bucket (which may be incomplete). The reductions are vectorized over
+    the buckets.
+
+    Parameters:
+    ------------
+    times: numpy array
+        sorted unix times of the samples.
+    vals: numpy array
+        values of the samples, with time along the first axis. Several
+        variables sampled at the same times can be reduced in one pass by
+        passing a 2-D array of shape (Ntimes, Nvariables).
+    period: integer
+        length of the buckets in seconds.
+    strategy: string
+        one of reduction_strategies: 'decimate', 'max', 'min', 'sum', 'mean',
+        'median', 'std' or 'last'.
 
-    # the // operator is a floored divide.
-    times_keep, inds = np.unique((times // period) * period, return_index=True)
-    if times_keep[0] < np.min(times):
+    Returns:
+    --------
+    tuple of the bucket start times and the reduced values (with the same
+    trailing shape as vals), or (None, None) if there are fewer than two
+    buckets.
+    """
+    if not isinstance(period, (int, np.integer)):
+        raise ValueError('period must be an integer')
+    if strategy not in reduction_strategies:
+        raise ValueError('unknown reduction strategy')
+    vals = np.asarray(vals)
+
+    # floor the times to the period (np.floor of the quotient is much faster
+    # than the // operator for floats). The times are sorted, so the buckets
+    # start where the floored times change.
+    floored_times = np.floor(times / period) * period
+    inds = np.concatenate(([0], np.flatnonzero(np.diff(floored_times)) + 1))
+    times_keep = floored_times[inds]
+    if times_keep[0] < times[0]:
         times_keep = times_keep[1:]
         inds = inds[1:]
 
     if len(inds) < 2:
         return None, None
     if strategy == 'decimate':
-        vals_keep = vals[inds]  # Could keep with len(inds) == 1, but oh well
-    elif strategy == 'max':
-        vals_keep = []
-        times_keep = times_keep[:-1]
-        for count in range(len(inds) - 1):
-            vals_keep.append(np.max(vals[inds[count]:inds[count + 1]]))
-        vals_keep = np.array(vals_keep)
-    elif strategy == 'mean':
-        vals_keep = []
-        times_keep = times_keep[:-1]
-        for count in range(len(inds) - 1):
-            vals_keep.append(np.mean(vals[inds[count]:inds[count + 1]]))
-        vals_keep = np.array(vals_keep)
-    elif strategy == 'sum':
-        vals_keep = []
-        times_keep = times_keep[:-1]
-        for count in range(len(inds) - 1):
-            vals_keep.append(np.sum(vals[inds[count]:inds[count + 1]]))
-        vals_keep = np.array(vals_keep)
+        # Could keep with len(inds) == 1, but oh well
+        return times_keep, vals[inds]
+
+    # the buckets are vals[inds[i]:inds[i + 1]], the last bucket is dropped
+    times_keep = times_keep[:-1]
+    vals = vals[inds[0]:inds[-1]]
+    starts = inds[:-1] - inds[0]
+    counts = np.diff(inds)
+    if strategy in _ufunc_reductions:
+        vals_keep = _ufunc_reductions[strategy].reduceat(vals, starts, axis=0)
+    elif strategy == 'last':
+        vals_keep = vals[starts + counts - 1]
+    elif strategy == 'median':
+        vals_keep = _segment_median(vals, starts, counts)
     else:
-        raise ValueError('unknown reduction strategy')
+        # broadcast the counts against the trailing axes of vals
+        bucket_counts = counts.reshape((-1,) + (1,) * (vals.ndim - 1))
+        means = np.add.reduceat(vals, starts, axis=0) / bucket_counts
+        if strategy == 'mean':
+            vals_keep = means
+        else:
+            # two pass standard deviation (ddof=0, like np.std)
+            deviations = vals - np.repeat(means, counts, axis=0)
+            vals_keep = np.sqrt(np.add.reduceat(deviations**2, starts, axis=0)
+                                / bucket_counts)
 
     return times_keep, vals_keep
 
@@ -131,8 +193,73 @@ class WeatherData(MCDeclarativeBase):
         return Time(self.time, format='gps')
 
 
+# default length in seconds of the windows fetched by backfill_from_sensors.
+# It is a multiple of all the reduction periods, so windows line up with buckets.
+default_window_seconds = 3600
+
+
+def _check_variables(variables):
+    if variables is None:
+        return list(weather_sensor_dict.keys())
+    if not isinstance(variables, (list, tuple)):
+        variables = [variables]
+    for var in variables:
+        if var not in weather_sensor_dict.keys():
+            raise ValueError('variable must be a key in weather_sensor_dict')
+    return list(variables)
+
+
+def _reduce_history(variable, history):
+    """
+    Reduce a KATPortal sensor history for a variable according to its
+    reduction strategy and period in weather_sensor_dict.
+
+    Returns:
+    --------
+    tuple of numpy arrays of unix times and values, or (None, None) if there
+    is not enough good data
+    """
+    sensor_times = [0.0]
+    sensor_data = []
+    for item in history:
+        # status is usually nominal, but can indicate sensor errors.
+        # Since we can't do anything about those and the data might be bad, ignore them
+        if item.status != 'nominal':
+            continue
+        # skip it if nan is supplied
+        if isnan(float(item.value)):
+            continue
+
+        # the value_timestamp is the sensor timestamp, while the other is
+        # when the recording system got it. The value_timestamp isn't always
+        # present, so test for it
+        if 'value_timestamp' in item._fields:
+            timestamp = item.value_timestamp
+        else:
+            timestamp = item.timestamp
+        if timestamp > sensor_times[-1]:
+            sensor_times.append(timestamp)
+            sensor_data.append(float(item.value))
+    del(sensor_times[0])
+    if not len(sensor_data):
+        return None, None
+
+    reduction = weather_sensor_dict[variable]['reduction']
+    period = weather_sensor_dict[variable]['period']
+    return _reduce_time_vals(np.array(sensor_times), np.array(sensor_data),
+                             period, strategy=reduction)
+
+
+def _get_portal_client(portal_client=None):
+    if portal_client is None:
+        from katportalclient import KATPortalClient
+
+        portal_client = KATPortalClient(katportal_url, on_update_callback=None)
+    return portal_client
+
+
 @tornado.gen.coroutine
-def _helper_create_from_sensors(starttime, stoptime, variables=None):
+def _helper_create_from_sensors(starttime, stoptime, variables=None, portal_client=None):
     """
     Create a list of weather objects from sensor data using tornado server.
 
@@ -145,33 +272,28 @@ def _helper_create_from_sensors(starttime, stoptime, variables=None):
     variable: string
         variable to get history for. Must be a key in weather_sensor_dict,
         defaults to all keys in weather_sensor_dict
+    portal_client: KATPortalClient object
+        client to get the sensor histories from. Defaults to a new client
+        connected to katportal_url.
 
     Returns:
     -----------
     A list of WeatherData objects (only accessible via a yield call)
     """
-    from katportalclient import KATPortalClient
-
     if not isinstance(starttime, Time):
         raise ValueError('starttime must be an astropy Time object')
 
     if not isinstance(stoptime, Time):
         raise ValueError('stoptime must be an astropy Time object')
 
-    if variables is None:
-        variables = weather_sensor_dict.keys()
-    elif not isinstance(variables, (list, tuple)):
-        variables = [variables]
-
+    variables = _check_variables(variables)
     sensor_names = []
     sensor_var_dict = {}
     for var in variables:
-        if var not in weather_sensor_dict.keys():
-            raise ValueError('variable must be a key in weather_sensor_dict')
         sensor_names.append(weather_sensor_dict[var]['sensor_name'])
         sensor_var_dict[weather_sensor_dict[var]['sensor_name']] = var
 
-    portal_client = KATPortalClient(katportal_url, on_update_callback=None)
+    portal_client = _get_portal_client(portal_client)
 
     histories = yield portal_client.sensors_histories(sensor_names, starttime.unix,
                                                       stoptime.unix, timeout_sec=120)
@@ -179,45 +301,115 @@ def _helper_create_from_sensors(starttime, stoptime, variables=None):
     weather_obj_list = []
     for sensor_name, history in histories.items():
         variable = sensor_var_dict[sensor_name]
-        sensor_times = [0.0]
-        sensor_data = []
-        for item in history:
-            # status is usually nominal, but can indicate sensor errors.
-            # Since we can't do anything about those and the data might be bad, ignore them
-            if item.status != 'nominal':
-                continue
-            # skip it if nan is supplied
-            if isnan(float(item.value)):
-                continue
-
-            # the value_timestamp is the sensor timestamp, while the other is
-            # when the recording system got it. The value_timestamp isn't always
-            # present, so test for it
-            if 'value_timestamp' in item._fields:
-                timestamp = item.value_timestamp
-            else:
-                timestamp = item.timestamp
-            if timestamp > sensor_times[-1]:
-                sensor_times.append(timestamp)
-                sensor_data.append(float(item.value))
-        del(sensor_times[0])
-        if len(sensor_data):
-            reduction = weather_sensor_dict[variable]['reduction']
-            period = weather_sensor_dict[variable]['period']
-
-            times_use, values_use = _reduce_time_vals(np.array(sensor_times),
-                                                      np.array(sensor_data),
-                                                      period, strategy=reduction)
-            if times_use is not None:
-                for count, timestamp in enumerate(times_use.tolist()):
-                    time_obj = Time(timestamp, format='unix')
-                    weather_obj_list.append(WeatherData.create(time_obj, variable,
-                                                               values_use[count]))
+        times_use, values_use = _reduce_history(variable, history)
+        if times_use is not None:
+            for count, timestamp in enumerate(times_use.tolist()):
+                time_obj = Time(timestamp, format='unix')
+                weather_obj_list.append(WeatherData.create(time_obj, variable,
+                                                           values_use[count]))
 
     raise tornado.gen.Return(weather_obj_list)
 
 
-def create_from_sensors(starttime, stoptime, variables=None):
+@tornado.gen.coroutine
+def _backfill_variable(session, variable, start, stop, window_seconds,
+                       portal_client, fetch_lock):
+    # fetch, reduce and insert the windows of one variable in time order,
+    # committing each one so an interrupted backfill can resume from the
+    # latest time in the database
+    sensor_name = weather_sensor_dict[variable]['sensor_name']
+    period = weather_sensor_dict[variable]['period']
+    n_rows = 0
+    window_start = floor(start / window_seconds) * window_seconds
+    while window_start < stop:
+        window_stop = window_start + window_seconds
+        keep_start = max(window_start, start)
+        keep_stop = min(window_stop, stop)
+
+        # pad the fetched range by a period so the buckets at the window
+        # edges are complete, then only keep the buckets inside the window
+        with (yield fetch_lock.acquire()):
+            histories = yield portal_client.sensors_histories(
+                [sensor_name], keep_start - period, keep_stop + period, timeout_sec=120)
+        times_use, values_use = _reduce_history(variable, histories.get(sensor_name, []))
+        if times_use is not None:
+            keep = (times_use >= keep_start) & (times_use < keep_stop)
+            if np.any(keep):
+                session.add_weather_data_bulk(Time(times_use[keep], format='unix'),
+                                              variable, values_use[keep],
+                                              ignore_duplicates=True)
+                session.commit()
+                n_rows += int(np.sum(keep))
+
+        window_start = window_stop
+
+    raise tornado.gen.Return(n_rows)
+
+
+@tornado.gen.coroutine
+def backfill_from_sensors(session, starttime, stoptime=None, variables=None,
+                          window_seconds=default_window_seconds, max_concurrent=4,
+                          portal_client=None):
+    """
+    Incrementally add weather data from the KAT sensors to the M&C database.
+
+    Each variable starts from the latest time already in the database for it
+    (or starttime if that is later) and the time range is split into windows
+    of window_seconds. Windows of different variables are fetched concurrently
+    on the current IOLoop, and each window is bulk inserted (skipping rows
+    already present) and committed as it arrives. This keeps memory use
+    bounded for long backfills and lets an interrupted backfill resume where
+    it stopped.
+
+    Parameters:
+    ------------
+    session: MCSession object
+        session to add the data with. It is committed after each window.
+    starttime: astropy time object
+        earliest time to get history for.
+    stoptime: astropy time object
+        time to stop getting history. Defaults to now.
+    variables: string or list of strings
+        variables to get history for. Must be keys in weather_sensor_dict,
+        defaults to all keys in weather_sensor_dict
+    window_seconds: integer
+        length of the windows fetched in one request. Should be a multiple
+        of the reduction periods in weather_sensor_dict.
+    max_concurrent: integer
+        maximum number of sensor history requests in flight at once.
+    portal_client: KATPortalClient object
+        client to get the sensor histories from. Defaults to a new client
+        connected to katportal_url.
+
+    Returns:
+    --------
+    dict giving the number of rows added (or already present) for each
+    variable (only accessible via a yield call)
+    """
+    import tornado.locks
+
+    if not isinstance(starttime, Time):
+        raise ValueError('starttime must be an astropy Time object')
+    if stoptime is None:
+        stoptime = Time.now()
+    elif not isinstance(stoptime, Time):
+        raise ValueError('stoptime must be an astropy Time object')
+    variables = _check_variables(variables)
+    portal_client = _get_portal_client(portal_client)
+
+    high_water = dict((obj.variable, obj.astropy_time.unix)
+                      for obj in session.get_latest_weather())
+    fetch_lock = tornado.locks.Semaphore(max_concurrent)
+    n_rows = yield [_backfill_variable(session, var,
+                                       max(starttime.unix, high_water.get(var, -np.inf)),
+                                       stoptime.unix, window_seconds, portal_client,
+                                       fetch_lock)
+                    for var in variables]
+
+    raise tornado.gen.Return(dict(zip(variables, n_rows)))
+
+
+def create_from_sensors(starttime, stoptime, variables=None, portal_client=None):
     """
     Return a list of weather objects from sensor data.
 
@@ -230,11 +422,14 @@ def create_from_sensors(starttime, stoptime, variables=None):
     variable: string
         variable to get history for. Must be a key in weather_sensor_dict,
         defaults to all keys in weather_sensor_dict
+    portal_client: KATPortalClient object
+        client to get the sensor histories from. Defaults to a new client
+        connected to katportal_url.
 
     Returns:
     -----------
     A list of WeatherData objects
     """
     io_loop = tornado.ioloop.IOLoop.current()
-    return io_loop.run_sync(lambda: _helper_create_from_sensors(starttime, stoptime,
-                                                                variables=variables))
+    return io_loop.run_sync(lambda: _helper_create_from_sensors(
+        starttime, stoptime, variables=variables, portal_client=portal_client))
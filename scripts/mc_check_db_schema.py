@@ -12,13 +12,14 @@ parser = mc.get_mc_argument_parser()
 args = parser.parse_args()
 
 try:
-    db = mc.connect_to_mc_db(args)
+    db = mc.connect_to_mc_db(args, force_validation=True)
 except RuntimeError as e:
     raise SystemExit(str(e))
 
 # If the specified database is in "testing" mode, we won't have actually
 # checked anything yet. It doesn't hurt to double-check if the DB is
-# in production mode, so let's just check again.
+# in production mode, so let's just check again. The forced validation above
+# also refreshes the local schema cache for production databases.
 
 with db.sessionmaker() as session:
     if not is_valid_database(MCDeclarativeBase, session):
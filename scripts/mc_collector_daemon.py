@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Collect ROACH temperatures, autocorrelations, weather and server status
+into M&C from one long-lived process.
+
+The sources and their cadences are set in the "collector" section of
+mc_config.json, see hera_mc.collector. This replaces running
+mc_monitor_roach_temps.py, mc_log_autocorrelations.py, mc_wx.py and
+mc_server_status_daemon.py separately.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import logging
+
+from hera_mc import mc, collector
+
+parser = mc.get_mc_argument_parser()
+parser.description = __doc__
+parser.add_argument('--sources', type=str, nargs='+', default=None,
+                    help='Only run these of the configured sources.')
+parser.add_argument('--duration', type=float, default=None,
+                    help='Stop after this many seconds. Defaults to running until '
+                    'interrupted.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+config = collector.get_collector_config(args.mc_config_path)
+if args.sources is not None:
+    missing = set(args.sources) - set(config.get('sources', {}).keys())
+    if len(missing) > 0:
+        raise ValueError('sources {0} are not in the collector configuration'
+                         .format(sorted(missing)))
+    config['sources'] = dict((name, options) for name, options in config['sources'].items()
+                             if name in args.sources)
+
+db = mc.connect_to_mc_db(args)
+daemon = collector.CollectorDaemon(db, config)
+daemon.run(duration=args.duration)
+daemon.publish_stats()
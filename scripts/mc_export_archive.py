@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Export M&C tables in a time range to time-partitioned columnar files
+(one .npy file per column per partition) for off-site analysis. Read them
+back with hera_mc.archive.ArchiveReader.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+from astropy.time import Time
+
+from hera_mc import mc
+
+parser = mc.get_mc_argument_parser()
+parser.description = __doc__
+parser.add_argument('archive_dir', type=str, help='Directory to write the archive to.')
+parser.add_argument('--tables', type=str, nargs='+',
+                    default=['weather_data', 'roach_temperature', 'autocorrelations',
+                             'ant_metrics'],
+                    help='Tables to export.')
+parser.add_argument('--start', type=str, required=True,
+                    help='Start of the time range, in a format astropy.time.Time '
+                    'understands (e.g. "2018-01-01 00:00:00").')
+parser.add_argument('--stop', type=str, default=None,
+                    help='End of the time range. Defaults to the latest data.')
+parser.add_argument('--partition-days', dest='partition_days', type=float, default=1.,
+                    help='Length of the partitions in days.')
+args = parser.parse_args()
+
+starttime = Time(args.start, scale='utc')
+stoptime = None if args.stop is None else Time(args.stop, scale='utc')
+partition_seconds = int(round(args.partition_days * 86400))
+
+db = mc.connect_to_mc_db(args)
+with db.sessionmaker() as session:
+    for table_name in args.tables:
+        partitions = session.export_archive(table_name, args.archive_dir, starttime,
+                                            stoptime=stoptime,
+                                            partition_seconds=partition_seconds)
+        print('{0}: {1} rows in {2} partitions'.format(
+            table_name, sum(part['nrows'] for part in partitions), len(partitions)))
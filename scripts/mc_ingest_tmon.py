@@ -14,6 +14,7 @@ import LabJackPython
 from time import time, sleep
 
 from hera_mc import mc
+from hera_mc.buffered_writer import BufferedWriter
 
 list_of_registers = range(240, 253, 2)
 list_of_registers += range(96, 109, 2)
@@ -27,6 +28,8 @@ parser.add_argument('--outDir', type=str, default=default_outDir,
                     help='Directory to save temperature files into')
 args = parser.parse_args()
 db = mc.connect_to_mc_db(args)
+# commit the temperatures once a minute without holding up the LabJack readout
+writer = BufferedWriter(db, max_batch_interval=60.)
 
 
 def V2K(vi, number):
@@ -79,25 +82,28 @@ outDir = '/home/obs/TMON/Temperatures/'
 
 d = ue9.UE9()
 
-while True:
-    fileName = '%stemp.%7.5f.txt' % (outDir, getJD())
-    print('Writing to %s' % fileName)
-    f = open(fileName, 'w')
-    file_start_time = time()
-    while(time() - file_start_time < mPerFile * 60.):
-        Ts = None
-        int_start_time = time()
-        while(time() - int_start_time < sPerInt):
-            try:
+try:
+    while True:
+        fileName = '%stemp.%7.5f.txt' % (outDir, getJD())
+        print('Writing to %s' % fileName)
+        f = open(fileName, 'w')
+        file_start_time = time()
+        while(time() - file_start_time < mPerFile * 60.):
+            Ts = None
+            int_start_time = time()
+            while(time() - int_start_time < sPerInt):
                 try:
-                    Ts = aggData(Ts, d, list_of_registers)
-                except(TypeError):
-                    Ts = readTemps(d, list_of_registers)
-            except(KeyboardInterrupt):
-                d.close()
-        f.write("\t".join(["%7.5f" % t for t in Ts]) + "\n")
-        with db.sessionmaker() as session:
-            session.add_paper_temps(Ts[0], Ts[1:])
-        f.flush()
-    f.close()
-d.close()
+                    try:
+                        Ts = aggData(Ts, d, list_of_registers)
+                    except(TypeError):
+                        Ts = readTemps(d, list_of_registers)
+                except(KeyboardInterrupt):
+                    d.close()
+            f.write("\t".join(["%7.5f" % t for t in Ts]) + "\n")
+            writer.add_paper_temps(Ts[0], Ts[1:])
+            f.flush()
+        f.close()
+    d.close()
+finally:
+    # send any readings still queued in the writer
+    writer.close()
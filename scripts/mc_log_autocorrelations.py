@@ -9,74 +9,42 @@ server by the correlator software.
 """
 from __future__ import absolute_import, division, print_function
 
-import datetime
-import numpy as np
-import redis
 import sys
 
 from hera_mc import autocorrelations, mc
 
-
-# Yay hardcoded config settings:
-
-redis_host = 'redishost'
-antnums = xrange(128)
-
-# End of config.
-
-
 parser = mc.get_mc_argument_parser()
 parser.add_argument('--debug', action='store_true',
                     help='Print out debugging information.')
 parser.add_argument('--noop', action='store_true',
                     help='Do not actually save information to the database.')
+parser.add_argument('--spectra-decimation', dest='spectra_decimation', type=int, default=None,
+                    help='Also save the spectra, averaging this many channels together.')
+parser.add_argument('--spectra-codec', dest='spectra_codec', type=str, default='zlib',
+                    choices=autocorrelations.spectrum_codecs,
+                    help='Compression for the saved spectra. "none" takes more space '
+                    'but is faster to read back.')
 args = parser.parse_args()
 db = mc.connect_to_mc_db(args)
-n_failures = 0
-
-with db.sessionmaker() as dbsession:
-    rsession = redis.Redis(redis_host)
 
-    # We put an identical timestamp for all records. The records from the
-    # redis server also include timestamps (as JDs), but I think it's actually
-    # preferable to use our own clock here. Note that we also ensure that the
-    # records grabbed in one execution of this script have identical
-    # timestamps, which is a nice property.
-    time = datetime.datetime.utcnow()
+# We put an identical timestamp for all records. The records from the redis
+# server also include timestamps (as JDs), but I think it's actually
+# preferable to use our own clock here. Note that we also ensure that the
+# records grabbed in one execution of this script have identical timestamps,
+# which is a nice property.
 
-    for ant in antnums:
-        for pol in 'xy':
-            try:
-                data = rsession.hgetall('visdata://%d/%d/%s%s' % (ant, ant, pol, pol))
-            except Exception as e:
-                print('failed to get autocorrelation %d%s: %s (%s)' % (ant, pol, e, e.__class__.__name__),
-                      file=sys.stderr)
-                n_failures += 1
-                continue
-
-            data = data.get('data')
-            if data is None:
-                print('failed to get autocorrelation %d%s: no "data" item?' % (ant, pol),
-                      file=sys.stderr)
-                n_failures += 1
-                continue
-
-            data = np.fromstring(data, dtype=np.float32)
-
-            # For now, we just compute the median:
-
-            ac = autocorrelations.Autocorrelations()
-            ac.time = time
-            ac.antnum = ant
-            ac.polarization = pol
-            ac.measurement_type = autocorrelations.MeasurementTypes.median
-            ac.value = np.asscalar(np.median(data))  # must turn np.float32 into plain Python float
-
-            if args.debug:
-                print(data.shape, repr(ac))
-            if not args.noop:
-                dbsession.add(ac)
-
-if n_failures:
-    print('error: %d fetches failed' % n_failures, file=sys.stderr)
+with db.sessionmaker() as dbsession:
+    if args.noop:
+        autos, failures = autocorrelations.create_from_redis()
+        if args.debug:
+            for ac in autos:
+                print(repr(ac))
+    else:
+        n_records, failures = dbsession.add_autocorrelations_from_redis(
+            spectra_decimation=args.spectra_decimation, spectra_codec=args.spectra_codec)
+        if args.debug:
+            print('added %d autocorrelation records' % n_records)
+
+if len(failures):
+    print('error: %d fetches failed' % len(failures), file=sys.stderr)
     sys.exit(1)
@@ -7,7 +7,8 @@
 
 The temperatures cycle out of the Redis store every minute, so cron can't
 sample quickly enough (and starting a new process every minute feels like a
-bit much).
+bit much). One Redis connection is kept open, and only the ROACHes whose
+timestamps changed since the last poll are written, so short cadences are cheap.
 
 """
 from __future__ import absolute_import, division, print_function
@@ -18,20 +19,24 @@ import time
 import traceback
 
 from hera_mc import mc
+from hera_mc.roach import RoachTemperatureCollector
 
 MONITORING_INTERVAL = 45  # seconds
 
 parser = mc.get_mc_argument_parser()
+parser.add_argument('--cadence', type=float, default=MONITORING_INTERVAL,
+                    help='Seconds between polls of Redis.')
 args = parser.parse_args()
 db = mc.connect_to_mc_db(args)
+collector = RoachTemperatureCollector()
 
 with db.sessionmaker() as session:
     try:
         while True:
-            time.sleep(MONITORING_INTERVAL)
+            time.sleep(args.cadence)
 
             try:
-                session.add_roach_temperature_from_redis()
+                collector.add_to_session(session)
             except Exception as e:
                 print('%s -- error adding ROACH temperatures' % time.asctime(), file=sys.stderr)
                 traceback.print_exc(file=sys.stderr)
@@ -39,6 +44,7 @@ with db.sessionmaker() as session:
 
             try:
                 session.commit()
+                collector.confirm()
             except sqlalchemy.exc.SQLAlchemyError as e:
                 print('%s -- SQL error committing new temperature data' % time.asctime(), file=sys.stderr)
                 traceback.print_exc(file=sys.stderr)
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Dump the rows of an M&C table in a time range as CSV, newline-delimited
+JSON or binary numpy arrays.
+
+Rows are streamed from the database in chunks, so output starts immediately
+and memory use stays constant however long the time range. The npy format
+writes one structured array per chunk; read them back by calling numpy.load
+on the open file until it reaches the end of the file.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import sys
+import csv
+import json
+import errno
+import datetime
+
+import numpy as np
+import six
+from astropy.time import Time
+
+from hera_mc import mc, get_table_class
+
+
+def parse_time(value):
+    """Parse a time given as gps seconds or in a format astropy understands."""
+    try:
+        return Time(float(value), format='gps')
+    except ValueError:
+        return Time(value, scale='utc')
+
+
+def parse_filters(table_name, filter_args):
+    """Turn column=value arguments into a dict, converting the values to the column types."""
+    table = get_table_class(table_name).__table__
+    filters = {}
+    for arg in filter_args:
+        if '=' not in arg:
+            raise ValueError('filters must be given as column=value, not {0!r}'.format(arg))
+        name, value = arg.split('=', 1)
+        if name not in table.columns:
+            raise ValueError('no column {0!r} in table {1}'.format(name, table_name))
+        try:
+            python_type = table.columns[name].type.python_type
+        except NotImplementedError:
+            python_type = str
+        if python_type in (int, float):
+            value = python_type(value)
+        filters[name] = value
+    return filters
+
+
+def to_python(value):
+    """Convert a numpy value to a JSON/CSV friendly python value."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def to_structured(arrays, columns):
+    """
+    Pack a chunk into a structured array, converting object columns. Nulls
+    become '' in string columns, NaT in DateTime columns and NaN otherwise.
+    """
+    fields = []
+    for name in columns:
+        values = arrays[name]
+        if values.dtype == object:
+            if all(val is None or isinstance(val, six.string_types) for val in values):
+                values = np.array(['' if val is None else val for val in values],
+                                  dtype=six.text_type)
+            elif all(val is None or isinstance(val, datetime.datetime) for val in values):
+                values = np.array([np.datetime64('NaT') if val is None else val
+                                   for val in values], dtype='datetime64[us]')
+            else:
+                values = np.array([np.nan if val is None else val for val in values],
+                                  dtype=np.float64)
+        fields.append(values)
+    out = np.empty(len(fields[0]), dtype=[(str(name), values.dtype)
+                                          for name, values in zip(columns, fields)])
+    for name, values in zip(columns, fields):
+        out[str(name)] = values
+    return out
+
+
+def write_chunks(chunks, columns, out_format, out_file):
+    """Write chunks of rows (dicts of numpy arrays) to a file as they arrive."""
+    if out_format == 'csv':
+        writer = csv.writer(out_file)
+        writer.writerow(columns)
+
+    for arrays in chunks:
+        if out_format == 'npy':
+            np.save(out_file, to_structured(arrays, columns))
+        else:
+            lists = [[to_python(val) for val in arrays[name].tolist()] for name in columns]
+            if out_format == 'csv':
+                writer.writerows([['' if val is None else val for val in row]
+                                  for row in zip(*lists)])
+            else:
+                for row in zip(*lists):
+                    out_file.write(json.dumps(dict(zip(columns, row))) + '\n')
+        out_file.flush()
+
+
+if __name__ == '__main__':
+    parser = mc.get_mc_argument_parser()
+    parser.description = __doc__
+    parser.add_argument('table', type=str, help='Name of the table to dump, e.g. weather_data.')
+    parser.add_argument('--start', type=str, required=True,
+                        help='Start of the time range, as gps seconds or in a format '
+                        'astropy.time.Time understands (e.g. "2018-01-01 00:00:00").')
+    parser.add_argument('--stop', type=str, default=None,
+                        help='End of the time range. Defaults to the latest data.')
+    parser.add_argument('--filter', dest='filters', type=str, nargs='+', default=[],
+                        help='Only dump rows with these column values, given as '
+                        'column=value (e.g. variable=wind_speed).')
+    parser.add_argument('--columns', type=str, nargs='+', default=None,
+                        help='Columns to dump. Defaults to all of them.')
+    parser.add_argument('--format', dest='out_format', type=str, default='csv',
+                        choices=['csv', 'ndjson', 'npy'], help='Output format.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to write to. Defaults to standard output.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=10000,
+                        help='Number of rows read from the database at a time.')
+    args = parser.parse_args()
+
+    starttime = parse_time(args.start)
+    stoptime = None if args.stop is None else parse_time(args.stop)
+    filters = parse_filters(args.table, args.filters)
+    columns = args.columns
+    if columns is None:
+        columns = get_table_class(args.table).__table__.columns.keys()
+
+    if args.output is not None:
+        out_file = open(args.output, 'wb' if args.out_format == 'npy' else 'w')
+    elif args.out_format == 'npy' and six.PY3:
+        out_file = sys.stdout.buffer
+    else:
+        out_file = sys.stdout
+
+    db = mc.connect_to_mc_db(args)
+    with db.sessionmaker() as session:
+        chunks = session.iter_table(args.table, starttime, stoptime=stoptime,
+                                    filters=filters, columns=columns,
+                                    chunk_size=args.chunk_size)
+        try:
+            write_chunks(chunks, columns, args.out_format, out_file)
+        except IOError as err:
+            # e.g. piped into head
+            if err.errno != errno.EPIPE:
+                raise
+        finally:
+            if args.output is not None:
+                out_file.close()
@@ -0,0 +1,44 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Print the slowest M&C database call sites from dumped query statistics.
+
+Processes dump their statistics when the database entry in mc_config.json has
+`instrument_queries` set to true, a `query_stats_interval` and a
+`query_stats_file`. The latest dump of each
+process is used and the call sites are combined across processes.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+
+from hera_mc.query_stats import (read_query_stats_files, default_query_stats_file,
+                                 sort_keys, sort_summary)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*', default=[default_query_stats_file],
+                        help='Query stats files to read, defaults to {0}'
+                        .format(default_query_stats_file))
+    parser.add_argument('-n', '--top', type=int, default=10,
+                        help='Number of call sites to show.')
+    parser.add_argument('--sort', type=str, default='mean_time', choices=sort_keys,
+                        help='Quantity to rank the call sites by.')
+    parser.add_argument('--statements', action='store_true',
+                        help='Also print the slowest statement for each call site.')
+    args = parser.parse_args()
+
+    sites = sort_summary(read_query_stats_files(args.files), n=args.top, sort_by=args.sort)
+
+    print('{:<50s} {:>9s} {:>11s} {:>10s} {:>10s} {:>10s}'.format(
+        'call site', 'count', 'total s', 'mean ms', 'max ms', 'rows'))
+    for site in sites:
+        print('{:<50s} {:>9d} {:>11.3f} {:>10.3f} {:>10.3f} {:>10d}'.format(
+            site['call_site'], site['count'], site['total_time'],
+            site['mean_time'] * 1e3, site['max_time'] * 1e3, site['rows']))
+        if args.statements:
+            print('    ' + ' '.join(site['statement'].split()))
@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+# -*- mode: python; coding: utf-8 -*-
+# Copyright 2018 the HERA Collaboration
+# Licensed under the 2-clause BSD license.
+
+"""Roll up old rows of the high-volume telemetry tables into the
+telemetry_rollup table and remove them. Meant to be run daily, e.g. from cron.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+from hera_mc import mc, retention
+
+parser = mc.get_mc_argument_parser()
+parser.description = __doc__
+parser.add_argument('--raw-days', dest='raw_days', type=float,
+                    default=retention.default_raw_retention_days,
+                    help='Age in days after which raw rows are rolled up and removed.')
+parser.add_argument('--tables', type=str, nargs='+', default=None,
+                    choices=sorted(retention.retention_tables.keys()),
+                    help='Tables to process, defaults to all of them.')
+parser.add_argument('--keep-raw', dest='keep_raw', action='store_true',
+                    help='Compute the rollups but do not remove the raw rows.')
+parser.add_argument('--archive-dir', dest='archive_dir', type=str, default=None,
+                    help='Save the raw rows to .npz files in this directory before '
+                    'removing them.')
+args = parser.parse_args()
+
+db = mc.connect_to_mc_db(args)
+with db.sessionmaker() as session:
+    results = session.apply_retention(raw_retention_days=args.raw_days,
+                                      tables=args.tables, keep_raw=args.keep_raw,
+                                      archive_dir=args.archive_dir)
+
+for table_name in sorted(results.keys()):
+    print('{0}: {rollups} rollup records, {deleted} raw rows removed, '
+          '{expired} rollup records expired'.format(table_name, **results[table_name]))
@@ -23,6 +23,9 @@ if __name__ == '__main__':
     parser.add_argument('--stop-date', dest='stop_date', help="Stop date YYYY/MM/DD", default=None)
     parser.add_argument('--stop-time', dest='stop_time', help="Stop time in HH:MM", default='7:00')
     parser.add_argument('--add-to-db', dest='add_to_db', help="Flag to actually write to database.", action='store_true')
+    parser.add_argument('--incremental', action='store_true',
+                        help="With --add-to-db, resume from the latest data in the database for "
+                        "each variable and commit in windows (for long backfills).")
     parser.add_argument('-l', '--last-period', dest='last_period', default=None,
                         help="Time period from present for data (in minutes).  If present ignores start/stop.")
 
@@ -48,8 +51,11 @@ if __name__ == '__main__':
 
         db = mc.connect_to_mc_db(args)
         session = db.sessionmaker()
-        session.add_weather_data_from_sensors(start_time, stop_time, variables)
-        session.commit()
+        if args.incremental:
+            session.backfill_weather_data_from_sensors(start_time, stop_time, variables)
+        else:
+            session.add_weather_data_from_sensors(start_time, stop_time, variables)
+            session.commit()
     else:
         from hera_mc import weather
         wx = weather.create_from_sensors(start_time, stop_time, variables)